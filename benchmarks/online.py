@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Compares changing a large table in place with rebuilding it online, on a
+synthetic table in a SQLite database file: a model with a few columns and
+--rows rows, from which a migration drops a column (which makes SQLite
+rewrite the table).
+
+While the change runs, a second thread keeps inserting rows into the
+table through its own connection, and the longest any of its writes had
+to wait is reported alongside the change's total time. In place, writes
+wait for the whole rewrite; online, only for a chunk of rows (and the
+final swap, which drops the old table). SQLite lets whoever asks first
+have the database, so without --throttle the copy can starve the writer
+between chunks.
+
+Usage: benchmarks/online.py [options]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+
+directory = tempfile.mkdtemp()
+
+settings.configure(
+    DATABASES = {"default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(directory, "online.db"),
+        "OPTIONS": {"timeout": 3600},
+    }},
+    INSTALLED_APPS = ["migrations"],
+    USE_TZ = True,
+)
+
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from migrations.actions import CreateModel, DeleteField
+from migrations.loader import Loader
+from migrations.migration import Migration, RootMigration
+from migrations.migrator import Migrator
+from migrations.online import OnlineSchemaChanger
+from migrations.state import render_cache
+
+
+def make_loader():
+    "Returns a loader for a model and a migration dropping one of its columns"
+    loader = Loader({})
+    loader.add_migration(RootMigration("bench"))
+    for name, actions in [
+        ("0001_initial", [CreateModel("bench", "Row", [
+            ("name", models.CharField(max_length=50)),
+            ("value", models.IntegerField()),
+            ("extra", models.IntegerField(null=True)),
+        ], [])]),
+        ("0002_drop_extra", [DeleteField("bench", "Row", "extra")]),
+    ]:
+        migration = Migration("bench", name)
+        migration.dependencies = []
+        migration.actions = actions
+        loader.add_migration(migration)
+    loader.calculate_dependencies()
+    return loader
+
+
+def fill(rows, chunk=100000):
+    "Creates the table and fills it with rows"
+    if os.path.exists(settings.DATABASES["default"]["NAME"]):
+        connection.close()
+        os.remove(settings.DATABASES["default"]["NAME"])
+    render_cache.clear()
+    call_command("syncdb", interactive=False, verbosity=0)
+    migrator = Migrator(make_loader())
+    migrator.execute_plan(migrator.calculate_plan("bench", "0001"))
+    cursor = connection.cursor()
+    for start in xrange(0, rows, chunk):
+        cursor.executemany(
+            "INSERT INTO bench_row (name, value, extra) VALUES (%s, %s, %s)",
+            [("row %i" % i, i, i) for i in xrange(start, min(start + chunk, rows))],
+        )
+        transaction.commit_unless_managed()
+
+
+class Writer(threading.Thread):
+    "Inserts rows until stopped, noting the longest any insert took"
+
+    def __init__(self):
+        super(Writer, self).__init__()
+        self.daemon = True
+        self.stopped = threading.Event()
+        self.writes = 0
+        self.longest = 0.0
+
+    def run(self):
+        cursor = connection.cursor()
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                cursor.execute("INSERT INTO bench_row (name, value) VALUES ('written', 0)")
+                transaction.commit_unless_managed()
+            except Exception:
+                # The table can go missing for a moment as it's swapped
+                transaction.rollback_unless_managed()
+                continue
+            self.longest = max(self.longest, time.time() - started)
+            self.writes += 1
+            time.sleep(0.01)
+        connection.close()
+
+
+def run(mode, rows, chunk_size, throttle):
+    "Fills the table and changes it, returning (seconds, longest write, writes)"
+    fill(rows)
+    online = OnlineSchemaChanger(chunk_size, throttle) if mode == "online" else None
+    migrator = Migrator(make_loader(), online=online)
+    plan = migrator.calculate_plan()
+    writer = Writer()
+    writer.start()
+    time.sleep(0.1)
+    started = time.time()
+    migrator.execute_plan(plan)
+    elapsed = time.time() - started
+    writer.stopped.set()
+    writer.join()
+    return elapsed, writer.longest, writer.writes
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--rows", type="int", default=2000000)
+    parser.add_option("--chunk-size", type="int", default=10000, help="Primary keys copied per chunk online.")
+    parser.add_option("--throttle", type="float", default=0.01, help="Seconds to pause between chunks online.")
+    parser.add_option("--mode", default="both", choices=["inplace", "online", "both"])
+    options, args = parser.parse_args()
+    modes = ["inplace", "online"] if options.mode == "both" else [options.mode]
+    try:
+        print "Table: %i rows, chunks of %i, throttle %ss" % (options.rows, options.chunk_size, options.throttle)
+        print "%-10s %10s %14s %8s" % ("Mode", "Time", "Longest write", "Writes")
+        for mode in modes:
+            elapsed, longest, writes = run(mode, options.rows, options.chunk_size, options.throttle)
+            print "%-10s %9.3fs %13.3fs %8i" % (mode, elapsed, longest, writes)
+    finally:
+        connection.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
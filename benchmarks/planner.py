@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Times the dependency planner on synthetic migration graphs: a number of
+apps, each a chain of migrations, with some migrations also depending on
+a random earlier migration in another app.
+
+Compares the iterative planner against the recursive generator walk it
+replaced (kept here as legacy_depends) - one plan for every app's top
+migration, the way an all-apps migrate plans.
+
+Usage: benchmarks/planner.py [apps] [migrations_per_app] [cross_density]
+
+The legacy walk is exponential in the number of paths through the graph,
+so it takes a very long time as cross_density rises much above 0.02.
+"""
+
+import os
+import sys
+import time
+import random
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from migrations.dependencies import depends, OrderedChildren, SortedSet
+
+
+def legacy_depends(target, get_children):
+    "The recursive-generator planner, for comparison"
+    return list(SortedSet(reversed(list(legacy_flatten(legacy_dfs(target, get_children, []))))))
+
+
+def legacy_dfs(start, get_children, path):
+    if start in path:
+        raise ValueError("Circular dependency")
+    path.append(start)
+    yield start
+    children = sorted(get_children(start), key=lambda x: str(x))
+    if children:
+        yield (legacy_dfs(n, get_children, path) for n in children)
+    path.pop()
+
+
+def legacy_flatten(*stack):
+    stack = deque(stack)
+    while stack:
+        try:
+            x = stack[0].next()
+        except AttributeError:
+            stack[0] = iter(stack[0])
+            x = stack[0].next()
+        except StopIteration:
+            stack.popleft()
+            continue
+        if hasattr(x, '__iter__') and not isinstance(x, tuple):
+            stack.appendleft(x)
+        else:
+            yield x
+
+
+def make_graph(apps, per_app, density, seed=0):
+    "Returns (links, tops) for a synthetic graph of (app, number) nodes"
+    rand = random.Random(seed)
+    links = {}
+    for app in range(apps):
+        for number in range(1, per_app):
+            children = [(app, number - 1)]
+            if app and rand.random() < density:
+                children.append((rand.randrange(app), rand.randrange(per_app)))
+            links[(app, number)] = children
+    return links, [(app, per_app - 1) for app in range(apps)]
+
+
+def plan_all(planner, links, tops):
+    "Plans every top node in turn, skipping already-planned nodes"
+    planned = set()
+    plan = []
+    for top in tops:
+        for node in planner(top):
+            if node not in planned:
+                planned.add(node)
+                plan.append(node)
+    return plan
+
+
+def main(apps=100, per_app=100, density=0.02):
+    links, tops = make_graph(apps, per_app, density)
+    print "Graph: %i apps x %i migrations, cross-app density %s" % (apps, per_app, density)
+    # New planner, with its shared seen set and cached child ordering
+    start = time.time()
+    seen = set()
+    children = OrderedChildren(lambda x: links.get(x, []))
+    new_plan = plan_all(lambda top: depends(top, children, seen), links, tops)
+    print "Iterative planner: %.3fs" % (time.time() - start)
+    # The legacy planner re-walks shared ancestry for every target
+    start = time.time()
+    legacy_plan = plan_all(lambda top: legacy_depends(top, lambda x: links.get(x, [])), links, tops)
+    print "Legacy planner:    %.3fs" % (time.time() - start)
+    if new_plan != legacy_plan:
+        print "WARNING: plans differ!"
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        apps = int(args[0]) if len(args) > 0 else 100,
+        per_app = int(args[1]) if len(args) > 1 else 100,
+        density = float(args[2]) if len(args) > 2 else 0.02,
+    )
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Times the main phases of a migration run on a synthetic project: a number
+of apps, each with a chain of migrations written out as real
+.migration.py files, some of them depending on a migration in an earlier
+app. Each migration after an app's first has one action, picked from
+CreateModel, CreateField and AlterModelOption according to the mix. The
+files can be Python or declarative (--format json) migrations.
+
+The phases timed are Loader.load_all, calculate_dependencies, planning
+every app's top migration, loading the migrations' actions, working out
+their states (plan_action_states) and a full execute_plan against an
+in-memory SQLite database. Each is the best of --repeat runs.
+
+Results can be saved as JSON with --output, and compared against an
+earlier run's file with --compare, so regressions show up between
+versions.
+
+Usage: benchmarks/suite.py [options]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+
+settings.configure(
+    DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    INSTALLED_APPS = ["migrations"],
+    USE_TZ = True,
+)
+
+from django.core.management import call_command
+from django.db import connections
+from migrations.loader import Loader
+from migrations.migrator import Migrator
+from migrations.state import render_cache
+
+
+PHASES = ["load_all", "calculate_dependencies", "plan", "load_actions", "action_states", "execute_plan"]
+
+HEADER = """from migrations.api import *
+
+
+class Migration(BaseMigration):
+
+"""
+
+
+def make_project(directory, apps, per_app, density, mix, seed=0, format="py"):
+    """
+    Writes the synthetic project's migration files into directory, as
+    Python (format "py") or declarative (format "json") migrations, and
+    returns the {app label: migrations dir} map for a Loader.
+    """
+    rand = random.Random(seed)
+    kinds = [kind for kind, weight in zip(["model", "field", "option"], mix) for _ in range(weight)]
+    result = {}
+    for app in range(apps):
+        app_label = "app%03i" % app
+        app_dir = result[app_label] = os.path.join(directory, app_label)
+        os.makedirs(app_dir)
+        models = []
+        fields = 0
+        for number in range(1, per_app + 1):
+            dependencies = []
+            if app and rand.random() < density:
+                dependencies.append(("app%03i" % rand.randrange(app), "%04i_auto" % rand.randint(1, per_app)))
+            kind = rand.choice(kinds) if models else "model"
+            if kind == "model":
+                models.append("Model%i" % len(models))
+                action = {
+                    "action": "CreateModel",
+                    "name": models[-1],
+                    "fields": [["name", ["django.db.models.fields.CharField", [], {"max_length": 100}]]],
+                }
+            elif kind == "field":
+                fields += 1
+                action = {
+                    "action": "CreateField",
+                    "model_name": rand.choice(models),
+                    "name": "field%i" % fields,
+                    "field": ["django.db.models.fields.IntegerField", [], {"null": True}],
+                }
+            else:
+                action = {
+                    "action": "AlterModelOption",
+                    "model_name": rand.choice(models),
+                    "name": "verbose_name",
+                    "value": "version %i" % number,
+                }
+            if format == "json":
+                source = json.dumps({"dependencies": dependencies, "actions": [action]}, indent=4)
+            else:
+                source = python_source(dependencies, action)
+            with open(os.path.join(app_dir, "%04i_auto.migration.%s" % (number, format)), "w") as fh:
+                fh.write(source)
+    return result
+
+
+def python_source(dependencies, action):
+    "Returns a Python migration file equivalent to a declarative one"
+    action = dict(action)
+    lines = ["        %s(" % action.pop("action")]
+    for key, value in sorted(action.items()):
+        if key == "field":
+            value = "Field(%r, %r, %r)" % tuple(value)
+        elif key == "fields":
+            value = "[%s]" % ", ".join("(%r, Field(%r, %r, %r))" % ((name, ) + tuple(field)) for name, field in value)
+        else:
+            value = repr(value)
+        lines.append("            %s = %s," % (key, value))
+    lines.append("        ),")
+    source = HEADER
+    if dependencies:
+        source += "    dependencies = %r\n\n" % dependencies
+    return source + "    actions = [\n" + "\n".join(lines) + "\n    ]\n"
+
+
+def reset_database():
+    "Gives the default connection a fresh, empty in-memory database"
+    # close() leaves in-memory databases open, so go underneath it
+    connection = connections["default"]
+    if connection.connection is not None:
+        connection.connection.close()
+        connection.connection = None
+    call_command("syncdb", interactive=False, verbosity=0)
+
+
+def run(apps):
+    "Runs every phase once, returning {phase: seconds}"
+    timings = {}
+    render_cache.clear()
+    reset_database()
+    def timed(phase, function, *args):
+        start = time.time()
+        result = function(*args)
+        timings[phase] = time.time() - start
+        return result
+    loader = Loader(apps)
+    timed("load_all", loader.load_all)
+    timed("calculate_dependencies", loader.calculate_dependencies)
+    targets = [loader.get_top_migration(app_label) for app_label in sorted(loader.migrations)]
+    plan = timed("plan", loader.plan, targets, set())
+    timed("load_actions", lambda: [migration.actions for forwards, migration in plan])
+    timed("action_states", lambda: list(loader.plan_action_states(plan)))
+    render_cache.clear()
+    timed("execute_plan", Migrator(loader, batch_size=None).execute_plan, plan)
+    return timings
+
+
+def compare(results, previous):
+    "Prints each phase's time against an earlier run's"
+    if previous["parameters"] != results["parameters"]:
+        print "WARNING: the runs being compared used different parameters."
+    print "%-24s %10s %10s %8s" % ("Phase", "Before", "After", "Change")
+    for phase in PHASES:
+        before, after = previous["timings"].get(phase), results["timings"][phase]
+        if before:
+            print "%-24s %9.3fs %9.3fs %+7.1f%%" % (phase, before, after, (after - before) / before * 100)
+        else:
+            print "%-24s %10s %9.3fs" % (phase, "-", after)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--apps", type="int", default=20)
+    parser.add_option("--migrations", type="int", default=50, help="Migrations per app.")
+    parser.add_option("--density", type="float", default=0.1,
+        help="Chance of each migration depending on one in an earlier app.")
+    parser.add_option("--mix", default="1,4,2",
+        help="Relative weights of CreateModel, CreateField and AlterModelOption actions.")
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--seed", type="int", default=0)
+    parser.add_option("--format", default="py", choices=["py", "json"],
+        help="Write Python (py) or declarative (json) migration files.")
+    parser.add_option("--output", help="Save the results to this JSON file.")
+    parser.add_option("--compare", help="Compare the results with those saved in this JSON file.")
+    options, args = parser.parse_args()
+    mix = [int(weight) for weight in options.mix.split(",")]
+    directory = tempfile.mkdtemp()
+    try:
+        apps = make_project(
+            directory,
+            options.apps,
+            options.migrations,
+            options.density,
+            mix,
+            options.seed,
+            options.format,
+        )
+        runs = [run(apps) for _ in range(options.repeat)]
+    finally:
+        shutil.rmtree(directory)
+    results = {
+        "parameters": {
+            "apps": options.apps,
+            "migrations": options.migrations,
+            "density": options.density,
+            "mix": mix,
+            "seed": options.seed,
+            "format": options.format,
+        },
+        "python": platform.python_version(),
+        "timings": dict((phase, min(timings[phase] for timings in runs)) for phase in PHASES),
+    }
+    print "Project: %i apps x %i %s migrations, cross-app density %s, mix %s" % (
+        options.apps, options.migrations, options.format, options.density, options.mix,
+    )
+    for phase in PHASES:
+        print "%-24s %9.3fs" % (phase, results["timings"][phase])
+    if options.compare:
+        with open(options.compare) as fh:
+            compare(results, json.load(fh))
+    if options.output:
+        with open(options.output, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
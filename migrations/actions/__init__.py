@@ -6,3 +6,4 @@ operations
 
 from .models import CreateModel, DeleteModel, AlterModelOption, AlterModelBases
 from .fields import CreateField, DeleteField
+from .data import RunBatches
@@ -1,10 +1,21 @@
 class Action(object):
     "Base class for actions"
 
+    # Actions that commit as they go set this to False, so they're never
+    # run inside a transaction of the migrator's
+    atomic = True
+
     def alter_state(self, project_state):
         "Mutates the project_state with the changes this Action represents"
         raise NotImplementedError()
 
-    def alter_database(self, from_state, to_state, database, forwards):
-        "Run to alter the database. Should call Django's alteration backends directly."
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Run to alter the database, through the given SchemaEditor."
         raise NotImplementedError()
+
+    def alter_table_online(self, from_state, to_state, editor):
+        "Has the editor rebuild the model's table online, from its from_state form to its to_state one"
+        editor.change_table(
+            from_state.get_model(self.app_label, self.model_name).render(from_state),
+            to_state.get_model(self.app_label, self.model_name).render(to_state),
+        )
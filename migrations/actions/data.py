@@ -0,0 +1,208 @@
+"""
+Actions are used to model the set of operations which migrations
+request, and are responsible for changing AppState / emitting database
+operations
+"""
+
+import time
+import multiprocessing
+from django.db import connections, transaction
+from django.db.models import Min, Max
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.importlib import import_module
+from ..exceptions import MigrationError, DataMigrationError
+from ..models import DataMigrationCheckpoint
+from .base import Action
+
+
+class RunBatches(Action):
+    """
+    Runs a function over a model's rows, as the model is at this point in
+    the migrations, batch_size rows at a time in primary key order. The
+    function is called as function(model, objects, database) for each
+    batch, and can be a dotted path to one. reverse_function, if given, is
+    run the same way going backwards; otherwise going backwards does
+    nothing.
+
+    Each batch runs in a transaction, along with saving how far the run
+    has got in DataMigrationCheckpoint, under name; if the run is
+    interrupted, running it again carries on after the last batch that
+    finished. Checkpoints are removed once the whole table is done.
+
+    sleep is a pause, in seconds, between batches. With workers more than
+    one, an integer primary key range is split into that many parts, each
+    run by its own process (or one after the other where that can't be
+    done: inside a transaction, or on an in-memory database).
+
+    As batches commit as they go, the action can't be run inside a
+    transaction, or written out as SQL.
+    """
+
+    atomic = False
+
+    def __init__(self, app_label, model_name, function, name, reverse_function=None,
+                 batch_size=1000, sleep=0, workers=1):
+        self.app_label = app_label
+        self.model_name = model_name
+        self.function = function
+        self.name = name
+        self.reverse_function = reverse_function
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.workers = workers
+
+    def __repr__(self):
+        return "<RunBatches %s.%s %s>" % (self.app_label, self.model_name, self.name)
+
+    def __str__(self):
+        return "Run %s over %s.%s" % (self.name, self.app_label, self.model_name)
+
+    def alter_state(self, project_state):
+        "Data migrations don't change the state"
+        pass
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Runs the function (or reverse_function, backwards) over the model's rows"
+        function = self.function if forwards else self.reverse_function
+        if function is None:
+            return
+        if editor.collect_sql:
+            raise MigrationError("Data migrations can't be written out as SQL")
+        if transaction.is_managed(using=editor.database):
+            raise MigrationError("Data migrations commit each batch, so can't be run inside a transaction")
+        # The function needs the table as the state says it is
+        editor.flush()
+        if isinstance(function, basestring):
+            module_name, function_name = function.rsplit(".", 1)
+            function = getattr(import_module(module_name), function_name)
+        model = to_state.get_model(self.app_label, self.model_name).render(to_state)
+        name = "%s.%s%s" % (self.app_label, self.name, "" if forwards else ".reverse")
+        checkpoints = [c for c in self.checkpoints(model, name, editor.database) if not c.done]
+        if len(checkpoints) > 1 and self.can_fork(editor.database):
+            self.run_parallel(model, function, checkpoints, editor.database)
+        else:
+            for checkpoint in checkpoints:
+                self.run_partition(model, function, checkpoint, editor.database)
+        with transaction.commit_on_success(using=editor.database):
+            DataMigrationCheckpoint.objects.using(editor.database).filter(name=name).delete()
+
+    def checkpoints(self, model, name, database):
+        """
+        Returns the checkpoints for a run, splitting the table between
+        self.workers of them if the run is only just starting.
+        """
+        manager = DataMigrationCheckpoint.objects.using(database)
+        checkpoints = list(manager.filter(name=name).order_by("partition"))
+        if checkpoints:
+            return checkpoints
+        bounds = [(None, None)]
+        if self.workers > 1:
+            limits = model._default_manager.using(database).aggregate(low=Min("pk"), high=Max("pk"))
+            low, high = limits["low"], limits["high"]
+            if isinstance(low, (int, long)) and high > low:
+                step = (high - low) // self.workers + 1
+                ends = [low + step * i - 1 for i in range(1, self.workers)]
+                bounds = zip([None] + ends, ends + [None])
+        now = timezone.now()
+        checkpoints = [
+            DataMigrationCheckpoint(
+                name = name,
+                partition = i,
+                last_pk = None if last_pk is None else force_text(last_pk),
+                end_pk = None if end_pk is None else force_text(end_pk),
+                updated = now,
+            )
+            for i, (last_pk, end_pk) in enumerate(bounds)
+        ]
+        with transaction.commit_on_success(using=database):
+            manager.bulk_create(checkpoints)
+        return list(manager.filter(name=name).order_by("partition"))
+
+    def run_partition(self, model, function, checkpoint, database):
+        "Runs the function over the rows after the checkpoint, up to its end"
+        pk = model._meta.pk
+        queryset = model._default_manager.using(database).order_by("pk")
+        if checkpoint.end_pk is not None:
+            queryset = queryset.filter(pk__lte=pk.to_python(checkpoint.end_pk))
+        while True:
+            batch = queryset
+            if checkpoint.last_pk is not None:
+                batch = batch.filter(pk__gt=pk.to_python(checkpoint.last_pk))
+            objects = list(batch[:self.batch_size])
+            with transaction.commit_on_success(using=database):
+                if objects:
+                    function(model, objects, database)
+                    checkpoint.last_pk = force_text(objects[-1].pk)
+                checkpoint.done = len(objects) < self.batch_size
+                checkpoint.updated = timezone.now()
+                checkpoint.save(using=database)
+            if checkpoint.done:
+                return
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def can_fork(self, database):
+        "Returns True if worker processes can run batches against the database"
+        connection = connections[database]
+        if transaction.is_managed(using=database):
+            return False
+        return not (connection.vendor == "sqlite" and connection.settings_dict["NAME"] in ("", ":memory:"))
+
+    def run_parallel(self, model, function, checkpoints, database):
+        "Runs each checkpoint's part of the table in its own process"
+        # Forked processes mustn't share the connection
+        connections[database].close()
+        processes = [
+            multiprocessing.Process(target=self.run_worker, args=(model, function, checkpoint, database))
+            for checkpoint in checkpoints
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        failed = [c.partition for c, p in zip(checkpoints, processes) if p.exitcode != 0]
+        if failed:
+            raise DataMigrationError("%s failed in part(s) %s; run it again to carry on." % (
+                self.name,
+                ", ".join(str(partition) for partition in failed),
+            ))
+
+    def run_worker(self, model, function, checkpoint, database):
+        "Runs in a worker process"
+        try:
+            self.run_partition(model, function, checkpoint, database)
+        finally:
+            connections[database].close()
+
+
+def bulk_update(model, objects, fields, database):
+    """
+    Saves the named fields of objects (instances of model) with as few
+    UPDATE statements as possible, picking each row's new values with a
+    CASE on its primary key. For use in RunBatches functions.
+    """
+    connection = connections[database]
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in fields]
+    pk_column = qn(model._meta.pk.column)
+    # Keep under SQLite's limit of 999 parameters per statement
+    size = max(1, 999 // (len(fields) * 2 + 1))
+    cursor = connection.cursor()
+    for start in range(0, len(objects), size):
+        chunk = objects[start:start + size]
+        clauses, params = [], []
+        for field in fields:
+            cases = []
+            for obj in chunk:
+                cases.append("WHEN %s THEN %s")
+                params.extend([obj.pk, field.get_db_prep_save(getattr(obj, field.attname), connection=connection)])
+            clauses.append("%s = CASE %s %s END" % (qn(field.column), pk_column, " ".join(cases)))
+        params.extend(obj.pk for obj in chunk)
+        cursor.execute("UPDATE %s SET %s WHERE %s IN (%s)" % (
+            qn(model._meta.db_table),
+            ", ".join(clauses),
+            pk_column,
+            ", ".join(["%s"] * len(chunk)),
+        ), params)
+    transaction.set_dirty(using=database)
@@ -28,13 +28,20 @@ class CreateField(Action):
 
     def alter_state(self, project_state):
         "Alters the project state"
-        project_state.models[(self.app_label, self.model_name)].fields.append(
+        project_state.mutate_model(self.app_label, self.model_name).fields.append(
             (self.name, self.instance),
         )
 
-    def alter_database(self, from_state, to_state, database, forwards):
-        "Creates the field (column or table)"
-        pass
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Creates the field's column (or removes it, backwards)"
+        if editor.online is not None:
+            self.alter_table_online(from_state, to_state, editor)
+        elif forwards:
+            model = to_state.get_model(self.app_label, self.model_name).render(to_state)
+            editor.add_field(model, model._meta.get_field(self.name))
+        else:
+            model = from_state.get_model(self.app_label, self.model_name).render(from_state)
+            editor.remove_field(model, model._meta.get_field(self.name))
 
 
 class DeleteField(Action):
@@ -57,13 +64,20 @@ class DeleteField(Action):
 
     def alter_state(self, project_state):
         "Alters the project state"
-        model_state = project_state.models[(self.app_label, self.model_name)]
+        model_state = project_state.mutate_model(self.app_label, self.model_name)
         model_state.fields = [
             (name, field)
             for name, field in model_state.fields
             if name != self.name
         ]
 
-    def alter_database(self, from_state, to_state, database, forwards):
-        "Creates the field (column or table)"
-        pass
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Removes the field's column (or adds it back, backwards)"
+        if editor.online is not None:
+            self.alter_table_online(from_state, to_state, editor)
+        elif forwards:
+            model = from_state.get_model(self.app_label, self.model_name).render(from_state)
+            editor.remove_field(model, model._meta.get_field(self.name))
+        else:
+            model = to_state.get_model(self.app_label, self.model_name).render(to_state)
+            editor.add_field(model, model._meta.get_field(self.name))
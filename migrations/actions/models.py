@@ -5,6 +5,7 @@ operations
 """
 
 from django.db.models import AutoField
+from ..online import OnlineSchemaChanger
 from ..state import ModelState
 from .base import Action
 
@@ -36,21 +37,21 @@ class CreateModel(Action):
 
     def alter_state(self, project_state):
         "Alters the project state"
-        project_state.models[(self.app_label, self.model_name)] = ModelState(
+        project_state.add_model(ModelState(
             project_state = project_state,
             app_label = self.app_label,
             name = self.model_name,
-            fields = self.fields,
-            options = self.options,
-            bases = self.bases,
-        )
+            fields = list(self.fields),
+            options = dict(self.options),
+            bases = list(self.bases),
+        ))
 
-    def alter_database(self, from_state, to_state, database, forwards):
-        "Creates the model"
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Creates the model's table (or drops it, backwards)"
         if forwards:
-            print "CALLING 'CREATE TABLE' with %s" % to_state.models[self.app_label, self.model_name].render()
+            editor.create_model(to_state.get_model(self.app_label, self.model_name).render(to_state))
         else:
-            print "CALLING 'DROP TABLE' with %s" % to_state.models[self.app_label, self.model_name].render()
+            editor.delete_model(from_state.get_model(self.app_label, self.model_name).render(from_state))
 
 
 class DeleteModel(Action):
@@ -60,14 +61,36 @@ class DeleteModel(Action):
         self.app_label = app_label
         self.model_name = model_name
 
+    def __repr__(self):
+        return "<DeleteModel %s.%s>" % (self.app_label, self.model_name)
+
+    def __str__(self):
+        return "Delete model %s.%s" % (self.app_label, self.model_name)
+
     def alter_state(self, project_state):
         "Alters the project state"
-        del project_state.models[(self.app_label, self.model_name)]
+        project_state.remove_model(self.app_label, self.model_name)
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Drops the model's table (or creates it again, backwards)"
+        if forwards:
+            editor.delete_model(from_state.get_model(self.app_label, self.model_name).render(from_state))
+        else:
+            editor.create_model(to_state.get_model(self.app_label, self.model_name).render(to_state))
 
 
 class AlterModelOption(Action):
     "Represents a change to a model option"
 
+    # Options that change the table itself, other than its name, and the
+    # SchemaEditor methods that make the changes; with online schema
+    # changes, the table is rebuilt for them instead
+    table_options = {
+        "db_tablespace": "alter_db_tablespace",
+        "index_together": "alter_index_together",
+        "unique_together": "alter_unique_together",
+    }
+
     def __init__(self, app_label, model_name, name, value):
         self.app_label = app_label
         self.model_name = model_name
@@ -82,9 +105,34 @@ class AlterModelOption(Action):
             self.value,
         )
 
+    def __str__(self):
+        return "Set %s on %s.%s" % (self.name, self.app_label, self.model_name)
+
     def alter_state(self, project_state):
         "Alters the project state"
-        project_state.models[(self.app_label, self.model_name)].options[self.name] = self.value
+        project_state.mutate_model(self.app_label, self.model_name).options[self.name] = self.value
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        """
+        Renames the table for db_table, and changes it (or rebuilds it
+        online) for table_options; other options only affect the Python
+        side of the model.
+        """
+        if self.name == "db_table":
+            editor.rename_table(
+                from_state.get_model(self.app_label, self.model_name).render(from_state),
+                to_state.get_model(self.app_label, self.model_name).render(to_state),
+            )
+        elif self.name in self.table_options:
+            if editor.online is not None:
+                self.alter_table_online(from_state, to_state, editor)
+                return
+            from_model = from_state.get_model(self.app_label, self.model_name).render(from_state)
+            to_model = to_state.get_model(self.app_label, self.model_name).render(to_state)
+            if self.name == "unique_together":
+                editor.alter_unique_together(from_model, to_model, OnlineSchemaChanger())
+            else:
+                getattr(editor, self.table_options[self.name])(from_model, to_model)
 
 
 class AlterModelBases(Action):
@@ -104,4 +152,8 @@ class AlterModelBases(Action):
 
     def alter_state(self, project_state):
         "Alters the project state"
-        project_state.models[(self.app_label, self.model_name)].bases = self.value
+        project_state.mutate_model(self.app_label, self.model_name).bases = self.value
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        "Bases aren't rendered yet (see ModelState.construct), so there's nothing to do"
+        pass
@@ -4,14 +4,16 @@ is separate to the core classes is so that in future it's possible to move to
 a v2 of this API.
 """
 
-from django.utils.importlib import import_module
 import actions
+from actions.data import bulk_update
+from registry import DeferredField
 
 
 class BaseMigration(object):
     "Base migration class"
 
     dependencies = []
+    replaces = []
     actions = []
 
 
@@ -24,10 +26,13 @@ class Action(object):
 ## Field definition ##
 
 def Field(path, args, kwargs):
-    "Creates fields from textual definitions"
-    field_module, field_class = path.rsplit(".", 1)
-    field_module = import_module(field_module)
-    return getattr(field_module, field_class)(*args, **kwargs)
+    """
+    Creates fields from textual definitions. The field isn't constructed
+    until it's needed; path can be a dotted path or an alias registered
+    with the field registry. The definition is kept on the field as
+    _migrations_definition, so it can be written out again.
+    """
+    return DeferredField(path, args, kwargs)
 
 ## Model-level ##
 
@@ -50,8 +55,54 @@ class CreateModel(Action):
         )
 
 
+class DeleteModel(Action):
+    "Deletion of models"
+
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, app_label):
+        return actions.DeleteModel(
+            app_label = app_label,
+            model_name = self.name,
+        )
+
+
+class AlterModelOption(Action):
+    "Changing a model option"
+
+    def __init__(self, model_name, name, value):
+        self.model_name = model_name
+        self.name = name
+        self.value = value
+
+    def render(self, app_label):
+        return actions.AlterModelOption(
+            app_label = app_label,
+            model_name = self.model_name,
+            name = self.name,
+            value = self.value,
+        )
+
+
+class AlterModelBases(Action):
+    "Changing a model's bases"
+
+    def __init__(self, model_name, bases):
+        self.model_name = model_name
+        self.bases = bases
+
+    def render(self, app_label):
+        return actions.AlterModelBases(
+            app_label = app_label,
+            model_name = self.model_name,
+            value = self.bases,
+        )
+
+## Field-level ##
+
 class CreateField(Action):
-    "Creation of models"
+    "Creation of fields"
 
     def __init__(self, model_name, name, field):
         self.model_name = model_name
@@ -65,3 +116,50 @@ class CreateField(Action):
             name = self.name,
             instance = self.field,
         )
+
+
+class DeleteField(Action):
+    "Deletion of fields"
+
+    def __init__(self, model_name, name):
+        self.model_name = model_name
+        self.name = name
+
+    def render(self, app_label):
+        return actions.DeleteField(
+            app_label = app_label,
+            model_name = self.model_name,
+            name = self.name,
+        )
+
+## Data ##
+
+class RunBatches(Action):
+    """
+    Runs function(model, objects, database) over the model's rows in
+    batches, saving its progress so an interrupted run carries on where it
+    stopped. function (and reverse_function) can be dotted paths. name
+    identifies the run's progress, so has to be unique within the app.
+    """
+
+    def __init__(self, model_name, function, name=None, reverse_function=None,
+                 batch_size=1000, sleep=0, workers=1):
+        self.model_name = model_name
+        self.function = function
+        self.name = name or (function if isinstance(function, basestring) else function.__name__)
+        self.reverse_function = reverse_function
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.workers = workers
+
+    def render(self, app_label):
+        return actions.RunBatches(
+            app_label = app_label,
+            model_name = self.model_name,
+            function = self.function,
+            name = self.name,
+            reverse_function = self.reverse_function,
+            batch_size = self.batch_size,
+            sleep = self.sleep,
+            workers = self.workers,
+        )
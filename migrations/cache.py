@@ -0,0 +1,115 @@
+"""
+On-disk cache of compiled migration files, so that migrations which haven't
+changed don't need to be parsed and compiled on every run.
+"""
+
+import os
+import imp
+import marshal
+import hashlib
+import tempfile
+
+
+def user_cache_dir(name):
+    """
+    Returns a directory called name in the current user's cache directory
+    ($XDG_CACHE_HOME, or ~/.cache).
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "django-migrations", name)
+
+
+def default_cache_dir():
+    "Returns the cache directory used when MIGRATIONS_CACHE_DIR isn't set"
+    return user_cache_dir("compiled")
+
+
+def private_dir(directory, create=False):
+    """
+    Returns True if directory belongs to the current user and nobody else
+    can write to it, so what's in it can be trusted. If create is set, it's
+    made (readable by the current user only) if it doesn't exist.
+    """
+    try:
+        if create and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        stat = os.stat(directory)
+    except OSError:
+        return False
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 022
+
+
+class MigrationCache(object):
+    """
+    Stores compiled migration payloads (a dict of marshallable values,
+    such as the code object) in a directory, one file per migration path.
+    Entries are only returned if the file's mtime, size and content hash
+    (and the Python bytecode version) all still match.
+
+    Payloads are run when migrations load, so the directory is only used
+    if it belongs to the current user and nobody else can write to it (see
+    private_dir); it's created readable by the current user only.
+    """
+
+    suffix = ".cache"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.trusted = None
+
+    def is_trusted(self, create=False):
+        "Returns True if the directory is safe to read entries from (and write them to)"
+        if not self.trusted:
+            self.trusted = private_dir(self.directory, create)
+        return self.trusted
+
+    def entry_path(self, path):
+        "Returns the filename the entry for the given migration path lives in"
+        key = hashlib.sha1(os.path.abspath(path)).hexdigest()
+        return os.path.join(self.directory, key + self.suffix)
+
+    def key(self, path, source_hash):
+        "Returns the tuple an entry must match to be valid"
+        stat = os.stat(path)
+        return (imp.get_magic(), os.path.abspath(path), int(stat.st_mtime), stat.st_size, source_hash)
+
+    def get(self, path, source_hash):
+        "Returns the cached payload for path, or None if it's missing or stale"
+        key, payload = None, None
+        if self.is_trusted():
+            try:
+                with open(self.entry_path(path), "rb") as fh:
+                    key, payload = marshal.load(fh)
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+        if key != self.key(path, source_hash):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return payload
+
+    def set(self, path, source_hash, payload):
+        "Stores the payload for path. Failures are ignored; it's only a cache."
+        entry_path = self.entry_path(path)
+        if not self.is_trusted(create=True):
+            return
+        try:
+            # Write to a temporary file first so readers never see half an entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as fh:
+                marshal.dump((self.key(path, source_hash), payload), fh)
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        "Removes all entries from the cache"
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.suffix):
+                os.remove(os.path.join(self.directory, filename))
@@ -0,0 +1,114 @@
+"""
+Declarative migration files (.migration.json), which are parsed rather than
+run, so they load faster than Python ones and can't run code of their own:
+the only things they can refer to by dotted path are model field classes
+(see FieldRegistry.resolve).
+
+A declarative migration is a JSON object with optional "dependencies" and
+"replaces" lists of [app_label, name] pairs, and an "actions" list. Each
+action is an object naming its API class in "action", with the rest of its
+keys being the class's arguments; fields are written as [path, args,
+kwargs], as they would be passed to Field(). Data migrations (RunBatches)
+run code, so they can only be written in Python. For example:
+
+    {
+        "dependencies": [["app2", "0001_initial"]],
+        "actions": [
+            {
+                "action": "CreateField",
+                "model_name": "Author",
+                "name": "yob",
+                "field": ["django.db.models.fields.IntegerField", [], {"null": true}]
+            }
+        ]
+    }
+"""
+
+import json
+from . import api
+from .exceptions import ParsingError
+from .migration import Migration
+
+
+# The API classes declarative migrations can use
+ACTIONS = dict(
+    (action_class.__name__, action_class)
+    for action_class in [
+        api.CreateModel,
+        api.DeleteModel,
+        api.AlterModelOption,
+        api.AlterModelBases,
+        api.CreateField,
+        api.DeleteField,
+    ]
+)
+
+
+class DeclarativeMigration(Migration):
+    """
+    Represents a declarative migration file on disk. The parsed file is
+    kept in the compiled migration cache in place of a code object.
+    """
+
+    def read_header(self, source):
+        "Parses the file, returning its header"
+        try:
+            data = to_str(json.loads(source))
+        except ValueError, e:
+            raise ParsingError("Could not parse %s: %s" % (self.path, e))
+        if not isinstance(data, dict) or not isinstance(data.get("actions", []), list):
+            raise ParsingError("%s is not a declarative migration" % self.path)
+        try:
+            header = {
+                "dependencies": [tuple(entry) for entry in data.get("dependencies", [])],
+                "replaces": [tuple(entry) for entry in data.get("replaces", [])],
+                "actions": [spec["action"] for spec in data.get("actions", [])],
+            }
+        except (KeyError, TypeError):
+            raise ParsingError("%s has a malformed dependency or action" % self.path)
+        self._payload["data"] = data
+        return header
+
+    def load_body(self, source=None):
+        "Builds and renders the migration's actions"
+        if "data" not in self._payload:
+            if source is None:
+                with open(self.path, "rb") as fh:
+                    source = fh.read()
+            self._payload["header"] = self.read_header(source)
+            self.save_payload()
+        self._actions = [
+            build_action(spec, self.path).render(self.app_label)
+            for spec in self._payload["data"].get("actions", [])
+        ]
+
+
+def build_action(spec, path):
+    "Returns the API action an action object from a declarative file describes"
+    arguments = dict(spec)
+    try:
+        action_class = ACTIONS[arguments.pop("action")]
+    except KeyError:
+        raise ParsingError("%s uses an unknown action: %s" % (path, spec.get("action")))
+    if "field" in arguments:
+        arguments["field"] = api.Field(*arguments["field"])
+    if "fields" in arguments:
+        arguments["fields"] = [(name, api.Field(*field)) for name, field in arguments["fields"]]
+    try:
+        return action_class(**arguments)
+    except TypeError, e:
+        raise ParsingError("%s has a malformed %s: %s" % (path, action_class.__name__, e))
+
+
+def to_str(value):
+    """
+    Converts the unicode strings json gives back into byte strings, as
+    model, field and keyword argument names have to be.
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf8")
+    elif isinstance(value, list):
+        return [to_str(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((to_str(key), to_str(item)) for key, item in value.items())
+    return value
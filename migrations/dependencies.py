@@ -24,37 +24,74 @@ class SortedSet(SortedDict):
         [self.add(k) for k in iterable]
 
 
-def depends(target, get_children):
+class OrderedChildren(object):
+    """
+    Wraps a get_children function, remembering each node's children in the
+    order the planner walks them (reverse string order, so that the result
+    matches a string-ordered depth-first search).
+    """
+
+    def __init__(self, get_children):
+        self.get_children = get_children
+        self.cache = {}
+
+    def __call__(self, node):
+        try:
+            return self.cache[node]
+        except KeyError:
+            children = list(reversed(sorted(self.get_children(node), key=lambda x: str(x))))
+            self.cache[node] = children
+            return children
+
+    def clear(self):
+        self.cache.clear()
+
+
+def depends(target, get_children, seen=None):
     """
     Given a single target migration and a function to get its deps,
     returns the list of migrations to apply, in order.
     """
-    result = SortedSet(reversed(list(dfs(target, get_children))))
-    return list(result)
-
-
-def dfs(start, get_children):
-    "Nice entry-point to depth-first search"
-    return flatten(_dfs(start, get_children, []))
-
-
-def _dfs(start, get_children, path):
-    "Actual depth-first search worker function"
-    if start in path:
-        raise CircularDependency(path[path.index(start):] + [start])
-    path.append(start)
-    yield start
-    try:
-        children = sorted(get_children(start), key=lambda x: str(x))
-    except AttributeError:
-        # Print this else it'll get masked by flatten()
-        import traceback
-        traceback.print_exc()
-        raise
-    if children:
-        # We need to apply all the migrations this one depends on
-        yield (_dfs(n, get_children, path) for n in children)
-    path.pop()
+    return depends_all([target], get_children, seen)
+
+
+def depends_all(targets, get_children, seen=None):
+    """
+    Given several targets and a function to get their deps, returns one
+    list of everything to apply, in order, with no duplicates. Each node
+    is only visited once, so this is linear in the size of the graph.
+    Nodes in seen (which is updated as we go) are skipped, along with
+    anything only reachable through them.
+    """
+    if not isinstance(get_children, OrderedChildren):
+        get_children = OrderedChildren(get_children)
+    if seen is None:
+        seen = set()
+    result = []
+    for target in targets:
+        if target in seen:
+            continue
+        # Iterative depth-first search, emitting nodes as they finish
+        seen.add(target)
+        path = [target]
+        on_path = set(path)
+        stack = [iter(get_children(target))]
+        while stack:
+            for child in stack[-1]:
+                if child in on_path:
+                    raise CircularDependency(path[path.index(child):] + [child])
+                if child not in seen:
+                    seen.add(child)
+                    path.append(child)
+                    on_path.add(child)
+                    stack.append(iter(get_children(child)))
+                    break
+            else:
+                stack.pop()
+                node = path.pop()
+                on_path.remove(node)
+                result.append(node)
+    return result
 
 
 def flatten(*stack):
@@ -41,3 +41,8 @@ class AmbiguousMigration(MigrationError):
 class UnmigratedApp(MigrationError):
     "Raised when a migration operation is peformed on an app without them"
     pass
+
+
+class DataMigrationError(MigrationError):
+    "Raised when a batched data migration fails in a worker process"
+    pass
@@ -0,0 +1,113 @@
+"""
+Applies migrations to many databases with the same schema (tenants, for
+example) in one go.
+"""
+
+import sys
+import time
+import Queue
+import threading
+from django.db import connections
+from django.utils.datastructures import SortedDict
+
+
+class FanOut(object):
+    """
+    Runs a Migrator's plan against many databases at once. Everything that
+    doesn't depend on the database is done once: migrations are loaded and
+    the graph is worked out by the migrator's loader, databases with the
+    same migrations applied share one plan, and each plan's action states
+    are worked out once and shared by all the databases it's for.
+
+    The plans are then run on a pool of at most workers threads, each
+    database by a single thread, one migration after another (the
+    migrator's own workers setting isn't used). A database failing doesn't
+    stop the others; results maps each database to None if it was
+    migrated, or to the exception that stopped it.
+
+    Tenants kept in separate schemas can be migrated the same way, with a
+    database alias per schema.
+    """
+
+    def __init__(self, migrator, workers=4):
+        self.migrator = migrator
+        self.workers = workers
+        self.results = SortedDict()
+        self.lock = threading.Lock()
+
+    def plans(self, databases, app=None, target=None):
+        """
+        Returns a list of (plan, entries, databases), with each database in
+        the list that has the same migrations applied as the others.
+        """
+        groups = SortedDict()
+        for database in databases:
+            applied = frozenset(self.migrator.recorder.applied_migrations(database))
+            groups.setdefault(applied, []).append(database)
+        result = []
+        for applied, group in groups.items():
+            # Squashed migrations can change the graph for each applied set,
+            # so the entries are worked out straight after their plan
+            plan = self.migrator.calculate_plan(app, target, group[0])
+            result.append((plan, list(self.migrator.plan_entries(plan)), group))
+        return result
+
+    def run(self, databases, app=None, target=None):
+        """
+        Migrates all the databases, returning the results. Planning errors
+        are raised straight away, before anything is run.
+        """
+        return self.run_plans(self.plans(databases, app, target))
+
+    def run_plans(self, plans):
+        "Migrates the databases in plans (as returned by plans()), returning the results"
+        work = Queue.Queue()
+        for plan, entries, group in plans:
+            for database in group:
+                work.put((database, plan, entries))
+        threads = [
+            threading.Thread(target=self.run_worker, args=(work, ))
+            for _ in range(min(self.workers, work.qsize()))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Keep the results in the order the databases were planned in
+        self.results = SortedDict(
+            (database, self.results[database])
+            for plan, entries, group in plans
+            for database in group
+        )
+        return self.results
+
+    def run_worker(self, work):
+        "Migrates databases from the work queue until it's empty"
+        while True:
+            try:
+                database, plan, entries = work.get_nowait()
+            except Queue.Empty:
+                return
+            self.log_database_start(database, plan)
+            started = time.time()
+            error = None
+            try:
+                self.migrator.execute_entries(entries, database)
+            except Exception:
+                error = sys.exc_info()[1]
+            finally:
+                connections[database].close()
+            with self.lock:
+                self.results[database] = error
+                self.log_database_end(database, plan, error, time.time() - started)
+
+    def failed(self):
+        "Returns the databases that failed to migrate"
+        return [database for database, error in self.results.items() if error is not None]
+
+    def log_database_start(self, database, plan):
+        pass
+
+    def log_database_end(self, database, plan, error, seconds):
+        pass
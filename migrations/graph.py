@@ -0,0 +1,98 @@
+"""
+Exports the migration graph and plans as JSON or DOT, using only what's in
+the migrations' headers, so no actions are loaded and no models rendered.
+"""
+
+import json
+
+
+# Roughly how many statements each kind of action runs
+ACTION_STATEMENTS = {
+    "CreateModel": 1,
+    "DeleteModel": 1,
+    "CreateField": 1,
+    "DeleteField": 1,
+    "AlterModelOption": 0,
+    "AlterModelBases": 0,
+}
+
+
+def estimated_statements(migration):
+    """
+    Returns a guess at how many statements the migration runs, from the
+    action names in its header, or None if they aren't known.
+    """
+    if migration.action_names is None:
+        return None
+    return sum(ACTION_STATEMENTS.get(name, 1) for name in migration.action_names)
+
+
+def graph_data(loader, plan=None, applied=None):
+    """
+    Returns a JSON-serializable description of the loader's dependency
+    graph (which must have been calculated), with each migration's status
+    in the applied set, and of the plan, if one is given.
+    """
+    applied = applied or set()
+    planned = dict((migration, forwards) for forwards, migration in plan or [])
+    nodes = []
+    edges = []
+    for migration in sorted(loader.dependencies, key=lambda m: (m.app_label, m.name)):
+        if migration.is_root:
+            continue
+        nodes.append({
+            "id": str(migration),
+            "app_label": migration.app_label,
+            "name": migration.name,
+            "applied": migration in applied,
+            "planned": None if migration not in planned else ("forwards" if planned[migration] else "backwards"),
+            "actions": migration.action_names,
+            "estimated_statements": estimated_statements(migration),
+            "replaces": ["%s:%s" % replaced for replaced in migration.replaces],
+        })
+        for dependency in loader.get_forward_dependencies(migration):
+            if not dependency.is_root:
+                edges.append([str(migration), str(dependency)])
+    return {
+        "nodes": nodes,
+        "edges": edges,
+        "plan": [
+            {"migration": str(migration), "forwards": forwards, "estimated_statements": estimated_statements(migration)}
+            for forwards, migration in plan or []
+        ],
+    }
+
+
+def to_json(data):
+    return json.dumps(data, indent=2, sort_keys=True)
+
+
+def to_dot(data):
+    """
+    Returns the graph as a DOT digraph, with edges pointing from each
+    migration to what it depends on. Applied migrations are filled in, and
+    planned ones outlined in green (forwards) or red (backwards).
+    """
+    colors = {"forwards": "green", "backwards": "red"}
+    lines = ["digraph migrations {", "    rankdir = BT;", "    node [shape = box];"]
+    clusters = {}
+    for node in data["nodes"]:
+        clusters.setdefault(node["app_label"], []).append(node)
+    for app_label, nodes in sorted(clusters.items()):
+        lines.append("    subgraph \"cluster_%s\" {" % app_label)
+        lines.append("        label = \"%s\";" % app_label)
+        for node in nodes:
+            attributes = ["label = \"%s\\n~%s statements\"" % (
+                node["name"],
+                "?" if node["estimated_statements"] is None else node["estimated_statements"],
+            )]
+            if node["applied"]:
+                attributes.append("style = filled")
+            if node["planned"]:
+                attributes.append("color = %s" % colors[node["planned"]])
+            lines.append("        \"%s\" [%s];" % (node["id"], ", ".join(attributes)))
+        lines.append("    }")
+    for source, target in data["edges"]:
+        lines.append("    \"%s\" -> \"%s\";" % (source, target))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
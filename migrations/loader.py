@@ -1,28 +1,84 @@
 import os
+import bisect
+import hashlib
+from itertools import groupby
 from django.conf import settings
 from django.utils import importlib
+from .cache import MigrationCache, default_cache_dir
 from .migration import Migration, RootMigration
-from .dependencies import depends
+from .declarative import DeclarativeMigration
+from .dependencies import depends, OrderedChildren
+from .snapshots import SnapshotStore, default_snapshot_dir
 from .exceptions import NonexistentDependency, InvalidDependency, NonexistentMigration, AmbiguousMigration, UnmigratedApp
+from .registry import field_registry
 from .state import ProjectState
 
 
+class MigrationDict(dict):
+    """
+    The dict of an app's migrations by name, counting changes in version
+    so the Loader can tell when its index needs rebuilding.
+    """
+
+    version = 0
+
+    def changed(method):
+        def wrapper(self, *args, **kwargs):
+            self.version += 1
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    __setitem__ = changed(dict.__setitem__)
+    __delitem__ = changed(dict.__delitem__)
+    clear = changed(dict.clear)
+    pop = changed(dict.pop)
+    popitem = changed(dict.popitem)
+    setdefault = changed(dict.setdefault)
+    update = changed(dict.update)
+    del changed
+
+
 class Loader(object):
     """
     Responsible for scanning the filesystem for migrations, loading them in,
     planning, state creation and dependency handling.
     """
 
-    def __init__(self, apps):
-        "Constructor. Apps should be a map of {app label: migs dir}"
+    def __init__(self, apps, cache=None, snapshots=None, snapshot_interval=0):
+        """
+        Constructor. Apps should be a map of {app label: migs dir}, and
+        cache an optional MigrationCache for compiled migration files.
+        If a SnapshotStore is passed as snapshots, state building starts
+        from the nearest saved snapshot, and if snapshot_interval is set a
+        snapshot is saved every snapshot_interval migrations of each app.
+        """
         self.apps = apps
+        self.cache = cache
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
         self.migrations = {}
         self.dependencies = {}
         self.reverse_dependencies = {}
+        self.indexes = {}
+        self.replacements = {}
+        self.removed = set()
+        self.substitutes = {}
+        self.forwards_children = OrderedChildren(self.get_forward_dependencies)
+        self.backwards_children = OrderedChildren(self.get_backwards_dependencies)
 
     @classmethod
-    def from_settings(cls):
-        "Makes a Loader configured for the current INSTALLED_APPS setting"
+    def from_settings(cls, use_cache=True):
+        """
+        Makes a Loader configured for the current INSTALLED_APPS setting.
+        The compiled migration cache lives in MIGRATIONS_CACHE_DIR, and
+        state snapshots in MIGRATIONS_SNAPSHOT_DIR, taken automatically
+        every MIGRATIONS_SNAPSHOT_INTERVAL migrations (set either directory
+        to None to disable it altogether). MIGRATIONS_FIELD_ALIASES can map
+        names migrations may use in Field() to dotted paths or classes, and
+        MIGRATIONS_FIELD_MODULES can list more modules field classes can be
+        imported from (see FieldRegistry).
+        """
         result = {}
         for app in settings.INSTALLED_APPS:
             # Work out its app label, do a sanity check
@@ -34,8 +90,31 @@ class Loader(object):
             mig_path = os.path.join(os.path.dirname(module.__file__), "migrations")
             if os.path.isdir(mig_path):
                 result[app_label] = mig_path
+        # Work out the cache
+        cache = None
+        cache_dir = getattr(settings, "MIGRATIONS_CACHE_DIR", default_cache_dir())
+        if use_cache and cache_dir:
+            cache = MigrationCache(cache_dir)
+        snapshots = None
+        snapshot_dir = getattr(settings, "MIGRATIONS_SNAPSHOT_DIR", default_snapshot_dir())
+        if use_cache and snapshot_dir:
+            # Keep this project's snapshots apart from any other's
+            namespace = hashlib.sha1(repr(sorted(
+                (app_label, os.path.abspath(path)) for app_label, path in result.items()
+            ))).hexdigest()
+            snapshots = SnapshotStore(snapshot_dir, namespace)
+        for alias, target in getattr(settings, "MIGRATIONS_FIELD_ALIASES", {}).items():
+            field_registry.register(alias, target)
+        for module_name in getattr(settings, "MIGRATIONS_FIELD_MODULES", []):
+            if module_name not in field_registry.modules:
+                field_registry.allow_module(module_name)
         # Construct the class
-        return cls(result)
+        return cls(
+            result,
+            cache = cache,
+            snapshots = snapshots,
+            snapshot_interval = getattr(settings, "MIGRATIONS_SNAPSHOT_INTERVAL", 0),
+        )
 
     def load_all(self):
         "Loads all migrations of all enabled apps"
@@ -44,22 +123,85 @@ class Loader(object):
 
     def load_app(self, app_label):
         "Loads all migrations of the specified app"
-        self.migrations[app_label] = {"0000_root": RootMigration(app_label)}
+        self.migrations[app_label] = MigrationDict()
+        self.indexes.pop(app_label, None)
+        self.add_migration(RootMigration(app_label))
         # Read in all the migrations by name
         for filename in os.listdir(self.apps[app_label]):
             path = os.path.join(self.apps[app_label], filename)
             if filename.endswith(".migration.py"):
-                # Alright, load it
-                name = filename[:-13]
-                migration = Migration(app_label, name)
-                migration.load(path)
-                self.migrations[app_label][name] = migration
-
-    def calculate_dependencies(self):
-        "Calculates and stores the dependency links"
-        for app_label, migrations in self.migrations.items():
-            migrations = migrations.values()
-            migrations.sort(key=lambda m: m.name)
+                migration = Migration(app_label, filename[:-13])
+            elif filename.endswith(".migration.json"):
+                migration = DeclarativeMigration(app_label, filename[:-15])
+            else:
+                continue
+            if migration.name in self.migrations[app_label]:
+                raise AmbiguousMigration("There is more than one file for migration %s" % migration)
+            # Alright, load it
+            migration.load(path, cache=self.cache)
+            self.add_migration(migration)
+
+    def add_migration(self, migration):
+        "Adds a loaded migration, keeping the app's index up to date"
+        migrations = self.migrations.setdefault(migration.app_label, MigrationDict())
+        index = self.indexes.get(migration.app_label)
+        current = index is not None and self.index_current(migrations, index)
+        migrations[migration.name] = migration
+        if current:
+            names, ordered, key = index
+            position = bisect.bisect_left(names, migration.name)
+            if position < len(names) and names[position] == migration.name:
+                ordered[position] = migration
+            else:
+                names.insert(position, migration.name)
+                ordered.insert(position, migration)
+            self.indexes[migration.app_label] = (names, ordered, self.index_key(migrations))
+
+    def get_index(self, app_label):
+        """
+        Returns (names, migrations) for the app, both sorted by name.
+        They're built on first use, kept up to date by add_migration, and
+        rebuilt if self.migrations has been changed some other way.
+        """
+        if app_label not in self.migrations:
+            raise UnmigratedApp("App %s does not have migrations." % app_label)
+        migrations = self.migrations[app_label]
+        index = self.indexes.get(app_label)
+        if index is None or not self.index_current(migrations, index):
+            names = sorted(migrations)
+            index = self.indexes[app_label] = (names, [migrations[name] for name in names], self.index_key(migrations))
+        return index[:2]
+
+    def index_key(self, migrations):
+        "Returns what identifies the contents of an app's migrations dict for its index"
+        return (id(migrations), getattr(migrations, "version", None))
+
+    def index_current(self, migrations, index):
+        """
+        Returns True if an index still matches the app's migrations dict. A
+        MigrationDict counts its changes, so that's quick; anything else
+        has its names compared.
+        """
+        if index[2] != self.index_key(migrations):
+            return False
+        if isinstance(migrations, MigrationDict):
+            return True
+        return len(index[0]) == len(migrations) and set(index[0]) == set(migrations)
+
+    def calculate_dependencies(self, applied=None):
+        """
+        Calculates and stores the dependency links. Where a squashed
+        migration replaces others, only one side is kept in the graph (see
+        resolve_replacements); pass the applied set so that's decided
+        correctly for a database.
+        """
+        self.dependencies = {}
+        self.reverse_dependencies = {}
+        self.forwards_children.clear()
+        self.backwards_children.clear()
+        self.resolve_replacements(applied)
+        for app_label in self.migrations:
+            migrations = [m for m in self.get_index(app_label)[1] if m not in self.removed]
             for i, migration in enumerate(migrations):
                 # Initialise our entries
                 self.dependencies.setdefault(migration, [])
@@ -78,7 +220,7 @@ class Loader(object):
                             "%s:%s" % dep_tuple,
                         ))
                     try:
-                        dependency = self.migrations[dep_tuple[0]][dep_tuple[1]]
+                        dependency = self.substitute(self.get_dependency(*dep_tuple))
                     except KeyError:
                         raise NonexistentDependency("Migration %s depends on non-existent %s" % (
                             migration,
@@ -88,6 +230,74 @@ class Loader(object):
                     self.dependencies[migration].append(dependency)
                     self.reverse_dependencies[dependency].append(migration)
 
+    def resolve_replacements(self, applied=None):
+        """
+        Works out which side of each squashed migration to use. The squashed
+        migration is used unless some, but not all, of the migrations it
+        replaces are in applied, in which case the originals are used so the
+        rest of them can be applied one by one. The unused side is added to
+        self.removed, and mapped in self.substitutes to the migration that
+        stands in for it.
+        """
+        applied = set((m.app_label, m.name) for m in applied or [])
+        self.replacements = {}
+        self.removed = set()
+        self.substitutes = {}
+        for app_label in self.migrations:
+            for migration in self.get_index(app_label)[1]:
+                if not migration.replaces:
+                    continue
+                replaced = [
+                    self.migrations[r_app][r_name]
+                    for r_app, r_name in migration.replaces
+                    if r_name in self.migrations.get(r_app, {})
+                ]
+                self.replacements[migration] = replaced
+                applied_count = len([m for m in replaced if (m.app_label, m.name) in applied])
+                if applied_count in (0, len(replaced)):
+                    for m in replaced:
+                        self.removed.add(m)
+                        self.substitutes[m] = migration
+                elif replaced:
+                    self.removed.add(migration)
+                    self.substitutes[migration] = replaced[-1]
+
+    def get_dependency(self, app_label, name):
+        """
+        Returns the migration a dependency names, or, if that's been
+        removed, the squashed migration that replaced it.
+        """
+        try:
+            return self.migrations[app_label][name]
+        except KeyError:
+            for migration in self.migrations.get(app_label, {}).values():
+                if (app_label, name) in [tuple(replaced) for replaced in migration.replaces]:
+                    return migration
+            raise
+
+    def substitute(self, migration):
+        "Returns the migration that stands in for the given one in the graph"
+        return self.substitutes.get(migration, migration)
+
+    def graph_fingerprint(self):
+        """
+        Returns a hash of the loaded migrations' names, dependencies and
+        replacements, which are all read from headers, so nothing has to
+        be run or calculated to get it.
+        """
+        hasher = hashlib.sha1()
+        for app_label in sorted(self.migrations):
+            for name, migration in sorted(self.migrations[app_label].items()):
+                if migration.is_root:
+                    continue
+                hasher.update(repr((
+                    str(app_label),
+                    str(name),
+                    sorted((str(a), str(n)) for a, n in migration.dependencies),
+                    sorted((str(a), str(n)) for a, n in migration.replaces),
+                )))
+        return hasher.hexdigest()
+
     def get_migration(self, app_label, name):
         "Returns a Migration class with loaded actions by name"
         if app_label not in self.migrations:
@@ -99,28 +309,26 @@ class Loader(object):
 
     def get_migration_by_prefix(self, app_label, prefix):
         "Given an app label and prefix of a migration name, either returns one or errors"
-        if app_label not in self.migrations:
-            raise UnmigratedApp("App %s does not have migrations." % app_label)
+        names, migrations = self.get_index(app_label)
         matches = []
-        for name in self.migrations[app_label]:
-            if name.startswith(prefix):
-                matches.append(name)
+        position = bisect.bisect_left(names, prefix)
+        while position < len(names) and names[position].startswith(prefix):
+            matches.append(names[position])
+            position += 1
         if not matches:
-            raise NonexistentMigration("No loaded migration match the prefix %s:%s" % (app_label, name))
+            raise NonexistentMigration("No loaded migration match the prefix %s:%s" % (app_label, prefix))
         elif len(matches) > 1:
             raise AmbiguousMigration("Multiple migrations match the prefix %s:%s (%s)" % (
                 app_label,
-                name,
+                prefix,
                 ", ".join(matches),
             ))
         else:
             return self.get_migration(app_label, matches[0])
 
     def get_top_migration(self, app_label):
-        "Returns the most recent migration for app_label"
-        if app_label not in self.migrations:
-            raise UnmigratedApp("App %s does not have migrations." % app_label)
-        return sorted(self.migrations[app_label].items())[-1][1]
+        "Returns the most recent migration for app_label that's in the graph"
+        return [m for m in self.get_index(app_label)[1] if m not in self.removed][-1]
 
     def get_forward_dependencies(self, migration):
         return self.dependencies.get(migration, [])
@@ -132,19 +340,26 @@ class Loader(object):
         """
         Takes a set of target Migration id tuples and returns a plan for them.
         Also needs a set of already-applied migrations, to which the root migrations
-        will be added.
+        will be added, along with any squashed migrations whose replaced
+        migrations are all applied (Migrator.record_replacements records
+        those in the database).
         Returns a list of (forwards?, migration_instance).
         """
         applied = set(applied)
         for app_label in self.migrations:
             applied.add(RootMigration(app_label))
-        # Plan!
+        for migration, replaced in self.replacements.items():
+            if replaced and all(m in applied for m in replaced):
+                applied.add(migration)
+        targets = [self.substitute(target) for target in targets]
+        # Plan! Consecutive forwards targets share one walk of the graph.
         plan = []
+        seen = set()
         for target in targets:
             forwards = target not in applied
             if forwards:
                 # Go through a forwards plan and add anything missing
-                for entry in depends(target, self.get_forward_dependencies):
+                for entry in depends(target, self.forwards_children, seen):
                     if entry not in applied:
                         plan.append((True, entry))
                         applied.add(entry)
@@ -157,34 +372,138 @@ class Loader(object):
                         backwards_target = dependent
                 # Go through a backwards plan and remove anything we need to
                 if backwards_target:
-                    for entry in depends(backwards_target, self.get_backwards_dependencies):
+                    seen = set()
+                    for entry in depends(backwards_target, self.backwards_children):
                         if entry in applied:
                             plan.append((False, entry))
                             applied.remove(entry)
         return plan
 
+    def ancestors(self, migration):
+        """
+        Returns the list of migrations that have to be applied before the
+        given one (including root migrations), in order, and ending with
+        the migration itself.
+        """
+        return depends(migration, self.forwards_children)
+
+    def start_state(self, migration):
+        """
+        Returns a (project_state, replayed) pair to start building the state
+        before migration from. If there's a valid snapshot of one of its
+        ancestors, the latest one in the migration's history is used;
+        otherwise it's an empty state.
+        """
+        if self.snapshots is not None:
+            # Only the ancestors of snapshots that are actually tried are
+            # worked out, latest first
+            for ancestor in reversed(self.ancestors(migration)[:-1]):
+                if self.snapshots.has_snapshot(ancestor):
+                    ancestors = self.ancestors(ancestor)
+                    project_state = self.snapshots.load(ancestor, ancestors)
+                    if project_state is not None:
+                        return project_state, set(ancestors)
+        return ProjectState(), set()
+
+    def replay_ancestors(self, migration, project_state, replayed):
+        """
+        Applies the actions of any of the migration's ancestors that aren't
+        in replayed to project_state, and adds them to replayed.
+        """
+        for ancestor in depends(migration, self.forwards_children, replayed)[:-1]:
+            for action in ancestor.actions:
+                action.alter_state(project_state)
+            replayed.add(ancestor)
+
+    def save_snapshot(self, migration):
+        "Builds the state after migration and saves it to the snapshot store"
+        project_state, replayed = self.start_state(migration)
+        self.replay_ancestors(migration, project_state, replayed)
+        for action in migration.actions:
+            action.alter_state(project_state)
+        return self.snapshots.save(migration, self.ancestors(migration), project_state)
+
+    def auto_snapshot(self, migration, project_state, replayed):
+        """
+        Called with the state just after migration was applied. Saves it as
+        a snapshot if automatic snapshots are on, the migration falls on the
+        interval, and the state contains nothing but the migration and its
+        ancestors.
+        """
+        if self.snapshots is None or not self.snapshot_interval:
+            return
+        names = self.get_index(migration.app_label)[0]
+        if bisect.bisect_left(names, migration.name) % self.snapshot_interval:
+            return
+        ancestors = self.ancestors(migration)
+        if len(ancestors) != len(replayed):
+            return
+        if self.snapshots.load(migration, ancestors) is None:
+            self.snapshots.save(migration, ancestors, project_state)
+
     def action_states(self, migration, forwards=True):
         """
         Given a migration, returns a pair of ProjectStates for each action -
         the "from" and "to" states.
         """
-        # Use the planner to work out the migrations we need to consider
-        plan = self.plan([migration], [])[:-1]
-        # Step through and build up a base ProjectState
-        project_state = ProjectState()
-        for forwards, plan_migration in plan:
-            if not forwards:
-                raise ValueError("State migration plan contains backwards migration.")
-            for action in plan_migration.actions:
-                action.alter_state(project_state)
+        # Start from the closest snapshot and replay what's left
+        project_state, replayed = self.start_state(migration)
+        self.replay_ancestors(migration, project_state, replayed)
         # Now build the per-action states
+        result = self.migration_states(migration, project_state)
+        replayed.add(migration)
+        self.auto_snapshot(migration, project_state, replayed)
+        # If this is a backwards migration, reverse it all
+        if not forwards:
+            result = [(a, t, f) for (a, f, t) in reversed(result)]
+        # Return it
+        return result
+
+    def migration_states(self, migration, project_state):
+        """
+        Applies the migration's actions to project_state, returning a list
+        of (action, from_state, to_state) for each action.
+        """
         result = []
         for action in migration.actions:
             from_state = project_state.copy()
             action.alter_state(project_state)
             result.append((action, from_state, project_state.copy()))
-        # If this is a backwards migration, reverse it all
-        if not forwards:
-            result = [(a, t, f) for (a, f, t) in reversed(result)]
-        # Return it
         return result
+
+    def plan_action_states(self, plan):
+        """
+        Given a plan (as returned by plan()), yields a
+        (forwards, migration, action_states) triple for each entry in it.
+        Unlike calling action_states() for every migration, a single
+        ProjectState is carried through the plan, so each action's state
+        change is only worked out once.
+        """
+        for forwards, entries in groupby(plan, key=lambda entry: entry[0]):
+            migrations = [migration for _, migration in entries]
+            if forwards:
+                for migration, result in self._incremental_states(migrations):
+                    yield True, migration, result
+            else:
+                # Actions can't undo state changes, so a backwards run is
+                # built forwards (it's a valid forwards order when reversed)
+                # and then flipped round.
+                results = list(self._incremental_states(list(reversed(migrations))))
+                for migration, result in reversed(results):
+                    yield False, migration, [(a, t, f) for (a, f, t) in reversed(result)]
+
+    def _incremental_states(self, migrations):
+        """
+        Yields (migration, action_states) for each of a forwards-ordered list
+        of migrations, replaying any ancestors that are not already part of
+        the state the first time they're needed.
+        """
+        project_state = replayed = None
+        for migration in migrations:
+            if project_state is None:
+                project_state, replayed = self.start_state(migration)
+            self.replay_ancestors(migration, project_state, replayed)
+            result = self.migration_states(migration, project_state)
+            replayed.add(migration)
+            self.auto_snapshot(migration, project_state, replayed)
+            yield migration, result
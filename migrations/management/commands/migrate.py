@@ -1,37 +1,188 @@
+import os
 import sys
+from optparse import make_option
+from django.conf import settings
 from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from ...fanout import FanOut
 from ...migrator import Migrator
 from ...loader import Loader
-from ...exceptions import UnmigratedApp, NonexistentMigration, AmbiguousMigration, NonexistentDependency
+from ...online import OnlineSchemaChanger
+from ...recorder import MigrationRecorder
+from ...exceptions import ParsingError, MigrationError
+
+
+# Errors shown to the user as a message, rather than a traceback: broken
+# migration files, and anything else migrations raise MigrationError for
+# (unknown apps and migrations, missing dependencies, data migrations
+# asked to be written out as SQL, and so on)
+MIGRATION_ERRORS = (ParsingError, MigrationError)
 
 
 class Command(BaseCommand):
 
-    def handle(self, app=None, target=None, **kwargs):
-        # Construct tne migrator and calculate the plan
+    option_list = BaseCommand.option_list + (
+        make_option("--no-cache", action="store_false", dest="use_cache", default=True,
+            help="Don't read or write the compiled migration cache."),
+        make_option("--clear-cache", action="store_true", dest="clear_cache", default=False,
+            help="Empty the compiled migration cache before loading migrations."),
+        make_option("--batch-size", type="int", dest="batch_size", default=1,
+            help="Record (and, with transactional DDL, commit) this many migrations at once; 0 for the whole plan."),
+        make_option("--workers", type="int", dest="workers", default=1,
+            help="Run migrations that don't depend on each other on this many threads."),
+        make_option("--optimize", action="store_true", dest="optimize", default=False,
+            help="Fold actions together across the whole plan before running them."),
+        make_option("--dry-run", action="store_true", dest="dry_run", default=False,
+            help="Show the plan (and what --optimize would do to it) without running it."),
+        make_option("--database", action="append", dest="databases", default=None,
+            help="Migrate this database, rather than the default one. Can be given more than once."),
+        make_option("--checkpoint-actions", action="store_true", dest="checkpoint", default=False,
+            help="Record each action as it finishes, so an interrupted migration carries on from there."),
+        make_option("--no-fingerprint", action="store_false", dest="use_fingerprint", default=True,
+            help="Always plan against the applied migrations, even if the stored graph fingerprint matches."),
+        make_option("--all-databases", action="store_true", dest="all_databases", default=False,
+            help="Migrate every database in the DATABASES setting."),
+        make_option("--fan-out", type="int", dest="fan_out", default=0,
+            help="Migrate this many of the databases at once, planning once for databases in the same state."),
+        make_option("--sql-dir", dest="sql_dir", default=None,
+            help="Write the SQL for each database to <alias>.sql in this directory, rather than running it."),
+        make_option("--sql-transactions", action="store_true", dest="sql_transactions", default=False,
+            help="With --sql-dir, wrap each migration's statements in BEGIN and COMMIT."),
+        make_option("--profile", action="store_true", dest="profile", default=False,
+            help="Time each action and migration, and show the slowest actions at the end."),
+        make_option("--profile-json", dest="profile_json", default=None,
+            help="Write the full timing report to this file as JSON (implies --profile)."),
+        make_option("--online", action="store_true", dest="online", default=False,
+            help="Change existing tables by rebuilding them online, rather than altering them in place."),
+        make_option("--online-chunk-size", type="int", dest="online_chunk_size", default=10000,
+            help="With --online, copy rows this many primary keys at a time."),
+        make_option("--online-throttle", type="float", dest="online_throttle", default=0.0,
+            help="With --online, pause this many seconds between chunks of rows."),
+    )
+
+    def handle(self, app=None, target=None, use_cache=True, clear_cache=False, batch_size=1, workers=1,
+               optimize=False, dry_run=False, databases=None, sql_dir=None, sql_transactions=False,
+               profile=False, profile_json=None, online=False, online_chunk_size=10000, online_throttle=0.0,
+               all_databases=False, fan_out=0, checkpoint=False, use_fingerprint=True, **kwargs):
+        if all_databases:
+            databases = list(settings.DATABASES.keys())
+        databases = databases or [DEFAULT_DB_ALIAS]
+        fan_out = fan_out if not dry_run and sql_dir is None else 0
+        # Only runs of every app to its latest migration can be skipped
+        # because of, or recorded with, a graph fingerprint
+        fingerprinted = app is None and not dry_run and sql_dir is None
+        if optimize and checkpoint:
+            print >>sys.stderr, "Error: --optimize and --checkpoint-actions can't be used together."
+            sys.exit(1)
+        if online:
+            for database in databases:
+                try:
+                    OnlineSchemaChanger().check_vendor(connections[database])
+                except NotImplementedError, e:
+                    print >>sys.stderr, "Error:", e
+                    sys.exit(1)
+        # Construct the migrator (and, for fan-out, calculate the plans)
         try:
-            loader = Loader.from_settings()
+            loader = Loader.from_settings(use_cache=use_cache)
+            if clear_cache and loader.cache is not None:
+                loader.cache.clear()
             loader.load_all()
+            # If every database has already had the graph on disk applied in
+            # full, there's nothing to do
+            fingerprint = loader.graph_fingerprint()
+            if fingerprinted and use_fingerprint:
+                recorder = MigrationRecorder(loader)
+                if all(recorder.stored_fingerprint(database) == fingerprint for database in databases):
+                    print "No migrations required."
+                    return
             loader.calculate_dependencies()
-            migrator = PrettyMigrator(loader)
-            plan = migrator.calculate_plan(app, target)
-        except UnmigratedApp, e:
+            # Fanned-out databases report progress per database instead
+            migrator = (Migrator if fan_out else PrettyMigrator)(
+                loader,
+                batch_size = batch_size or None,
+                workers = workers,
+                optimize = optimize,
+                profile = profile or bool(profile_json),
+                online = OnlineSchemaChanger(online_chunk_size, online_throttle) if online else None,
+                checkpoint = checkpoint,
+            )
+            if fan_out:
+                fanout = PrettyFanOut(migrator, workers=fan_out)
+                plans = fanout.plans(databases, app, target)
+        except MIGRATION_ERRORS, e:
             print >>sys.stderr, "Error:", e
             sys.exit(1)
-        except NonexistentMigration, e:
-            print >>sys.stderr, "Error:", e
-            sys.exit(1)
-        except NonexistentDependency, e:
-            print >>sys.stderr, "Error:", e
-            sys.exit(1)
-        except AmbiguousMigration, e:
-            print >>sys.stderr, "Error:", e
-            sys.exit(1)
-        # Run the plan
-        if plan:
-            migrator.execute_plan(plan)
-        else:
-            print "No migrations required."
+        if fan_out:
+            fanout.run_plans(plans)
+            failed = fanout.failed()
+            if fingerprinted:
+                for database in databases:
+                    if database not in failed:
+                        migrator.recorder.record_fingerprint(fingerprint, database)
+            print "%i of %i databases migrated." % (len(databases) - len(failed), len(databases))
+            self.show_profile(migrator, profile_json)
+            if failed:
+                sys.exit(1)
+            return
+        for database in databases:
+            if len(databases) > 1:
+                print "Database %s:" % database
+            try:
+                # Each database is planned just before it's run, as planning
+                # resolves the loader's graph for that database's applied set
+                plan = migrator.calculate_plan(app, target, database)
+                # Show the plan if this is a dry run
+                if dry_run:
+                    for forwards, migration, action_states in migrator.plan_entries(plan):
+                        print "%s %s (%i actions)" % ("Apply" if forwards else "Unapply", migration, len(action_states))
+                    if migrator.optimizer is not None:
+                        print migrator.optimizer.report()
+                # Write the plan out as SQL if they asked for that
+                elif sql_dir is not None:
+                    if not os.path.isdir(sql_dir):
+                        os.makedirs(sql_dir)
+                    statements = migrator.compile_plan(plan, database, transactions=sql_transactions)
+                    path = os.path.join(sql_dir, "%s.sql" % database)
+                    with open(path, "w") as fh:
+                        for sql in statements:
+                            fh.write(sql + "\n")
+                    print "Wrote %i statements for %i migrations to %s." % (len(statements), len(plan), path)
+                # Run the plan
+                elif plan:
+                    migrator.execute_plan(plan, database)
+                else:
+                    migrator.record_replacements(database)
+                    print "No migrations required."
+            except MIGRATION_ERRORS, e:
+                print >>sys.stderr, "Error:", e
+                sys.exit(1)
+            if fingerprinted:
+                migrator.recorder.record_fingerprint(fingerprint, database)
+        if not dry_run and sql_dir is None:
+            self.show_profile(migrator, profile_json)
+
+    def show_profile(self, migrator, profile_json):
+        "Shows where the time went, if the migrator was profiling"
+        if migrator.profiler is not None:
+            for line in migrator.profiler.summary():
+                print line
+            if profile_json:
+                migrator.profiler.write_json(profile_json)
+
+
+COLORS = {
+    "blue": '\033[94m',
+    "green": '\033[92m',
+    "red": '\033[91m',
+    "end": '\033[0m',
+}
+
+
+def colored(string, name):
+    if sys.stdout.isatty():
+        return COLORS[name] + string + COLORS["end"]
+    else:
+        return string
 
 
 class PrettyMigrator(Migrator):
@@ -39,18 +190,8 @@ class PrettyMigrator(Migrator):
     Subclass of Migrator that nicely logs what's happening.
     """
 
-    colors = {
-        "blue": '\033[94m',
-        "green": '\033[92m',
-        "red": '\033[91m',
-        "end": '\033[0m',
-    }
-
     def colored(self, string, name):
-        if sys.stdout.isatty():
-            return self.colors[name] + string + self.colors["end"]
-        else:
-            return string
+        return colored(string, name)
 
     def log_migration_start(self, migration, forwards):
         print self.colored("%s:" % migration, "blue")
@@ -60,3 +201,20 @@ class PrettyMigrator(Migrator):
 
     def log_action_start(self, migration, action, forwards):
         print " -> %s" % action
+
+    def log_action_skipped(self, migration, action, forwards):
+        print " -> %s (already done)" % action
+
+
+class PrettyFanOut(FanOut):
+    """
+    Subclass of FanOut that reports each database as it's done.
+    """
+
+    def log_database_end(self, database, plan, error, seconds):
+        if error is not None:
+            print colored("%s: failed after %.1fs: %s" % (database, seconds, error), "red")
+        elif plan:
+            print colored("%s: applied %i migrations in %.1fs." % (database, len(plan), seconds), "green")
+        else:
+            print "%s: no migrations required." % database
@@ -0,0 +1,37 @@
+import sys
+from optparse import make_option
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from ...graph import graph_data, to_json, to_dot
+from ...loader import Loader
+from ...migrator import Migrator
+from .migrate import MIGRATION_ERRORS
+
+
+class Command(BaseCommand):
+
+    args = "[app [target]]"
+    help = "Shows the migration graph and what migrate would do, without loading any actions."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format", dest="format", default="json", choices=["json", "dot"],
+            help="Output format: json (the default) or dot."),
+        make_option("--database", dest="database", default=DEFAULT_DB_ALIAS,
+            help="Show the plan for this database, rather than the default one."),
+    )
+
+    def handle(self, app=None, target=None, format="json", database=DEFAULT_DB_ALIAS, **kwargs):
+        try:
+            loader = Loader.from_settings()
+            loader.load_all()
+            loader.calculate_dependencies()
+            migrator = Migrator(loader)
+            plan = migrator.calculate_plan(app, target, database)
+        except MIGRATION_ERRORS, e:
+            print >>sys.stderr, "Error:", e
+            sys.exit(1)
+        data = graph_data(loader, plan, migrator.recorder.applied_migrations(database))
+        if format == "dot":
+            sys.stdout.write(to_dot(data))
+        else:
+            sys.stdout.write(to_json(data) + "\n")
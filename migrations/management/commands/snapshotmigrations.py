@@ -0,0 +1,42 @@
+import sys
+from optparse import make_option
+from django.core.management import BaseCommand
+from ...loader import Loader
+from .migrate import MIGRATION_ERRORS
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option("--clear", action="store_true", dest="clear", default=False,
+            help="Remove all existing snapshots first."),
+    )
+
+    def handle(self, app=None, target=None, clear=False, **kwargs):
+        # Work out which migrations to snapshot
+        try:
+            loader = Loader.from_settings()
+            if loader.snapshots is None:
+                print >>sys.stderr, "Error: Snapshots are disabled (MIGRATIONS_SNAPSHOT_DIR is None)."
+                sys.exit(1)
+            loader.load_all()
+            loader.calculate_dependencies()
+            if app is None:
+                targets = [loader.get_top_migration(app_label) for app_label in sorted(loader.migrations.keys())]
+            elif target is None:
+                targets = [loader.get_top_migration(app)]
+            else:
+                targets = [loader.get_migration_by_prefix(app, target)]
+        except MIGRATION_ERRORS, e:
+            print >>sys.stderr, "Error:", e
+            sys.exit(1)
+        if clear:
+            loader.snapshots.clear()
+        # Save them
+        for migration in targets:
+            if migration.is_root:
+                continue
+            if loader.save_snapshot(migration):
+                print "Saved snapshot for %s." % migration
+            else:
+                print >>sys.stderr, "Could not save snapshot for %s." % migration
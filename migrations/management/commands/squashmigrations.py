@@ -0,0 +1,38 @@
+import os
+import sys
+from django.core.management import BaseCommand
+from ...loader import Loader
+from ...writer import squash_migrations
+from ...exceptions import MigrationError
+
+
+class Command(BaseCommand):
+
+    args = "app start_prefix end_prefix"
+    help = "Squashes a run of an app's migrations into one that replaces them."
+
+    def handle(self, app=None, start=None, end=None, **kwargs):
+        if end is None:
+            print >>sys.stderr, "Error: Usage is squashmigrations %s" % self.args
+            sys.exit(1)
+        # Work out the squashed migration
+        try:
+            loader = Loader.from_settings()
+            loader.load_all()
+            loader.calculate_dependencies()
+            name, writer = squash_migrations(
+                loader,
+                app,
+                loader.get_migration_by_prefix(app, start),
+                loader.get_migration_by_prefix(app, end),
+            )
+            source = writer.as_string()
+        except (MigrationError, ValueError), e:
+            print >>sys.stderr, "Error:", e
+            sys.exit(1)
+        # Write it out next to the others
+        path = os.path.join(loader.apps[app], "%s.migration.py" % name)
+        with open(path, "w") as fh:
+            fh.write(source)
+        print "Wrote %s, replacing %i migrations." % (path, len(writer.replaces))
+        print "Once every database has applied it, the replaced migrations can be removed."
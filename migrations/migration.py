@@ -1,23 +1,146 @@
+import ast
+import hashlib
+
+
+# Attributes read from a migration's header, and their defaults
+HEADER_ATTRIBUTES = {
+    "dependencies": [],
+    "replaces": [],
+}
+
+
+def parse_header(source, path):
+    """
+    Works out a migration file's header (its dependencies and what it
+    replaces) without running it, by looking for literal values on its
+    Migration class. Returns None if they can't be determined that way.
+    The header also lists the names of the action classes the migration
+    uses, where they can be seen, or has None for them if not.
+    """
+    try:
+        module = ast.parse(source, path)
+    except SyntaxError:
+        return None
+    for node in module.body:
+        if isinstance(node, ast.ClassDef) and node.name == "Migration":
+            # Anything other than BaseMigration might provide its own
+            if [getattr(base, "id", None) for base in node.bases] != ["BaseMigration"]:
+                return None
+            header = dict(HEADER_ATTRIBUTES, actions=[])
+            for statement in node.body:
+                if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and \
+                        getattr(statement.targets[0], "id", None) == "actions":
+                    header["actions"] = parse_action_names(statement.value)
+                elif isinstance(statement, ast.Assign) and len(statement.targets) == 1 and \
+                        getattr(statement.targets[0], "id", None) in HEADER_ATTRIBUTES:
+                    try:
+                        value = ast.literal_eval(statement.value)
+                        header[statement.targets[0].id] = [tuple(entry) for entry in value]
+                    except (ValueError, TypeError):
+                        return None
+            return header
+    return None
+
+
+def parse_action_names(node):
+    "Returns the class names of a literal list of action calls, or None"
+    if not isinstance(node, ast.List):
+        return None
+    names = [getattr(element.func, "id", None) for element in node.elts if isinstance(element, ast.Call)]
+    if len(names) != len(node.elts) or None in names:
+        return None
+    return names
+
+
 class Migration(object):
     """
     Represents a migration file on disk.
     """
 
     is_root = False
+    replaces = []
+    action_names = None
 
     def __init__(self, app_label, name):
         self.app_label = app_label
         self.name = name
 
-    def load(self, path):
-        "Reads the migration into memory"
+    def load(self, path, cache=None):
+        """
+        Reads the migration's header (its dependencies and what it replaces)
+        into memory. The actions are only loaded when they're first accessed,
+        as most runs only need the dependency graph. If a MigrationCache is passed,
+        headers and compiled code are fetched from and saved to it.
+        """
         # We don't use import here as we don't require migration files
         # to be on an importable path (they can be either Python or .sql files)
+        with open(path, "rb") as fh:
+            source = fh.read()
+        self.path = path
+        self.cache = cache
+        self.source_hash = hashlib.sha1(source).hexdigest()
+        self._actions = None
+        self._payload = None
+        if cache is not None:
+            self._payload = cache.get(path, self.source_hash)
+        if self._payload is None or "actions" not in self._payload.get("header", {}):
+            self._payload = {}
+            header = self.read_header(source)
+            if header is None:
+                # Can't tell without running it, so load the whole thing now
+                self.load_body(source)
+            else:
+                self._payload["header"] = header
+                self.save_payload()
+        self.dependencies = self._payload["header"]["dependencies"]
+        self.replaces = self._payload["header"]["replaces"]
+        self.action_names = self._payload["header"]["actions"]
+
+    def read_header(self, source):
+        "Returns the header parsed from the file's source, or None"
+        return parse_header(source, self.path)
+
+    def load_body(self, source=None):
+        "Runs the migration file and renders its actions"
+        if "code" not in self._payload:
+            if source is None:
+                with open(self.path, "rb") as fh:
+                    source = fh.read()
+            self._payload["code"] = compile(source, self.path, "exec")
+            self.save_payload()
         context = {}
-        execfile(path, context, context)
+        exec self._payload["code"] in context
         migration = context['Migration']
-        self.actions = [action.render(self.app_label) for action in migration.actions]
-        self.dependencies = migration.dependencies
+        self._actions = [action.render(self.app_label) for action in migration.actions]
+        self._payload["header"] = {
+            "dependencies": [tuple(d) for d in migration.dependencies],
+            "replaces": [tuple(r) for r in migration.replaces],
+            "actions": [action.__class__.__name__ for action in migration.actions],
+        }
+        self.dependencies = self._payload["header"]["dependencies"]
+        self.replaces = self._payload["header"]["replaces"]
+        self.action_names = self._payload["header"]["actions"]
+        self.save_payload()
+
+    def save_payload(self):
+        "Writes what we know about the file back to the cache, if there is one"
+        if self.cache is not None and "header" in self._payload:
+            self.cache.set(self.path, self.source_hash, self._payload)
+
+    @property
+    def loaded(self):
+        "True if the migration's actions have been loaded"
+        return self._actions is not None
+
+    def get_actions(self):
+        if self._actions is None:
+            self.load_body()
+        return self._actions
+
+    def set_actions(self, actions):
+        self._actions = actions
+
+    actions = property(get_actions, set_actions)
 
     def __eq__(self, other):
         try:
@@ -46,6 +169,9 @@ class RootMigration(Migration):
     """
 
     is_root = True
+    actions = []
+    action_names = []
+    loaded = True
 
     def __init__(self, app_label):
         self.app_label = app_label
@@ -1,20 +1,80 @@
-from django.db import DEFAULT_DB_ALIAS
-from .models import AppliedMigration
+import sys
+import Queue
+import threading
+from itertools import islice
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from .optimizer import Optimizer
+from .profiler import Profiler
+from .recorder import MigrationRecorder
+from .schema import SchemaEditor
 
 
 class Migrator(object):
     """
     Handles execution of migrations.
+
+    Applied migrations are recorded in batches of batch_size migrations, or
+    once at the end of the plan if batch_size is None. On backends with
+    transactional DDL, each batch's schema changes and records share a
+    single transaction. Elsewhere, schema changes can't be undone, so each
+    migration's changes are run and it's recorded as soon as it finishes;
+    if one fails, everything before it stays recorded, and any column
+    changes it still had buffered are thrown away rather than run.
+
+    If workers is more than one, migrations that don't depend on each other
+    are run concurrently on that many threads; see execute_plan_parallel.
+
+    If optimize is set, actions are folded together across the plan by an
+    Optimizer (available as self.optimizer) before they're run. Folded
+    actions can span migrations, so optimized plans always run (and are
+    recorded) as a single batch, on one thread.
+
+    Column changes are buffered by a SchemaEditor for each batch, so each
+    table is altered as few times as possible per batch.
+
+    Plans can also be compiled to SQL scripts, without touching the
+    database at all; see compile_plan.
+
+    If profile is set, timings and statement counts for everything run are
+    recorded by a Profiler (available as self.profiler).
+
+    If online is an OnlineSchemaChanger, changes to existing tables are
+    made by rebuilding them online (see migrations.online). Those copy
+    rows in chunks that are committed as they go, so on backends with
+    transactional DDL, batches aren't run in a transaction of their own;
+    nor are batches with actions that commit as they go (see
+    Action.atomic), such as data migrations.
+
+    If checkpoint is set, each action is recorded as it finishes (its
+    schema changes are run straight away, rather than buffered), and
+    actions already recorded are skipped, so a migration that was
+    interrupted carries on from where it stopped. Optimized plans fold
+    actions differently from one run to the next, so can't be
+    checkpointed.
     """
 
-    def __init__(self, loader):
+    def __init__(self, loader, batch_size=1, workers=1, optimize=False, profile=False, online=None,
+                 checkpoint=False):
+        if optimize and checkpoint:
+            raise ValueError("Optimized plans can't be checkpointed")
         self.loader = loader
+        self.recorder = MigrationRecorder(loader, track_actions=checkpoint)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.optimizer = Optimizer() if optimize else None
+        self.profiler = Profiler() if profile else None
+        self.online = online
+        self.checkpoint = checkpoint
 
     def calculate_plan(self, app=None, target=None, database=DEFAULT_DB_ALIAS):
         """
         Entrypoint for a migration command.
         Plans the execution, and then executes it.
         """
+        # Squashed migrations might need swapping for the ones they replace
+        applied = self.recorder.applied_migrations(database)
+        if self.loader.replacements:
+            self.loader.calculate_dependencies(applied)
         # Work out what targets they want
         if app is None:
             targets = [self.loader.get_top_migration(app_label) for app_label in self.loader.migrations.keys()]
@@ -23,18 +83,306 @@ class Migrator(object):
         else:
             targets = [self.loader.get_migration_by_prefix(app, target)]
         # Make a plan for that, taking already-applied ones into account
-        return self.loader.plan(targets, [(a.app_label, a.name) for a in AppliedMigration.objects.using(database)])
+        return self.loader.plan(targets, applied)
 
     def execute_plan(self, plan, database=DEFAULT_DB_ALIAS):
         "Executes the supplied plan"
-        for forwards, migration in plan:
-            self.log_migration_start(migration, forwards)
-            action_states = self.loader.action_states(migration, forwards)
-            for action, from_state, to_state in action_states:
-                self.log_action_start(migration, action, forwards)
-                action.alter_database(from_state, to_state, database, forwards)
-                self.log_action_end(migration, action, forwards)
-            self.log_migration_end(migration, forwards)
+        self.check_online(database)
+        if self.workers > 1 and self.optimizer is None:
+            return self.execute_plan_parallel(plan, database)
+        self.execute_entries(self.plan_entries(plan), database)
+
+    def execute_entries(self, entries, database=DEFAULT_DB_ALIAS):
+        """
+        Executes (forwards, migration, action_states) entries, as returned
+        by plan_entries, in order. The entries aren't changed, so they can
+        be shared between databases.
+        """
+        self.check_online(database)
+        transactional = self.has_transactional_ddl(database) and self.online is None
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, self.entry_batch_size() or None))
+            if not batch:
+                break
+            try:
+                if transactional and self.is_atomic(batch):
+                    with transaction.commit_on_success(using=database):
+                        self.execute_batch(batch, database)
+                else:
+                    self.execute_batch(batch, database, atomic=False)
+            except BaseException:
+                # Nothing that failed is recorded (with transactional DDL,
+                # the whole batch's records were rolled back with it)
+                self.recorder.discard_queued(database)
+                raise
+        self.record_replacements(database)
+
+    def execute_batch(self, batch, database, atomic=True):
+        """
+        Executes a list of (forwards, migration, action_states) and records
+        them. Migrations are only queued to be recorded once the editor's
+        buffered changes have been run, so if anything fails, whatever's
+        still buffered is never run and isn't recorded.
+
+        If the batch isn't atomic (its schema changes can't be rolled back
+        along with its records), that happens after each migration rather
+        than once at the end, so the migrations that did finish are
+        recorded.
+        """
+        editor = self.schema_editor(database)
+        finished = []
+        for forwards, migration, action_states in batch:
+            self.execute_migration(forwards, migration, action_states, database, editor)
+            finished.append((forwards, migration))
+            if not atomic:
+                self.record_finished(finished, database, editor)
+                finished = []
+        if finished:
+            self.record_finished(finished, database, editor)
+
+    def record_finished(self, finished, database, editor):
+        "Runs the editor's buffered changes, then records the (forwards, migration) pairs"
+        started = self.profiler and self.profiler.start(editor)
+        editor.flush()
+        if started:
+            self.profiler.flush_done(started, editor)
+        for forwards, migration in finished:
+            if forwards:
+                self.recorder.queue_applied(migration, database)
+            else:
+                self.recorder.queue_unapplied(migration, database)
+        self.recorder.flush_records(database)
+
+    def is_atomic(self, entries):
+        "Returns True if every action in the plan entries can run inside a transaction"
+        return all(
+            action.atomic
+            for forwards, migration, action_states in entries
+            for action, from_state, to_state in action_states
+        )
+
+    def entry_batch_size(self):
+        "Returns how many plan entries to run per batch, or None for all of them"
+        return None if self.optimizer is not None else self.batch_size
+
+    def plan_entries(self, plan):
+        """
+        Returns (forwards, migration, action_states) for each entry in the
+        plan, optimized if the migrator has an optimizer.
+        """
+        entries = self.loader.plan_action_states(plan)
+        if self.profiler is not None:
+            entries = self.profiler.time_states(entries)
+        if self.optimizer is not None:
+            entries = self.optimizer.optimize_plan(list(entries))
+        return entries
+
+    def flush_records(self, database):
+        "Writes any queued records in their own transaction"
+        with transaction.commit_on_success(using=database):
+            self.recorder.flush_records(database)
+
+    def record_replacements(self, database=DEFAULT_DB_ALIAS):
+        """
+        Records squashed migrations whose replaced migrations are now all
+        applied as applied themselves, so they stay applied once the
+        replaced migrations are removed. Called after each plan is run.
+        """
+        applied = self.recorder.applied_migrations(database)
+        for migration, replaced in self.loader.replacements.items():
+            if replaced and migration not in applied and all(m in applied for m in replaced):
+                self.recorder.queue_applied(migration, database)
+        self.flush_records(database)
+
+    def plan_prerequisites(self, plan):
+        """
+        Returns a list with a set for each plan entry, containing the
+        positions of the earlier entries that have to finish before it can
+        start: the migrations it depends on (or, going backwards, that
+        depend on it), plus the whole of the previous run of entries
+        whenever the plan changes direction.
+        """
+        result = []
+        positions = {}
+        run_start = previous_run_start = 0
+        for i, (forwards, migration) in enumerate(plan):
+            if i and forwards != plan[i - 1][0]:
+                previous_run_start, run_start = run_start, i
+            if forwards:
+                linked = self.loader.get_forward_dependencies(migration)
+            else:
+                linked = self.loader.get_backwards_dependencies(migration)
+            prerequisites = set(positions[m] for m in linked if positions.get(m, -1) >= run_start)
+            if run_start:
+                prerequisites.update(range(previous_run_start, run_start))
+            result.append(prerequisites)
+            positions[migration] = i
+        return result
+
+    def execute_plan_parallel(self, plan, database=DEFAULT_DB_ALIAS):
+        """
+        Executes the plan on a pool of self.workers threads, each with its
+        own database connection. Each migration starts as soon as
+        everything it has to wait for (see plan_prerequisites) is done.
+        States are worked out up front, and records are written from this
+        thread as migrations finish. On backends with transactional DDL,
+        each migration runs in its own transaction.
+        If a migration fails, nothing new is started, and the error is
+        raised once the running ones have finished and been recorded.
+        """
+        entries = list(self.plan_entries(plan))
+        waiting = self.plan_prerequisites(plan)
+        dependents = {}
+        for i, prerequisites in enumerate(waiting):
+            for j in prerequisites:
+                dependents.setdefault(j, []).append(i)
+        work, results = Queue.Queue(), Queue.Queue()
+        threads = [
+            threading.Thread(target=self.execute_worker, args=(entries, work, results, database))
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        ready = [i for i, prerequisites in enumerate(waiting) if not prerequisites]
+        running = unflushed = 0
+        error = None
+        try:
+            while True:
+                if error is None:
+                    for i in sorted(ready):
+                        work.put(i)
+                        running += 1
+                    ready = []
+                if not running:
+                    break
+                i, exc_info = results.get()
+                running -= 1
+                if exc_info is not None:
+                    error = error or exc_info
+                    continue
+                forwards, migration, action_states = entries[i]
+                if forwards:
+                    self.recorder.queue_applied(migration, database)
+                else:
+                    self.recorder.queue_unapplied(migration, database)
+                unflushed += 1
+                if self.batch_size and unflushed >= self.batch_size:
+                    self.flush_records(database)
+                    unflushed = 0
+                for j in dependents.get(i, []):
+                    waiting[j].discard(i)
+                    if not waiting[j]:
+                        ready.append(j)
+        finally:
+            for thread in threads:
+                work.put(None)
+            self.flush_records(database)
+        if error is not None:
+            raise error[0], error[1], error[2]
+        self.record_replacements(database)
+
+    def execute_worker(self, entries, work, results, database):
+        "Runs plan entries from the work queue until it gets a None"
+        try:
+            transactional = self.has_transactional_ddl(database) and self.online is None
+            while True:
+                i = work.get()
+                if i is None:
+                    return
+                try:
+                    if transactional and self.is_atomic([entries[i]]):
+                        with transaction.commit_on_success(using=database):
+                            self.execute_migration(*entries[i], database=database)
+                    else:
+                        self.execute_migration(*entries[i], database=database)
+                except Exception:
+                    results.put((i, sys.exc_info()))
+                else:
+                    results.put((i, None))
+        finally:
+            connections[database].close()
+
+    def execute_migration(self, forwards, migration, action_states, database, editor=None):
+        """
+        Runs a single migration's actions against the database. If no
+        SchemaEditor is passed, one is made and flushed at the end.
+        """
+        flush = editor is None
+        if flush:
+            editor = self.schema_editor(database)
+        migration_started = self.profiler and self.profiler.start(editor)
+        self.log_migration_start(migration, forwards)
+        done = self.recorder.applied_actions(migration, forwards, database) if self.checkpoint else set()
+        for index, (action, from_state, to_state) in enumerate(action_states):
+            if index in done:
+                self.log_action_skipped(migration, action, forwards)
+                continue
+            self.log_action_start(migration, action, forwards)
+            started = self.profiler and self.profiler.start(editor)
+            action.alter_database(from_state, to_state, editor, forwards)
+            if self.checkpoint:
+                # The action has to have reached the database before it's
+                # recorded
+                editor.flush()
+                self.recorder.record_action(migration, index, forwards, database)
+            if started:
+                self.profiler.action_done(started, migration, action, forwards, editor)
+            self.log_action_end(migration, action, forwards)
+        if flush:
+            editor.flush()
+        if migration_started:
+            self.profiler.migration_done(migration_started, migration, forwards, editor, len(action_states))
+        self.log_migration_end(migration, forwards)
+
+    def compile_plan(self, plan, database=DEFAULT_DB_ALIAS, transactions=False):
+        """
+        Returns the statements executing the plan would run against the
+        database, in order, including the ones that record migrations as
+        applied or unapplied; nothing is run, and nothing is recorded.
+        Statements are grouped into batches as for execute_plan; if
+        transactions is set, each migration (or an optimized plan as a
+        whole) is a batch of its own and is wrapped in BEGIN and COMMIT.
+        """
+        self.check_online(database)
+        editor = self.schema_editor(database, collect_sql=True)
+        entries = iter(self.plan_entries(plan))
+        batch_size = 1 if transactions and self.optimizer is None else self.entry_batch_size()
+        while True:
+            batch = list(islice(entries, batch_size or None))
+            if not batch:
+                break
+            if transactions:
+                editor.execute("BEGIN;")
+            for forwards, migration, action_states in batch:
+                for action, from_state, to_state in action_states:
+                    action.alter_database(from_state, to_state, editor, forwards)
+            editor.flush()
+            for forwards, migration, action_states in batch:
+                for sql in self.recorder.record_sql(migration, forwards, database):
+                    editor.execute(sql)
+            if transactions:
+                editor.execute("COMMIT;")
+        return [sql for sql, params in editor.executed]
+
+    def schema_editor(self, database, collect_sql=False):
+        "Returns a new SchemaEditor for the database"
+        return SchemaEditor(database, collect_sql=collect_sql, online=self.online)
+
+    def check_online(self, database):
+        """
+        Raises NotImplementedError if the migrator makes online schema
+        changes and the database doesn't support them, before anything
+        has been run.
+        """
+        if self.online is not None:
+            self.online.check_vendor(connections[database])
+
+    def has_transactional_ddl(self, database):
+        "Returns True if schema changes on the database can be rolled back"
+        connection = connections[database]
+        return getattr(connection.features, "can_rollback_ddl", connection.vendor == "postgresql")
 
     def log_migration_start(self, migration, forwards):
         pass
@@ -47,3 +395,6 @@ class Migrator(object):
 
     def log_action_end(self, migration, action, forwards):
         pass
+
+    def log_action_skipped(self, migration, action, forwards):
+        pass
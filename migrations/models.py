@@ -10,5 +10,68 @@ class AppliedMigration(models.Model):
     name = models.CharField(max_length=255)
     applied = models.DateTimeField(blank=True)
 
+    class Meta:
+        unique_together = [("app_label", "name")]
+
+    def __unicode__(self):
+        return "<%s: %s>" % (self.app_label, self.name)
+
+
+class AppliedAction(models.Model):
+    """
+    Tracks an action of a migration having been run against this database
+    (forwards or backwards) while the migration as a whole hasn't been, so
+    an interrupted migration can carry on from its next action. Actions
+    are identified by their position in the migration's run, which only
+    means the same thing while the migration's file is unchanged, so the
+    file's hash is kept too.
+    """
+
+    app_label = models.CharField(max_length=255)
+    migration = models.CharField(max_length=255)
+    forwards = models.BooleanField(default=True)
+    index = models.IntegerField()
+    source_hash = models.CharField(max_length=40, blank=True)
+    applied = models.DateTimeField(blank=True)
+
+    class Meta:
+        unique_together = [("app_label", "migration", "forwards", "index")]
+
+    def __unicode__(self):
+        return "<%s: %s action %i>" % (self.app_label, self.migration, self.index)
+
+
+class GraphFingerprint(models.Model):
+    """
+    Holds the fingerprint (see Loader.graph_fingerprint) of the migration
+    graph that was last applied to this database in full. It's removed
+    whenever a migration is unapplied, so while it's here, every
+    migration in that graph is applied.
+    """
+
+    fingerprint = models.CharField(max_length=64)
+    recorded = models.DateTimeField(blank=True)
+
+    def __unicode__(self):
+        return "<%s>" % self.fingerprint
+
+
+class DataMigrationCheckpoint(models.Model):
+    """
+    Tracks how far a batched data migration (see actions.RunBatches) has
+    got through one part of its table, so an interrupted run can carry on
+    from there. Primary keys are stored as text.
+    """
+
+    name = models.CharField(max_length=255)
+    partition = models.IntegerField()
+    last_pk = models.CharField(max_length=255, null=True)
+    end_pk = models.CharField(max_length=255, null=True)
+    done = models.BooleanField(default=False)
+    updated = models.DateTimeField(blank=True)
+
+    class Meta:
+        unique_together = [("name", "partition")]
+
     def __unicode__(self):
-        return "<%s: %s>" % (self.app_name, self.migration)
+        return "<%s: %s after %s>" % (self.name, self.partition, self.last_pk)
@@ -0,0 +1,289 @@
+"""
+Online schema changes, which rebuild a table without holding a lock on it
+for the length of an ALTER TABLE: the new form of the table is created
+alongside the old one as a shadow table, triggers copy any writes to the
+old table across as they happen, existing rows are copied over in
+primary key ranges, and the two tables are then swapped in one
+transaction.
+
+Supported on SQLite and PostgreSQL.
+"""
+
+import copy
+import time
+from django.db import models, transaction
+from django.db.backends.util import truncate_name
+from .schema import effective_default, quote_value
+from .state import make_model
+
+
+class OnlineSchemaChanger(object):
+    """
+    Rebuilds tables online for a SchemaEditor; see SchemaEditor.change_table.
+
+    Rows are copied chunk_size primary keys at a time, each chunk committed
+    on its own, with a pause of throttle seconds between chunks to leave
+    the database some room for other work.
+
+    Tables referenced by foreign keys from other tables can't be rebuilt
+    on PostgreSQL, as those constraints follow the old table; the swap
+    fails, and is rolled back, when the old table is dropped.
+
+    If a rebuild fails (say, the new form of the table has a unique
+    constraint the rows don't meet), the shadow table and triggers are
+    removed again, leaving the table as it was.
+    """
+
+    vendors = ["sqlite", "postgresql"]
+
+    def __init__(self, chunk_size=10000, throttle=0.0):
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+
+    def check_vendor(self, connection):
+        "Raises NotImplementedError if tables can't be rebuilt online on the connection"
+        if connection.vendor not in self.vendors:
+            raise NotImplementedError("Online schema changes are not supported on %s" % connection.vendor)
+
+    def change_table(self, editor, from_model, to_model):
+        "Rebuilds from_model's table in the form of to_model"
+        self.check_vendor(editor.connection)
+        vendor = editor.connection.vendor
+        table = from_model._meta.db_table
+        shadow = self.table_name(editor, table, "shadow")
+        old = self.table_name(editor, table, "old")
+        try:
+            self.create_shadow(editor, vendor, to_model, shadow)
+            columns, defaults = self.copied_columns(editor, from_model, to_model)
+            for sql in self.trigger_sql(editor, vendor, from_model, shadow, columns, defaults):
+                editor.execute(sql)
+            self.copy_rows(editor, from_model, shadow, columns, defaults)
+            editor.execute_atomic(self.swap_sql(editor, vendor, to_model, table, shadow, old))
+        except BaseException:
+            if not editor.collect_sql:
+                self.clean_up(editor, vendor, table, shadow)
+            raise
+        if vendor == "postgresql":
+            editor.execute("DROP FUNCTION %s();" % editor.quote_name(self.table_name(editor, table, "sync")))
+
+    def clean_up(self, editor, vendor, table, shadow):
+        """
+        Removes whatever a failed rebuild of table left behind. Errors are
+        ignored, so the one that stopped the rebuild is what's raised.
+        """
+        qn = editor.quote_name
+        if vendor == "sqlite":
+            statements = [
+                "DROP TRIGGER IF EXISTS %s;" % qn(self.table_name(editor, table, suffix))
+                for suffix in ["insert", "update", "delete"]
+            ]
+        else:
+            function = qn(self.table_name(editor, table, "sync"))
+            statements = [
+                "DROP TRIGGER IF EXISTS %s ON %s;" % (function, qn(table)),
+                "DROP FUNCTION IF EXISTS %s();" % function,
+            ]
+        statements.append("DROP TABLE IF EXISTS %s;" % qn(shadow))
+        # The failed statement may have left the transaction unusable
+        transaction.rollback_unless_managed(using=editor.database)
+        for sql in statements:
+            try:
+                editor.execute(sql)
+            except Exception:
+                transaction.rollback_unless_managed(using=editor.database)
+            else:
+                transaction.commit_unless_managed(using=editor.database)
+
+    def table_name(self, editor, table, suffix):
+        "Returns the name of something made for rebuilding table"
+        return truncate_name("%s__%s" % (table, suffix), editor.connection.ops.max_name_length())
+
+    def create_shadow(self, editor, vendor, model, shadow):
+        """
+        Creates the table for model, called shadow. A copy of the model is
+        made for it, as rendered models are shared.
+
+        Its indexes are named after the shadow table, so have to be given
+        their real names once it's swapped in (see swap_sql). SQLite can't
+        rename indexes, so there they're made at the swap instead.
+        """
+        meta = type("Meta", (), {
+            "app_label": model._meta.app_label,
+            "db_table": shadow,
+            "db_tablespace": model._meta.db_tablespace,
+            "unique_together": model._meta.unique_together,
+            "index_together": model._meta.index_together,
+        })
+        body = dict((field.name, copy.deepcopy(field)) for field in model._meta.local_fields)
+        body["Meta"] = meta
+        editor.create_model(
+            make_model(model._meta.app_label, model._meta.object_name, [models.Model], body),
+            indexes = vendor != "sqlite",
+        )
+
+    def copied_columns(self, editor, from_model, to_model):
+        """
+        Returns the shadow table's columns, and for each one the default
+        it's filled with as an SQL literal, or None if it's copied from
+        the old table's column of the same name.
+        """
+        existing = set(field.column for field in from_model._meta.local_fields)
+        columns, defaults = [], []
+        for field in to_model._meta.local_fields:
+            columns.append(field.column)
+            if field.column in existing:
+                defaults.append(None)
+            else:
+                default = effective_default(field)
+                if default is not None:
+                    default = field.get_db_prep_save(default, connection=editor.connection)
+                defaults.append(quote_value(default))
+        return columns, defaults
+
+    def values_sql(self, editor, columns, defaults, prefix=""):
+        "Returns the expressions giving the shadow table's columns from an old row"
+        return ", ".join(
+            default if default is not None else prefix + editor.quote_name(column)
+            for column, default in zip(columns, defaults)
+        )
+
+    def trigger_sql(self, editor, vendor, model, shadow, columns, defaults):
+        """
+        Returns the statements creating the triggers that keep the shadow
+        table up to date with writes to model's table. Each write replaces
+        the row in the shadow table, so it doesn't matter whether the copy
+        has reached it yet.
+        """
+        qn = editor.quote_name
+        table = model._meta.db_table
+        pk = qn(model._meta.pk.column)
+        delete = "DELETE FROM %s WHERE %s = OLD.%s;" % (qn(shadow), pk, pk)
+        delete_new = "DELETE FROM %s WHERE %s = NEW.%s;" % (qn(shadow), pk, pk)
+        insert = "INSERT INTO %s (%s) VALUES (%s);" % (
+            qn(shadow),
+            ", ".join(qn(column) for column in columns),
+            self.values_sql(editor, columns, defaults, "NEW."),
+        )
+        if vendor == "sqlite":
+            return [
+                "CREATE TRIGGER %s AFTER INSERT ON %s BEGIN %s %s END;" % (
+                    qn(self.table_name(editor, table, "insert")), qn(table), delete_new, insert,
+                ),
+                "CREATE TRIGGER %s AFTER UPDATE ON %s BEGIN %s %s %s END;" % (
+                    qn(self.table_name(editor, table, "update")), qn(table), delete, delete_new, insert,
+                ),
+                "CREATE TRIGGER %s AFTER DELETE ON %s BEGIN %s END;" % (
+                    qn(self.table_name(editor, table, "delete")), qn(table), delete,
+                ),
+            ]
+        function = qn(self.table_name(editor, table, "sync"))
+        return [
+            "CREATE FUNCTION %s() RETURNS trigger AS $$ BEGIN "
+            "IF TG_OP IN ('UPDATE', 'DELETE') THEN %s END IF; "
+            "IF TG_OP IN ('INSERT', 'UPDATE') THEN %s %s END IF; "
+            "RETURN NULL; END; $$ LANGUAGE plpgsql;" % (function, delete, delete_new, insert),
+            "CREATE TRIGGER %s AFTER INSERT OR UPDATE OR DELETE ON %s FOR EACH ROW EXECUTE PROCEDURE %s();" % (
+                function, qn(table), function,
+            ),
+        ]
+
+    def copy_sql(self, editor, model, shadow, columns, defaults, ranged):
+        """
+        Returns the statement copying rows the shadow table doesn't have yet
+        across from model's table, between two primary keys if ranged.
+        """
+        qn = editor.quote_name
+        pk = qn(model._meta.pk.column)
+        sql = "INSERT INTO %s (%s) SELECT %s FROM %s WHERE NOT EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s)" % (
+            qn(shadow),
+            ", ".join(qn(column) for column in columns),
+            self.values_sql(editor, columns, defaults),
+            qn(model._meta.db_table),
+            qn(shadow),
+            qn(shadow), pk, qn(model._meta.db_table), pk,
+        )
+        if ranged:
+            sql += " AND %s >= %%s AND %s < %%s" % (pk, pk)
+        return sql + ";"
+
+    def copy_rows(self, editor, model, shadow, columns, defaults):
+        """
+        Copies the rows already in model's table to the shadow table, in
+        chunks of primary keys if they're integers.
+        """
+        if editor.collect_sql:
+            editor.execute(self.copy_sql(editor, model, shadow, columns, defaults, False))
+            return
+        pk = editor.quote_name(model._meta.pk.column)
+        low, high = editor.query("SELECT MIN(%s), MAX(%s) FROM %s;" % (
+            pk, pk, editor.quote_name(model._meta.db_table),
+        ))[0]
+        if low is None:
+            return
+        if not isinstance(low, (int, long)):
+            editor.execute(self.copy_sql(editor, model, shadow, columns, defaults, False))
+            transaction.commit_unless_managed(using=editor.database)
+            return
+        sql = self.copy_sql(editor, model, shadow, columns, defaults, True)
+        for start in xrange(low, high + 1, self.chunk_size):
+            editor.execute(sql, (start, start + self.chunk_size))
+            transaction.commit_unless_managed(using=editor.database)
+            self.chunk_done(editor, model._meta.db_table, start, min(start + self.chunk_size, high + 1))
+            if self.throttle:
+                time.sleep(self.throttle)
+
+    def swap_sql(self, editor, vendor, model, table, shadow, old):
+        "Returns the statements that put the shadow table in place of the old one"
+        qn = editor.quote_name
+        if vendor == "sqlite":
+            # Stop SQLite pointing other tables' references at the old table
+            # as it's renamed
+            statements = ["PRAGMA legacy_alter_table = ON;"] + [
+                "DROP TRIGGER %s;" % qn(self.table_name(editor, table, suffix))
+                for suffix in ["insert", "update", "delete"]
+            ]
+        else:
+            statements = ["LOCK TABLE %s IN ACCESS EXCLUSIVE MODE;" % qn(table)]
+            pk = model._meta.pk
+            if pk.get_internal_type() == "AutoField":
+                statements.append("SELECT setval(pg_get_serial_sequence('%s', '%s'), COALESCE(MAX(%s), 1)) FROM %s;" % (
+                    shadow, pk.column, qn(pk.column), qn(shadow),
+                ))
+        statements.extend([
+            "ALTER TABLE %s RENAME TO %s;" % (qn(table), qn(old)),
+            "ALTER TABLE %s RENAME TO %s;" % (qn(shadow), qn(table)),
+            "DROP TABLE %s;" % qn(old),
+        ])
+        if vendor == "sqlite":
+            statements.extend(editor.connection.creation.sql_indexes_for_model(model, editor.style))
+            statements.append("PRAGMA legacy_alter_table = OFF;")
+        else:
+            statements.append(self.rename_sql(shadow, table))
+        return statements
+
+    def rename_sql(self, shadow, table):
+        """
+        Returns the PostgreSQL statement giving the indexes (including those
+        behind constraints) and sequences made for the shadow table the
+        names they'd have had if they were made for table, so the next
+        rebuild's shadow table doesn't clash with them.
+        """
+        return (
+            "DO $$ DECLARE r record; BEGIN "
+            "FOR r IN SELECT c.relname, c.relkind FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = current_schema() AND c.relkind IN ('i', 'S') "
+            "AND substr(c.relname, 1, %(length)i) = %(shadow)s LOOP "
+            "EXECUTE 'ALTER ' || CASE r.relkind WHEN 'i' THEN 'INDEX ' ELSE 'SEQUENCE ' END "
+            "|| quote_ident(r.relname) || ' RENAME TO ' "
+            "|| quote_ident(%(table)s || substr(r.relname, %(length)i + 1)); "
+            "END LOOP; END $$;" % {
+                "length": len(shadow),
+                "shadow": quote_value(shadow),
+                "table": quote_value(table),
+            }
+        )
+
+    def chunk_done(self, editor, table, start, end):
+        "Called after the rows with primary keys from start up to end are copied"
+        pass
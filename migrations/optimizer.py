@@ -0,0 +1,203 @@
+"""
+Plan-level optimisation of actions, so that fresh installs run fewer,
+larger operations against the database.
+"""
+
+from itertools import groupby
+from .actions import CreateModel, DeleteModel, AlterModelOption, CreateField, DeleteField
+from .state import related_model_key
+
+
+class Optimizer(object):
+    """
+    Takes the flattened actions of a plan and folds them together:
+
+     - CreateField and AlterModelOption are folded into an earlier
+       CreateModel of the same model, as long as a related field's target
+       isn't created or changed in between
+     - A CreateField followed by a DeleteField of the same field cancel out
+     - A CreateModel followed by a DeleteModel cancel out, along with any
+       actions on the model in between, as long as no other model refers
+       to it in the meantime
+     - Consecutive AlterModelOptions setting the same option on the same
+       model are collapsed into the last one
+
+    Folded actions run with the from_state of the first action involved and
+    the to_state of the last one, and are attributed to the migration the
+    first action came from. Keeps counts of actions before and after.
+    """
+
+    def __init__(self):
+        self.before = 0
+        self.after = 0
+
+    def report(self):
+        "Returns a human-readable summary of what was optimized"
+        return "Optimized %i actions down to %i." % (self.before, self.after)
+
+    def optimize_plan(self, entries):
+        """
+        Given a list of (forwards, migration, action_states) entries (as
+        returned by Loader.plan_action_states), returns a list of the same
+        shape with each run of forwards migrations optimized. Migrations
+        whose actions have all been folded elsewhere stay in the list with
+        no actions, so they're still recorded.
+        """
+        result = []
+        for forwards, run in groupby(entries, key=lambda entry: entry[0]):
+            run = list(run)
+            if not forwards:
+                result.extend(run)
+                continue
+            flattened = [
+                (migration, action, from_state, to_state)
+                for _, migration, action_states in run
+                for action, from_state, to_state in action_states
+            ]
+            by_migration = {}
+            for migration, action, from_state, to_state in self.optimize(flattened):
+                by_migration.setdefault(migration, []).append((action, from_state, to_state))
+            for _, migration, _ in run:
+                result.append((True, migration, by_migration.get(migration, [])))
+        return result
+
+    def optimize(self, entries):
+        """
+        Optimizes a list of (migration, action, from_state, to_state)
+        forwards entries, returning a new list.
+        """
+        result = []
+        for entry in entries:
+            self.before += 1
+            if not self.reduce(result, entry):
+                result.append(entry)
+        self.after += len(result)
+        return result
+
+    def reduce(self, result, entry):
+        """
+        Tries to fold entry into the entries already in result, changing
+        result in place. Returns True if it managed to.
+        """
+        migration, action, from_state, to_state = entry
+        if isinstance(action, CreateField):
+            return self.reduce_create_field(result, entry)
+        elif isinstance(action, DeleteField):
+            return self.reduce_delete_field(result, entry)
+        elif isinstance(action, DeleteModel):
+            return self.reduce_delete_model(result, entry)
+        elif isinstance(action, AlterModelOption):
+            return self.reduce_alter_option(result, entry)
+        return False
+
+    def find_create_model(self, result, action, target=None):
+        """
+        Returns the position in result of the CreateModel for the action's
+        model, if nothing in between touches or refers to that model, or
+        creates or changes the model with the key target (what the action's
+        field refers to, if anything).
+        """
+        key = (action.app_label, action.model_name)
+        for i in range(len(result) - 1, -1, -1):
+            other = result[i][1]
+            if isinstance(other, CreateModel) and (other.app_label, other.model_name) == key:
+                return i
+            if touches(other, key) or (other.app_label, other.model_name) == target:
+                return None
+        return None
+
+    def replace_create_model(self, result, i, entry, **changes):
+        "Replaces the CreateModel at result[i] with a changed copy"
+        migration, create_model, from_state, to_state = result[i]
+        kwargs = dict(
+            app_label = create_model.app_label,
+            model_name = create_model.model_name,
+            fields = list(create_model.fields),
+            bases = create_model.bases,
+            options = dict(create_model.options),
+        )
+        kwargs.update(changes)
+        result[i] = (migration, CreateModel(**kwargs), from_state, entry[3])
+
+    def reduce_create_field(self, result, entry):
+        action = entry[1]
+        i = self.find_create_model(result, action, related_model_key(action.app_label, action.instance))
+        if i is None:
+            return False
+        fields = list(result[i][1].fields) + [(action.name, action.instance)]
+        self.replace_create_model(result, i, entry, fields=fields)
+        return True
+
+    def reduce_delete_field(self, result, entry):
+        action = entry[1]
+        key = (action.app_label, action.model_name)
+        skipped = False
+        for i in range(len(result) - 1, -1, -1):
+            other = result[i][1]
+            if isinstance(other, CreateModel) and (other.app_label, other.model_name) == key:
+                # The folded CreateModel renders with this action's to_state,
+                # so it can only skip over other changes to the model if
+                # they were folded into it too
+                fields = [(name, field) for name, field in other.fields if name != action.name]
+                if skipped or len(fields) == len(other.fields):
+                    return False
+                self.replace_create_model(result, i, entry, fields=fields)
+                return True
+            if isinstance(other, CreateField) and (other.app_label, other.model_name, other.name) == key + (action.name,):
+                del result[i]
+                return True
+            # Other field changes to the model don't stop the field being
+            # cancelled out
+            if isinstance(other, (CreateField, DeleteField)) and (other.app_label, other.model_name) == key:
+                skipped = True
+                continue
+            if touches(other, key):
+                return False
+        return False
+
+    def reduce_delete_model(self, result, entry):
+        action = entry[1]
+        key = (action.app_label, action.model_name)
+        own_actions = []
+        for i in range(len(result) - 1, -1, -1):
+            other = result[i][1]
+            if (other.app_label, other.model_name) == key:
+                own_actions.append(i)
+                if isinstance(other, CreateModel):
+                    for j in own_actions:
+                        del result[j]
+                    return True
+            elif touches(other, key):
+                return False
+        return False
+
+    def reduce_alter_option(self, result, entry):
+        action = entry[1]
+        previous = result[-1][1] if result else None
+        if isinstance(previous, AlterModelOption) and \
+                (previous.app_label, previous.model_name, previous.name) == (action.app_label, action.model_name, action.name):
+            result[-1] = (result[-1][0], action, result[-1][2], entry[3])
+            return True
+        i = self.find_create_model(result, action)
+        if i is None:
+            return False
+        options = dict(result[i][1].options)
+        options[action.name] = action.value
+        self.replace_create_model(result, i, entry, options=options)
+        return True
+
+
+def touches(action, key):
+    """
+    Returns True if the action changes the model with the given key, or
+    adds a field that refers to it.
+    """
+    if (action.app_label, action.model_name) == key:
+        return True
+    if isinstance(action, CreateModel):
+        fields = action.fields
+    elif isinstance(action, CreateField):
+        fields = [(action.name, action.instance)]
+    else:
+        fields = []
+    return any(related_model_key(action.app_label, field) == key for name, field in fields)
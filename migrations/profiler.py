@@ -0,0 +1,125 @@
+"""
+Timing and statement counts for migration runs, so it's possible to see
+which migrations and actions a deploy spends its time on.
+"""
+
+import json
+import time
+import threading
+
+
+class Profiler(object):
+    """
+    Records, for each action and each migration run, the wall time, the
+    time spent running statements, the number of statements and the rows
+    they affected (as counted by the SchemaEditor used). The time spent
+    working out each migration's states is recorded separately, as is the
+    time spent running column changes buffered until the end of a batch.
+
+    Measurements are taken with start(), which returns a token to pass to
+    the matching *_done() call.
+    """
+
+    def __init__(self):
+        self.actions = []
+        self.migrations = []
+        self.flushes = []
+        self.state_times = {}
+        self.lock = threading.Lock()
+
+    def start(self, editor):
+        "Returns a token for measuring something about to happen on editor"
+        return (time.time(), editor.time, len(editor.executed), editor.rows)
+
+    def measure(self, token, editor):
+        "Returns a dict of what's happened on editor since token was taken"
+        wall, db_time, statements, rows = token
+        return {
+            "wall": time.time() - wall,
+            "db_time": editor.time - db_time,
+            "statements": len(editor.executed) - statements,
+            "rows": editor.rows - rows,
+        }
+
+    def action_done(self, token, migration, action, forwards, editor):
+        record = self.measure(token, editor)
+        record.update(migration=str(migration), action=str(action), forwards=forwards)
+        with self.lock:
+            self.actions.append(record)
+
+    def migration_done(self, token, migration, forwards, editor, actions):
+        record = self.measure(token, editor)
+        record.update(
+            migration = str(migration),
+            forwards = forwards,
+            actions = actions,
+            state_time = self.state_times.get(migration, 0.0),
+        )
+        with self.lock:
+            self.migrations.append(record)
+
+    def flush_done(self, token, editor):
+        record = self.measure(token, editor)
+        with self.lock:
+            self.flushes.append(record)
+
+    def time_states(self, entries):
+        """
+        Wraps an iterable of (forwards, migration, action_states) entries,
+        noting down how long each took to produce.
+        """
+        entries = iter(entries)
+        while True:
+            started = time.time()
+            try:
+                entry = next(entries)
+            except StopIteration:
+                return
+            self.state_times[entry[1]] = self.state_times.get(entry[1], 0.0) + time.time() - started
+            yield entry
+
+    def totals(self):
+        "Returns the measurements summed over the whole run"
+        result = {"wall": 0.0, "db_time": 0.0, "statements": 0, "rows": 0}
+        for record in self.migrations + self.flushes:
+            for key in result:
+                result[key] += record[key]
+        result["state_time"] = sum(self.state_times.values())
+        return result
+
+    def report(self):
+        "Returns everything recorded, as a JSON-serializable dict"
+        return {
+            "totals": self.totals(),
+            "migrations": self.migrations,
+            "actions": self.actions,
+            "flushes": self.flushes,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+
+    def summary(self, limit=10):
+        "Returns lines describing the slowest actions, slowest first"
+        totals = self.totals()
+        lines = ["%i statements (%i rows) in %.3fs; %.3fs in the database, %.3fs working out states." % (
+            totals["statements"],
+            totals["rows"],
+            totals["wall"],
+            totals["db_time"],
+            totals["state_time"],
+        )]
+        slowest = sorted(self.actions, key=lambda record: record["wall"], reverse=True)[:limit]
+        if slowest:
+            lines.append("Slowest actions:")
+        for record in slowest:
+            lines.append("  %.3fs  %s: %s%s (%i statements, %i rows)" % (
+                record["wall"],
+                record["migration"],
+                record["action"],
+                "" if record["forwards"] else " (backwards)",
+                record["statements"],
+                record["rows"],
+            ))
+        return lines
@@ -0,0 +1,229 @@
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .exceptions import MigrationError
+from .migration import Migration
+from .models import AppliedMigration, AppliedAction, GraphFingerprint
+from .schema import quote_value
+
+
+class MigrationRecorder(object):
+    """
+    Keeps track of which migrations are applied to each database.
+    The applied set is read with a single query the first time a database
+    is asked about, and then kept up to date in memory as migrations are
+    recorded as applied or unapplied.
+
+    Records can also be queued and then written together by
+    flush_records, which uses one INSERT and one DELETE at most.
+
+    The fingerprint of the graph last applied in full can be stored too
+    (see record_fingerprint); it's removed as soon as anything is
+    unapplied.
+
+    If track_actions is set, the actions of migrations part-way through
+    being run can be recorded too (see record_action); those records are
+    removed once the migration itself is recorded.
+    """
+
+    def __init__(self, loader, track_actions=False):
+        self.loader = loader
+        self.track_actions = track_actions
+        self.applied = {}
+        self.queued = {}
+
+    def applied_migrations(self, database=DEFAULT_DB_ALIAS):
+        "Returns the set of Migrations applied to the database"
+        if database not in self.applied:
+            rows = AppliedMigration.objects.using(database).values_list("app_label", "name")
+            self.applied[database] = set(self.get_migration(app_label, name) for app_label, name in rows)
+        return self.applied[database]
+
+    def get_migration(self, app_label, name):
+        """
+        Returns the loaded Migration for a row, or a bare one if it's not
+        loaded (for example, if its file has been removed).
+        """
+        try:
+            return self.loader.migrations[app_label][name]
+        except KeyError:
+            return Migration(app_label, name)
+
+    def record_applied(self, migration, database=DEFAULT_DB_ALIAS):
+        "Records that the migration has been applied to the database"
+        self.queue_applied(migration, database)
+        self.flush_records(database)
+
+    def record_unapplied(self, migration, database=DEFAULT_DB_ALIAS):
+        "Records that the migration has been unapplied from the database"
+        self.queue_unapplied(migration, database)
+        self.flush_records(database)
+
+    def queue_applied(self, migration, database=DEFAULT_DB_ALIAS):
+        """
+        Queues a record that the migration has been applied. Squashed
+        migrations also record the migrations they replace.
+        """
+        self.queue(migration, True, database)
+
+    def queue_unapplied(self, migration, database=DEFAULT_DB_ALIAS):
+        "Queues a record that the migration (and anything it replaces) has been unapplied"
+        self.queue(migration, False, database)
+
+    def queue(self, migration, is_applied, database):
+        queued = self.queued.setdefault(database, [])
+        for app_label, name in migration.replaces:
+            queued.append((self.get_migration(app_label, name), is_applied))
+        queued.append((migration, is_applied))
+
+    def discard_queued(self, database=DEFAULT_DB_ALIAS):
+        "Forgets any queued records for the database without writing them"
+        self.queued.pop(database, None)
+
+    def flush_records(self, database=DEFAULT_DB_ALIAS):
+        """
+        Writes all queued records for the database. If a migration was
+        queued more than once, only its final state is written.
+        """
+        queued = self.queued.pop(database, [])
+        if not queued:
+            return
+        applied = self.applied_migrations(database)
+        final = {}
+        for migration, is_applied in queued:
+            final[migration] = is_applied
+        inserts = [m for m, is_applied in final.items() if is_applied and m not in applied]
+        deletes = [m for m, is_applied in final.items() if not is_applied and m in applied]
+        if inserts:
+            now = timezone.now()
+            AppliedMigration.objects.using(database).bulk_create([
+                AppliedMigration(app_label=m.app_label, name=m.name, applied=now)
+                for m in inserts
+            ])
+            applied.update(inserts)
+        if deletes:
+            by_app = {}
+            for migration in deletes:
+                by_app.setdefault(migration.app_label, []).append(migration.name)
+            query = Q()
+            for app_label, names in by_app.items():
+                query |= Q(app_label=app_label, name__in=names)
+            AppliedMigration.objects.using(database).filter(query).delete()
+            applied.difference_update(deletes)
+            GraphFingerprint.objects.using(database).delete()
+        if self.track_actions:
+            query = Q()
+            for migration in final:
+                query |= Q(app_label=migration.app_label, migration=migration.name)
+            AppliedAction.objects.using(database).filter(query).delete()
+
+    def applied_actions(self, migration, forwards, database=DEFAULT_DB_ALIAS):
+        """
+        Returns the positions of the migration's actions recorded as run in
+        that direction. Raises MigrationError if the migration's file has
+        changed since they were recorded, as the positions might not be
+        those of the same actions any more.
+        """
+        rows = AppliedAction.objects.using(database).filter(
+            app_label = migration.app_label,
+            migration = migration.name,
+            forwards = forwards,
+        ).values_list("index", "source_hash")
+        done = set()
+        for index, source_hash in rows:
+            if source_hash != source_hash_of(migration):
+                raise MigrationError(
+                    "%s has changed since it was interrupted, so it can't be told which of its actions "
+                    "have run. Put back the version that was run to carry on, or bring the database in "
+                    "line with the new version by hand and delete its rows from %s." % (
+                        migration,
+                        AppliedAction._meta.db_table,
+                    )
+                )
+            done.add(index)
+        return done
+
+    def record_action(self, migration, index, forwards, database=DEFAULT_DB_ALIAS):
+        """
+        Records that the migration's action at index has been run. The
+        record is committed straight away, unless a transaction is being
+        managed, in which case it's left to commit (or roll back) with the
+        action itself.
+        """
+        if transaction.is_managed(using=database):
+            self.create_action(migration, index, forwards, database)
+        else:
+            with transaction.commit_on_success(using=database):
+                self.create_action(migration, index, forwards, database)
+
+    def create_action(self, migration, index, forwards, database):
+        AppliedAction.objects.using(database).create(
+            app_label = migration.app_label,
+            migration = migration.name,
+            forwards = forwards,
+            index = index,
+            source_hash = source_hash_of(migration),
+            applied = timezone.now(),
+        )
+
+    def record_sql(self, migration, is_applied, database=DEFAULT_DB_ALIAS):
+        """
+        Returns the statements that record the migration (and anything it
+        replaces) as applied or unapplied, for writing out in SQL scripts.
+        """
+        qn = connections[database].ops.quote_name
+        table = qn(AppliedMigration._meta.db_table)
+        statements = []
+        for app_label, name in list(migration.replaces) + [(migration.app_label, migration.name)]:
+            if is_applied:
+                statements.append("INSERT INTO %s (%s, %s, %s) VALUES (%s, %s, CURRENT_TIMESTAMP);" % (
+                    table,
+                    qn("app_label"),
+                    qn("name"),
+                    qn("applied"),
+                    quote_value(app_label),
+                    quote_value(name),
+                ))
+            else:
+                statements.append("DELETE FROM %s WHERE %s = %s AND %s = %s;" % (
+                    table,
+                    qn("app_label"),
+                    quote_value(app_label),
+                    qn("name"),
+                    quote_value(name),
+                ))
+        if not is_applied:
+            statements.append("DELETE FROM %s;" % qn(GraphFingerprint._meta.db_table))
+        return statements
+
+    def stored_fingerprint(self, database=DEFAULT_DB_ALIAS):
+        """
+        Returns the stored graph fingerprint for the database, or None if
+        there isn't one (or nowhere to store one yet).
+        """
+        try:
+            fingerprints = list(GraphFingerprint.objects.using(database).values_list("fingerprint", flat=True)[:1])
+        except DatabaseError:
+            transaction.rollback_unless_managed(using=database)
+            return None
+        return fingerprints[0] if fingerprints else None
+
+    def record_fingerprint(self, fingerprint, database=DEFAULT_DB_ALIAS):
+        "Stores the fingerprint of a graph that's now applied to the database in full"
+        with transaction.commit_on_success(using=database):
+            GraphFingerprint.objects.using(database).delete()
+            GraphFingerprint.objects.using(database).create(fingerprint=fingerprint, recorded=timezone.now())
+
+    def flush(self, database=None):
+        "Forgets the cached applied set (and queued records) for database, or for all of them"
+        if database is None:
+            self.applied = {}
+            self.queued = {}
+        else:
+            self.applied.pop(database, None)
+            self.queued.pop(database, None)
+
+
+def source_hash_of(migration):
+    "Returns the hash of the migration's file, or an empty string if it wasn't loaded from one"
+    return getattr(migration, "source_hash", None) or ""
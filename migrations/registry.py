@@ -0,0 +1,134 @@
+"""
+Resolution of the field classes migrations refer to by dotted path, and
+fields that are only constructed once they're really needed.
+"""
+
+import sys
+import copy
+from django.db import models
+from django.db.models.fields.related import RelatedField
+from django.utils.importlib import import_module
+from .exceptions import MigrationError
+
+
+class FieldRegistry(object):
+    """
+    Maps dotted paths (or aliases registered for them) to field classes.
+    Each path is only imported the first time it's looked up, and has to
+    turn out to be a model Field subclass; migrations can't use anything
+    else they might be able to import.
+
+    Nor can they import just any module for its side effects: a path has
+    to be in one of modules (or a module inside one), or in a module
+    that's already imported, such as those the installed apps' models
+    use. Paths that registered aliases point at are always imported.
+    """
+
+    modules = ["django.db.models"]
+
+    def __init__(self):
+        self.classes = {}
+        self.aliases = {}
+        self.modules = list(self.modules)
+
+    def allow_module(self, module_name):
+        "Lets paths in the module (and modules inside it) be imported"
+        self.modules.append(module_name)
+
+    def can_import(self, module_name):
+        "Returns True if paths in the module can be imported"
+        if sys.modules.get(module_name) is not None:
+            return True
+        return any(module_name == allowed or module_name.startswith(allowed + ".") for allowed in self.modules)
+
+    def register(self, alias, target):
+        """
+        Makes alias resolve to target, which can be a dotted path or the
+        field class itself.
+        """
+        if isinstance(target, basestring):
+            self.aliases[alias] = target
+            self.classes.pop(alias, None)
+        else:
+            self.aliases.pop(alias, None)
+            self.classes[alias] = target
+
+    def resolve(self, path):
+        "Returns the field class for a dotted path or alias"
+        try:
+            return self.classes[path]
+        except KeyError:
+            pass
+        target = self.aliases.get(path, path)
+        if target in self.classes:
+            field_class = self.classes[target]
+        else:
+            try:
+                module_name, class_name = target.rsplit(".", 1)
+            except ValueError:
+                raise MigrationError("Could not find the field class %s" % target)
+            if target == path and not self.can_import(module_name):
+                raise MigrationError("%s is not in a module field classes can be imported from" % target)
+            try:
+                field_class = getattr(import_module(module_name), class_name)
+            except (ImportError, AttributeError):
+                raise MigrationError("Could not find the field class %s" % target)
+        if not (isinstance(field_class, type) and issubclass(field_class, models.Field)):
+            raise MigrationError("%s is not a model field class" % target)
+        self.classes[path] = self.classes[target] = field_class
+        return field_class
+
+
+field_registry = FieldRegistry()
+
+
+class DeferredField(object):
+    """
+    Stands in for a field defined in a migration until the field itself is
+    needed, which is usually only when a model is rendered from a state
+    for the first time. Until then it can be fingerprinted, and its
+    relation looked at, without being constructed; any other attribute
+    constructs the field and is read from that.
+    """
+
+    def __init__(self, path, args, kwargs, registry=None):
+        self._migrations_definition = (path, args, kwargs)
+        self._registry = registry or field_registry
+        self._field = None
+        self.primary_key = kwargs.get("primary_key", False)
+
+    def __repr__(self):
+        return "<DeferredField %s>" % self._migrations_definition[0]
+
+    def __getattr__(self, name):
+        # Leave private and special names alone, so copying and pickling
+        # don't construct the field (or recurse before __init__ has run)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.construct(), name)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.construct(), memo)
+
+    def construct(self):
+        "Returns the field, constructing it the first time"
+        if self._field is None:
+            path, args, kwargs = self._migrations_definition
+            self._field = self._registry.resolve(path)(*args, **kwargs)
+            self._field._migrations_definition = self._migrations_definition
+        return self._field
+
+    def fingerprint(self):
+        "Returns a hashable description of the field, made from its definition"
+        path, args, kwargs = self._migrations_definition
+        return ("deferred", path, repr(args), repr(sorted(kwargs.items())))
+
+    def related_to(self):
+        """
+        Returns what the field's relation points at, as given in its
+        definition, or None if it isn't a relation.
+        """
+        path, args, kwargs = self._migrations_definition
+        if not issubclass(self._registry.resolve(path), RelatedField):
+            return None
+        return args[0] if args else kwargs.get("to")
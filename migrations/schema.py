@@ -0,0 +1,330 @@
+"""
+Turns schema changes into SQL and runs it against a database.
+"""
+
+import time
+from decimal import Decimal
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.backends.util import truncate_name
+from django.utils.datastructures import SortedDict
+
+
+class SchemaEditor(object):
+    """
+    Runs schema changes against a database. Column changes are buffered
+    per table until flush() is called, so that on backends which can do
+    several in one ALTER TABLE (see combine_alters), a table is only
+    altered (and so, on some backends, rewritten) once, however many
+    columns change. Elsewhere they're run one statement at a time.
+
+    Everything run is noted down in self.executed, as (sql, params), and
+    the time it took and rows it affected are added to self.time and
+    self.rows. If
+    collect_sql is set, nothing is actually run against the database; the
+    statements are only noted down, to be written out as a script.
+
+    If online is an OnlineSchemaChanger, actions that can rebuild their
+    table online (see change_table) do that instead of altering it.
+    """
+
+    # Backends that accept several comma-separated changes per ALTER TABLE
+    combining_vendors = ["mysql", "postgresql"]
+
+    # Backends that can't add or drop constraints on an existing table
+    rebuilding_vendors = ["sqlite"]
+
+    def __init__(self, database, collect_sql=False, online=None):
+        self.database = database
+        self.collect_sql = collect_sql
+        self.online = online
+        self.connection = connections[database]
+        self.combine_alters = self.connection.vendor in self.combining_vendors
+        self.style = no_style()
+        self.deferred = SortedDict()
+        self.online_changes = SortedDict()
+        self.executed = []
+        self.time = 0.0
+        self.rows = 0
+
+    def execute(self, sql, params=()):
+        "Runs a single statement"
+        if not self.collect_sql:
+            started = time.time()
+            cursor = self.connection.cursor()
+            cursor.execute(sql, params)
+            self.time += time.time() - started
+            self.rows += max(cursor.rowcount, 0)
+        self.executed.append((sql, params))
+
+    def execute_atomic(self, statements):
+        "Runs statements so that either all of them take effect or none do"
+        if self.collect_sql:
+            self.executed.extend((sql, ()) for sql in ["BEGIN;"] + statements + ["COMMIT;"])
+        elif self.connection.vendor == "sqlite":
+            # Python's sqlite3 module commits before each DDL statement, so
+            # the statements have to be run as one script
+            started = time.time()
+            self.connection.cursor()
+            try:
+                self.connection.connection.executescript("BEGIN;\n%s\nCOMMIT;" % "\n".join(statements))
+            except Exception:
+                self.connection.connection.rollback()
+                raise
+            self.time += time.time() - started
+            self.executed.extend((sql, ()) for sql in statements)
+        else:
+            with transaction.commit_on_success(using=self.database):
+                for sql in statements:
+                    self.execute(sql)
+
+    def query(self, sql, params=()):
+        "Runs a single query, returning its rows"
+        started = time.time()
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        self.time += time.time() - started
+        self.executed.append((sql, params))
+        return rows
+
+    def quote_name(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def defer(self, model, clause, after=None):
+        """
+        Buffers a clause for the model's ALTER TABLE, along with any
+        statements that need to run after it.
+        """
+        clauses, statements = self.deferred.setdefault(model._meta.db_table, ([], []))
+        clauses.append(clause)
+        statements.extend(after or [])
+
+    # Tables
+
+    def create_model(self, model, indexes=True):
+        "Creates the table for a model, and its indexes unless indexes is False"
+        for field in model._meta.local_fields:
+            check_relation(model, field)
+        # Migrations run in dependency order, so anything a relation points
+        # at already exists
+        known_models = set(field.rel.to for field in model._meta.local_fields if field.rel)
+        statements, pending = self.connection.creation.sql_create_model(model, self.style, known_models)
+        if indexes:
+            statements.extend(self.connection.creation.sql_indexes_for_model(model, self.style))
+        for sql in statements:
+            self.execute(sql)
+
+    def delete_model(self, model):
+        "Drops the table for a model, after any changes still buffered for it"
+        # There's no point rebuilding a table that's about to go
+        self.online_changes.pop(model._meta.db_table, None)
+        self.flush(model._meta.db_table)
+        self.execute("DROP TABLE %s;" % self.quote_name(model._meta.db_table))
+
+    def rename_table(self, from_model, to_model):
+        "Renames from_model's table to to_model's, after any changes still buffered for it"
+        self.flush(from_model._meta.db_table)
+        self.execute("ALTER TABLE %s RENAME TO %s;" % (
+            self.quote_name(from_model._meta.db_table),
+            self.quote_name(to_model._meta.db_table),
+        ))
+
+    # Table options
+
+    def alter_unique_together(self, from_model, to_model, rebuilder):
+        """
+        Drops and adds unique constraints for a change to unique_together,
+        after any changes still buffered for the table. Where constraints
+        can't be changed (see rebuilding_vendors), the table is rebuilt
+        by rebuilder, an OnlineSchemaChanger, straight away instead.
+        """
+        table = from_model._meta.db_table
+        self.flush(table)
+        if self.connection.vendor in self.rebuilding_vendors:
+            rebuilder.change_table(self, from_model, to_model)
+            return
+        old = together_columns(from_model, from_model._meta.unique_together)
+        new = together_columns(to_model, to_model._meta.unique_together)
+        for columns in old:
+            if columns not in new:
+                self.execute("ALTER TABLE %s DROP %s %s;" % (
+                    self.quote_name(table),
+                    "INDEX" if self.connection.vendor == "mysql" else "CONSTRAINT",
+                    self.quote_name(self.unique_name(table, columns)),
+                ))
+        for columns in new:
+            if columns not in old:
+                self.execute("ALTER TABLE %s ADD CONSTRAINT %s UNIQUE (%s);" % (
+                    self.quote_name(table),
+                    self.quote_name(self.unique_name(table, columns)),
+                    ", ".join(self.quote_name(column) for column in columns),
+                ))
+
+    def unique_name(self, table, columns):
+        """
+        Returns the name the database gives a unique constraint on columns
+        when it's made along with the table, so constraints made either way
+        can be dropped again.
+        """
+        if self.connection.vendor == "mysql":
+            return columns[0]
+        # PostgreSQL's table_columns_key, shortened the way it does
+        columns = "_".join(columns)
+        available = self.connection.ops.max_name_length() - len("_key") - 1
+        table_length, columns_length = len(table), len(columns)
+        while table_length + columns_length > available:
+            if table_length > columns_length:
+                table_length -= 1
+            else:
+                columns_length -= 1
+        return "%s_%s_key" % (table[:table_length], columns[:columns_length])
+
+    def alter_index_together(self, from_model, to_model):
+        "Drops and creates indexes for a change to index_together"
+        table = from_model._meta.db_table
+        self.flush(table)
+        creation = self.connection.creation
+        old = [tuple(fields) for fields in from_model._meta.index_together]
+        new = [tuple(fields) for fields in to_model._meta.index_together]
+        for fields in old:
+            if fields not in new:
+                name = self.quote_name(truncate_name(
+                    "%s_%s" % (table, creation._digest(list(fields))),
+                    self.connection.ops.max_name_length(),
+                ))
+                if self.connection.vendor == "mysql":
+                    self.execute("DROP INDEX %s ON %s;" % (name, self.quote_name(table)))
+                else:
+                    self.execute("DROP INDEX %s;" % name)
+        for fields in new:
+            if fields not in old:
+                fields = [to_model._meta.get_field(name) for name in fields]
+                for sql in creation.sql_indexes_for_fields(to_model, fields, self.style):
+                    self.execute(sql)
+
+    def alter_db_tablespace(self, from_model, to_model):
+        """
+        Moves the table to to_model's tablespace, on databases that have
+        tablespaces; elsewhere, as when tables are created, it's ignored.
+        """
+        if not self.connection.features.supports_tablespaces:
+            return
+        table = self.quote_name(from_model._meta.db_table)
+        tablespace = to_model._meta.db_tablespace
+        self.flush(from_model._meta.db_table)
+        if self.connection.vendor == "oracle":
+            if tablespace:
+                self.execute("ALTER TABLE %s MOVE TABLESPACE %s;" % (table, self.quote_name(tablespace)))
+        else:
+            self.execute("ALTER TABLE %s SET TABLESPACE %s;" % (table, self.quote_name(tablespace or "pg_default")))
+
+    # Columns
+
+    def add_field(self, model, field):
+        "Buffers adding a field's column to the model's table"
+        check_relation(model, field)
+        self.defer(
+            model,
+            "ADD COLUMN %s" % self.column_sql(field),
+            self.connection.creation.sql_indexes_for_field(model, field, self.style),
+        )
+
+    def remove_field(self, model, field):
+        "Buffers removing a field's column from the model's table"
+        self.defer(model, "DROP COLUMN %s" % self.quote_name(field.column))
+
+    def change_table(self, from_model, to_model):
+        """
+        Buffers rebuilding from_model's table in the form of to_model,
+        through self.online. Several changes to one table are rebuilt
+        together, from the first one's from_model to the last one's
+        to_model.
+        """
+        table = from_model._meta.db_table
+        if table in self.online_changes:
+            from_model = self.online_changes[table][0]
+        self.online_changes[table] = (from_model, to_model)
+
+    def column_sql(self, field):
+        "Returns the column definition for a field, as used in ADD COLUMN"
+        sql = [self.quote_name(field.column), field.db_type(connection=self.connection)]
+        sql.append("NULL" if field.null else "NOT NULL")
+        default = effective_default(field)
+        if default is not None:
+            sql.append("DEFAULT %s" % quote_value(field.get_db_prep_save(default, connection=self.connection)))
+        if field.primary_key:
+            sql.append("PRIMARY KEY")
+        elif field.unique:
+            sql.append("UNIQUE")
+        if field.rel:
+            sql.append("REFERENCES %s (%s)%s" % (
+                self.quote_name(field.rel.to._meta.db_table),
+                self.quote_name(field.rel.to._meta.get_field(field.rel.field_name).column),
+                self.connection.ops.deferrable_sql(),
+            ))
+        return " ".join(sql)
+
+    def alter_statements(self, table):
+        "Returns the statements the changes buffered for table will run"
+        clauses, after = self.deferred.get(table, ([], []))
+        if not clauses:
+            return list(after)
+        prefix = "ALTER TABLE %s " % self.quote_name(table)
+        if self.combine_alters:
+            statements = [prefix + ", ".join(clauses) + ";"]
+        else:
+            statements = [prefix + clause + ";" for clause in clauses]
+        return statements + after
+
+    def flush(self, table=None):
+        "Runs the changes buffered for table, or for all tables"
+        if table is not None:
+            tables = [table]
+        else:
+            tables = list(self.deferred.keys())
+            tables.extend(table for table in self.online_changes if table not in self.deferred)
+        for table in tables:
+            for sql in self.alter_statements(table):
+                self.execute(sql)
+            self.deferred.pop(table, None)
+            if table in self.online_changes:
+                from_model, to_model = self.online_changes.pop(table)
+                self.online.change_table(self, from_model, to_model)
+
+
+def check_relation(model, field):
+    "Raises ValueError if the field's relation couldn't be resolved to a model"
+    if field.rel and isinstance(field.rel.to, basestring):
+        raise ValueError("%s.%s refers to %s, which is not in the state it is being created from "
+                         "(is a dependency missing?)" % (model._meta.object_name, field.name, field.rel.to))
+
+
+def together_columns(model, together):
+    "Returns the column names for each set of field names in a unique_together or index_together"
+    return [tuple(model._meta.get_field(name).column for name in fields) for fields in together]
+
+
+def effective_default(field):
+    "Returns the value existing rows get for a newly-added field's column"
+    if field.has_default():
+        return field.get_default()
+    if not field.null and field.blank and field.empty_strings_allowed:
+        return ""
+    return None
+
+
+def quote_value(value):
+    """
+    Returns a value as an SQL literal. Defaults have to be written into the
+    statement, as not every backend accepts parameters in DDL.
+    """
+    if value is None:
+        return "NULL"
+    elif isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, (int, long, float, Decimal)):
+        return str(value)
+    elif isinstance(value, basestring):
+        return "'%s'" % value.replace("'", "''")
+    raise ValueError("Cannot use %r as a column default" % (value, ))
@@ -0,0 +1,105 @@
+"""
+Saved ProjectStates at particular migrations, so that building the state for
+a migration deep in an app's history doesn't mean replaying every action
+from the root.
+"""
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+from .cache import private_dir, user_cache_dir
+
+
+def default_snapshot_dir():
+    "Returns the snapshot directory used when MIGRATIONS_SNAPSHOT_DIR isn't set"
+    return user_cache_dir("snapshots")
+
+
+class SnapshotStore(object):
+    """
+    Stores pickled ProjectStates in a directory, one per migration.
+    Each snapshot is the state after a migration and all of its ancestors
+    have been applied, and records a fingerprint of those migrations' files
+    so it's ignored as soon as any of them change.
+
+    Snapshots are keyed by namespace as well as migration, so projects
+    sharing a directory (pass something identifying the project) don't
+    see each other's. Unpickling can run code, so as with MigrationCache
+    the directory is only used if it's private to the current user.
+    """
+
+    suffix = ".snapshot"
+
+    def __init__(self, directory, namespace=""):
+        self.directory = directory
+        self.namespace = namespace
+        self.trusted = None
+
+    def is_trusted(self, create=False):
+        "Returns True if the directory is safe to read snapshots from (and write them to)"
+        if not self.trusted:
+            self.trusted = private_dir(self.directory, create)
+        return self.trusted
+
+    def snapshot_path(self, migration):
+        "Returns the filename the snapshot for the migration lives in"
+        key = hashlib.sha1("%s:%s:%s" % (self.namespace, migration.app_label, migration.name)).hexdigest()
+        return os.path.join(self.directory, key + self.suffix)
+
+    def has_snapshot(self, migration):
+        "Returns True if there's a (possibly stale) snapshot for the migration"
+        return self.is_trusted() and os.path.exists(self.snapshot_path(migration))
+
+    def fingerprint(self, ancestors):
+        "Returns a hash of the given migrations' names and file contents"
+        hasher = hashlib.sha1()
+        for migration in sorted(ancestors, key=lambda m: (m.app_label, m.name)):
+            hasher.update("%s:%s:%s\n" % (
+                migration.app_label,
+                migration.name,
+                getattr(migration, "source_hash", None),
+            ))
+        return hasher.hexdigest()
+
+    def load(self, migration, ancestors):
+        """
+        Returns the saved ProjectState for the migration, or None if there
+        isn't one or it doesn't match ancestors (which should include the
+        migration itself).
+        """
+        if not self.is_trusted():
+            return None
+        try:
+            with open(self.snapshot_path(migration), "rb") as fh:
+                fingerprint, project_state = pickle.load(fh)
+        except (IOError, OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        if fingerprint != self.fingerprint(ancestors):
+            return None
+        return project_state
+
+    def save(self, migration, ancestors, project_state):
+        """
+        Saves project_state as the snapshot for the migration. Failures are
+        ignored, as snapshots are only ever a shortcut.
+        """
+        if not self.is_trusted(create=True):
+            return False
+        try:
+            data = pickle.dumps((self.fingerprint(ancestors), project_state), pickle.HIGHEST_PROTOCOL)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.rename(temp_path, self.snapshot_path(migration))
+        except (IOError, OSError, TypeError, pickle.PicklingError):
+            return False
+        return True
+
+    def clear(self):
+        "Removes all snapshots"
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.suffix):
+                os.remove(os.path.join(self.directory, filename))
@@ -3,7 +3,75 @@ Contains classes which model the state of an app's models.
 Not called models.py for obvious reasons.
 """
 
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 from django.db import models
+from django.db.models.loading import cache as app_cache
+from django.utils.datastructures import SortedDict
+from .registry import DeferredField
+
+
+# Marks a model as deleted in a layer, hiding it in the layers below
+DELETED = object()
+
+# Held while models are rendered, as that goes through the app cache (and
+# the render cache), which several threads may be using at once
+render_lock = threading.RLock()
+
+
+class StateLayer(object):
+    """
+    An immutable set of model changes on top of a parent layer. ProjectStates
+    share these, so copying one doesn't have to copy every model.
+    """
+
+    def __init__(self, changes, parent=None):
+        self.changes = changes
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self._models = None
+
+    def get(self, key):
+        layer = self
+        while layer is not None:
+            if key in layer.changes:
+                return layer.changes[key]
+            layer = layer.parent
+        return DELETED
+
+    def models(self):
+        "Returns a dict of all the models this layer and its parents contain"
+        if self._models is None:
+            self._models = merge_changes(
+                self.parent.models() if self.parent is not None else {},
+                self.changes,
+            )
+        return self._models
+
+
+def merge_changes(models, changes):
+    "Returns a copy of the models dict with a layer's changes applied"
+    result = dict(models)
+    for key, value in changes.items():
+        if value is DELETED:
+            result.pop(key, None)
+        else:
+            result[key] = value
+    return ReadOnlyDict(result)
+
+
+class ReadOnlyDict(dict):
+    "A dict that raises TypeError on any attempt to change it"
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError("This dict is read-only; change states through their methods")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = read_only
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self), ))
 
 
 class ProjectState(object):
@@ -11,19 +79,109 @@ class ProjectState(object):
     Represents the entire project's overall state.
     This is the item that is passed around - we do it here rather than at the
     app level so that cross-app FKs/etc. resolve properly.
+
+    States are copy-on-write: copy() is constant time, as the copy shares
+    all of its models with the original, and a ModelState is only copied
+    when it's about to be changed. Because of that, models must only ever be
+    changed through add_model, remove_model and mutate_model; the models
+    dict is read-only.
+
+    Each ModelState's project_state is the state that last changed it.
+    Once that state is copied, the ModelStates it shares are pointed at a
+    frozen state instead (see frozen()), with the contents both states had
+    at the time, so later changes to either don't leak into the other.
     """
 
+    # How many layers deep states can get before they're flattened
+    max_depth = 32
+
     def __init__(self, models=None):
-        self.models = models or {}
+        self.parent = None
+        self.changes = dict(models or {})
+        self._models = None
+        self.read_only = False
+
+    @classmethod
+    def frozen(cls, layer):
+        "Returns a read-only state with the contents of a StateLayer"
+        ps = cls()
+        ps.parent = layer
+        ps.read_only = True
+        return ps
+
+    def __getstate__(self):
+        return {"models": dict(self.models)}
+
+    def __setstate__(self, state):
+        self.__init__(state["models"])
+
+    @property
+    def models(self):
+        "Returns a read-only dict of {(app_label, name): ModelState}"
+        if self._models is None:
+            if self.parent is None:
+                self._models = ReadOnlyDict(self.changes)
+            else:
+                self._models = merge_changes(self.parent.models(), self.changes)
+        return self._models
 
     def copy(self):
-        ps = ProjectState(
-            models = dict((k, v.copy()) for k, v in self.models.items())
-        )
-        for model in ps.models.values():
-            model.project_state = ps
+        "Returns a copy of this state, sharing all models with it"
+        if self.changes:
+            # Freeze our changes into a layer both states can share
+            self.parent = StateLayer(self.changes, self.parent)
+            if self.parent.depth > self.max_depth:
+                self.parent = StateLayer(self.parent.models())
+            frozen = ProjectState.frozen(self.parent)
+            for model_state in self.changes.values():
+                if model_state is not DELETED and model_state.project_state is self:
+                    model_state.project_state = frozen
+            self.changes = {}
+        ps = ProjectState()
+        ps.parent = self.parent
+        ps._models = self._models
         return ps
 
+    def get_model(self, app_label, name):
+        "Returns the ModelState for the named model. Don't change it."
+        key = (app_label, name)
+        model_state = self.changes.get(key)
+        if model_state is None:
+            model_state = self.parent.get(key) if self.parent is not None else DELETED
+        if model_state is DELETED:
+            raise KeyError(key)
+        return model_state
+
+    def check_writable(self):
+        if self.read_only:
+            raise TypeError("This state is frozen; copy() it to change it")
+
+    def add_model(self, model_state):
+        "Adds (or replaces) a model in this state"
+        self.check_writable()
+        model_state.project_state = self
+        self.changes[model_state.app_label, model_state.name] = model_state
+        self._models = None
+
+    def remove_model(self, app_label, name):
+        "Removes the named model from this state"
+        self.check_writable()
+        self.get_model(app_label, name)
+        self.changes[app_label, name] = DELETED
+        self._models = None
+
+    def mutate_model(self, app_label, name):
+        """
+        Returns the ModelState for the named model, ready to be changed.
+        If it's shared with another state, it's copied first.
+        """
+        self.check_writable()
+        model_state = self.changes.get((app_label, name))
+        if model_state is None or model_state is DELETED:
+            model_state = self.get_model(app_label, name).copy()
+            self.add_model(model_state)
+        return model_state
+
 
 class ModelState(object):
     """
@@ -41,18 +199,68 @@ class ModelState(object):
         self.bases = bases or []
 
     def copy(self):
-        "Returns an exact copy of this ModelState"
+        "Returns an exact copy of this ModelState, which can be changed independently"
         return self.__class__(
             project_state = self.project_state,
             app_label = self.app_label,
             name = self.name,
-            fields = self.fields,
-            options = self.options,
-            bases = self.bases,
+            fields = list(self.fields),
+            options = dict(self.options),
+            bases = list(self.bases),
         )
 
-    def render(self):
-        "Returns a Model object created from our current state"
+    def fingerprint(self):
+        "Returns a hash of everything about this model that affects rendering"
+        return hashlib.sha1(repr((
+            self.app_label,
+            self.name,
+            [(name, field_fingerprint(field)) for name, field in self.fields],
+            sorted(self.options.items()),
+            self.bases,
+        ))).hexdigest()
+
+    def render(self, project_state=None, cache=None):
+        """
+        Returns a Model object created from our current state. Related
+        models are looked up in project_state (by default, the state that
+        last changed this model, as it was when it was last copied) and
+        rendered too. Models are reused from
+        cache (by default, the shared render_cache) where possible.
+        """
+        if cache is None:
+            cache = render_cache
+        with render_lock:
+            return self._render(project_state or self.project_state, cache, set())[1]
+
+    def _render(self, project_state, cache, in_progress):
+        "Does the work for render(), returning a (cache key, model) pair"
+        in_progress.add((self.app_label, self.name))
+        # Render the models our relations point to first, so they resolve
+        # to the right versions rather than whatever's in the app cache
+        related = {}
+        for name, field in self.fields:
+            target = related_model_key(self.app_label, field)
+            if target is None or target in in_progress:
+                continue
+            try:
+                target_state = project_state.get_model(*target)
+            except KeyError:
+                continue
+            related[name] = target_state._render(project_state, cache, in_progress)
+        in_progress.discard((self.app_label, self.name))
+        key = (self.fingerprint(), tuple(sorted((name, key) for name, (key, model) in related.items())))
+        model = cache.get(key)
+        if model is None:
+            model = self.construct(dict((name, model) for name, (key, model) in related.items()))
+            cache.set(key, model)
+        return key, model
+
+    def construct(self, related=None):
+        """
+        Makes a new Model class from our current state. related can map
+        field names to the model classes their relations should point at.
+        """
+        related = related or {}
         # First, make a Meta object
         meta_contents = {'app_label': self.app_label}
         meta_contents.update(self.options)
@@ -60,13 +268,116 @@ class ModelState(object):
         # Then, work out our bases
         # TODO: Use the actual bases
         bases = [models.Model]
-        # Turn fields into a dict for the body, add other bits
-        body = dict(self.fields)
+        # Turn fields into a dict for the body, add other bits. The fields
+        # are copied, as the model binds them to itself.
+        body = {}
+        for name, field in self.fields:
+            body[name] = copy.deepcopy(field)
+            if name in related:
+                body[name].rel.to = related[name]
         body['Meta'] = meta
-        body['__module__'] = "__fake__"
-        # Then, make a Model object
-        return type(
-            self.name,
-            tuple(bases),
-            body,
-        )
+        return make_model(self.app_label, self.name, bases, body)
+
+
+def make_model(app_label, name, bases, body):
+    """
+    Makes a Model class that isn't registered with the app cache. Django
+    won't make a model if one with the same name is already registered,
+    and will register ours, so the app cache is kept out of the way while
+    it's made.
+    """
+    body['__module__'] = "__fake__"
+    with render_lock:
+        app_models = app_cache.app_models.setdefault(app_label, SortedDict())
+        existing = app_models.pop(name.lower(), None)
+        try:
+            return type(
+                name,
+                tuple(bases),
+                body,
+            )
+        finally:
+            app_models.pop(name.lower(), None)
+            if existing is not None:
+                app_models[name.lower()] = existing
+            app_cache._get_models_cache.clear()
+
+
+# Field attributes that affect how it renders or what it does to the database
+FINGERPRINT_ATTRIBUTES = [
+    "max_length", "null", "blank", "primary_key", "unique", "db_index",
+    "db_column", "db_tablespace", "max_digits", "decimal_places",
+    "auto_now", "auto_now_add", "default", "choices",
+]
+
+
+def field_fingerprint(field):
+    "Returns a hashable description of a field instance"
+    if isinstance(field, DeferredField):
+        return field.fingerprint()
+    result = ["%s.%s" % (field.__class__.__module__, field.__class__.__name__)]
+    for attribute in FINGERPRINT_ATTRIBUTES:
+        result.append((attribute, repr(getattr(field, attribute, None))))
+    rel = getattr(field, "rel", None)
+    if rel is not None:
+        if isinstance(rel.to, basestring):
+            result.append(("to", rel.to))
+        else:
+            result.append(("to", "%s.%s" % (rel.to._meta.app_label, rel.to._meta.object_name)))
+        result.append(("related_name", rel.related_name))
+    return tuple(result)
+
+
+def related_model_key(app_label, field):
+    """
+    Returns the (app_label, name) of the model a field's relation points
+    to, if it's a relation defined by name to something other than "self".
+    """
+    if isinstance(field, DeferredField):
+        to = field.related_to()
+    else:
+        to = getattr(getattr(field, "rel", None), "to", None)
+    if not isinstance(to, basestring) or to == "self":
+        return None
+    if "." in to:
+        return tuple(to.split(".", 1))
+    return (app_label, to)
+
+
+class RenderCache(object):
+    """
+    A bounded, least-recently-used cache of rendered Model classes,
+    keyed by ModelState fingerprints.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        "Returns the model for key, or None"
+        try:
+            model = self.models.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.models[key] = model
+        self.hits += 1
+        return model
+
+    def set(self, key, model):
+        "Stores the model for key, evicting the oldest entry if full"
+        self.models.pop(key, None)
+        self.models[key] = model
+        while len(self.models) > self.max_size:
+            self.models.popitem(last=False)
+
+    def clear(self):
+        self.models.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+render_cache = RenderCache()
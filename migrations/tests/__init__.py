@@ -1,3 +1,17 @@
 from .loader import LoaderTests
 from .dependencies import DependencyTests
 from .state import StateTests
+from .cache import CacheTests
+from .snapshots import SnapshotTests
+from .recorder import RecorderTests
+from .migrator import MigratorTests
+from .optimizer import OptimizerTests
+from .writer import SquashTests
+from .schema import SchemaTests
+from .graph import GraphTests
+from .declarative import DeclarativeTests
+from .registry import RegistryTests
+from .online import OnlineTests
+from .data import DataTests
+from .fanout import FanOutTests
+from .checkpoint import CheckpointTests
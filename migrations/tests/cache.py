@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+from django.utils import unittest
+from .. import migration as migration_module
+from ..cache import MigrationCache, default_cache_dir
+from ..loader import Loader
+
+
+class CacheTests(unittest.TestCase):
+    """
+    Tests the compiled migration cache
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_test_loader(self, apps=None):
+        "Creates a loader with a cache for the tests"
+        loader = Loader(
+            apps or {
+                "app1": os.path.join(os.path.dirname(__file__), "loader_files", "app1"),
+                "app2": os.path.join(os.path.dirname(__file__), "loader_files", "app2"),
+            },
+            cache = MigrationCache(self.cache_dir),
+        )
+        loader.load_all()
+        return loader
+
+    def test_warm_load(self):
+        "Tests that a warm load uses the cache and doesn't compile anything"
+        cold_loader = self.get_test_loader()
+        self.assertEqual(cold_loader.cache.hits, 0)
+        self.assertEqual(cold_loader.cache.misses, 3)
+        for migrations in cold_loader.migrations.values():
+            for migration in migrations.values():
+                migration.actions
+        # Make compile() blow up for the second load
+        def no_compile(*args, **kwargs):
+            raise AssertionError("compile() called on a warm load")
+        migration_module.compile = no_compile
+        try:
+            warm_loader = self.get_test_loader()
+            self.assertEqual(
+                len(warm_loader.migrations["app1"]["0001_initial"].actions[0].fields),
+                2,
+            )
+        finally:
+            del migration_module.compile
+        self.assertEqual(warm_loader.cache.hits, 3)
+        self.assertEqual(warm_loader.cache.misses, 0)
+
+    def test_invalidation(self):
+        "Tests that changed files and clear() invalidate entries"
+        app_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(app_dir, "0001_initial.migration.py")
+            with open(path, "w") as fh:
+                fh.write("from migrations.api import *\nclass Migration(BaseMigration):\n    actions = []\n")
+            loader = self.get_test_loader({"app3": app_dir})
+            self.assertEqual(loader.cache.misses, 1)
+            # Same size, different contents
+            with open(path, "w") as fh:
+                fh.write("from migrations.api import *\nclass Migration(BaseMigration):\n    actions = ()\n")
+            loader = self.get_test_loader({"app3": app_dir})
+            self.assertEqual(loader.cache.misses, 1)
+            self.assertEqual(loader.migrations["app3"]["0001_initial"].actions, [])
+            loader = self.get_test_loader({"app3": app_dir})
+            self.assertEqual(loader.cache.hits, 1)
+            # Clearing should force a recompile
+            loader.cache.clear()
+            loader = self.get_test_loader({"app3": app_dir})
+            self.assertEqual(loader.cache.misses, 1)
+        finally:
+            shutil.rmtree(app_dir)
+
+    def test_untrusted_directory(self):
+        "Tests that a directory others can write to is never read from or written to"
+        self.assertFalse(default_cache_dir().startswith(tempfile.gettempdir()))
+        self.get_test_loader()
+        os.chmod(self.cache_dir, 0777)
+        loader = self.get_test_loader()
+        self.assertEqual(loader.cache.hits, 0)
+        self.assertEqual(loader.cache.misses, 3)
+        # New directories are made private
+        cache = MigrationCache(os.path.join(self.cache_dir, "new"))
+        self.assertTrue(cache.is_trusted(create=True))
+        self.assertEqual(os.stat(cache.directory).st_mode & 0777, 0700)
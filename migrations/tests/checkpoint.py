@@ -0,0 +1,123 @@
+from django.db import connection, models, transaction
+from django.test import TransactionTestCase
+from ..actions import CreateModel, CreateField
+from ..actions.base import Action
+from ..exceptions import MigrationError
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..models import AppliedMigration, AppliedAction
+from ..recorder import MigrationRecorder
+
+
+class FailOnce(Action):
+    "Action that fails the first time it's run, as if the process died"
+
+    app_label = "checkpointtest"
+    model_name = "Reader"
+
+    def __init__(self):
+        self.runs = 0
+
+    def alter_state(self, project_state):
+        pass
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        self.runs += 1
+        if self.runs == 1:
+            raise KeyboardInterrupt()
+
+
+class CheckpointTests(TransactionTestCase):
+    """
+    Tests resuming migrations from their last finished action
+    """
+
+    def get_test_loader(self):
+        "Creates a loader with a model, then a migration with an interruption in the middle"
+        loader = Loader({})
+        loader.add_migration(RootMigration("checkpointtest"))
+        initial = Migration("checkpointtest", "0001_initial")
+        initial.dependencies = []
+        initial.actions = [CreateModel("checkpointtest", "Reader", [("name", models.CharField(max_length=10))], [])]
+        loader.add_migration(initial)
+        columns = Migration("checkpointtest", "0002_columns")
+        columns.dependencies = []
+        columns.actions = [
+            CreateField("checkpointtest", "Reader", "email", models.CharField(max_length=50, null=True)),
+            CreateField("checkpointtest", "Reader", "age", models.IntegerField(null=True)),
+            FailOnce(),
+            CreateField("checkpointtest", "Reader", "active", models.NullBooleanField()),
+        ]
+        loader.add_migration(columns)
+        loader.calculate_dependencies()
+        return loader
+
+    def get_columns(self):
+        cursor = connection.cursor()
+        if "checkpointtest_reader" not in connection.introspection.table_names(cursor):
+            return None
+        return sorted(row[0] for row in connection.introspection.get_table_description(cursor, "checkpointtest_reader"))
+
+    def test_resume(self):
+        "Tests that an interrupted migration carries on from its next action"
+        loader = self.get_test_loader()
+        migrator = Migrator(loader, checkpoint=True)
+        self.assertRaises(KeyboardInterrupt, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["age", "email", "id", "name"])
+        # The initial migration was recorded as a whole, so only the
+        # interrupted one's actions are left
+        self.assertEqual(
+            sorted(AppliedAction.objects.values_list("migration", "index")),
+            [("0002_columns", 0), ("0002_columns", 1)],
+        )
+        self.assertFalse(AppliedMigration.objects.filter(name="0002_columns").exists())
+        # A fresh run picks up at the action that was interrupted
+        migrator = Migrator(loader, checkpoint=True)
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["active", "age", "email", "id", "name"])
+        self.assertEqual(loader.get_migration("checkpointtest", "0002_columns").actions[2].runs, 2)
+        self.assertTrue(AppliedMigration.objects.filter(name="0002_columns").exists())
+        self.assertEqual(AppliedAction.objects.count(), 0)
+        migrator.execute_plan(migrator.calculate_plan("checkpointtest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+        self.assertEqual(AppliedAction.objects.count(), 0)
+
+    def test_changed_migration(self):
+        "Tests that a migration changed since it was interrupted isn't resumed"
+        loader = self.get_test_loader()
+        migration = loader.get_migration("checkpointtest", "0002_columns")
+        migration.source_hash = "original"
+        migrator = Migrator(loader, checkpoint=True)
+        self.assertRaises(KeyboardInterrupt, migrator.execute_plan, migrator.calculate_plan())
+        # The first action is edited out, so the recorded positions would
+        # skip the wrong ones
+        migration.source_hash = "edited"
+        migration.actions = migration.actions[1:]
+        migrator = Migrator(loader, checkpoint=True)
+        self.assertRaises(MigrationError, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["age", "email", "id", "name"])
+        self.assertEqual(AppliedAction.objects.count(), 2)
+        AppliedAction.objects.all().delete()
+        AppliedMigration.objects.all().delete()
+        connection.cursor().execute("DROP TABLE checkpointtest_reader")
+
+    def test_optimize(self):
+        "Tests that optimized plans can't be checkpointed"
+        self.assertRaises(ValueError, Migrator, self.get_test_loader(), optimize=True, checkpoint=True)
+
+    def test_managed_transaction(self):
+        "Tests that actions recorded inside a transaction commit or roll back with it"
+        loader = self.get_test_loader()
+        recorder = MigrationRecorder(loader, track_actions=True)
+        migration = loader.get_migration("checkpointtest", "0002_columns")
+        try:
+            with transaction.commit_on_success():
+                recorder.record_action(migration, 0, True)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(recorder.applied_actions(migration, True), set())
+        recorder.record_action(migration, 1, True)
+        transaction.rollback()
+        self.assertEqual(recorder.applied_actions(migration, True), set([1]))
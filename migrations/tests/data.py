@@ -0,0 +1,132 @@
+from django.db import connection, models, transaction
+from django.test import TransactionTestCase
+from ..actions import CreateModel, RunBatches
+from ..actions.data import bulk_update
+from ..exceptions import MigrationError
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..models import AppliedMigration, DataMigrationCheckpoint
+from ..writer import MigrationWriter
+
+
+batches = []
+fail_at = [None]
+
+
+def double_values(model, objects, database):
+    "Sets double to twice value, failing on the batch fail_at says to"
+    batches.append([obj.pk for obj in objects])
+    if len(batches) == fail_at[0]:
+        raise ValueError("Interrupted")
+    for obj in objects:
+        obj.double = obj.value * 2
+    bulk_update(model, objects, ["double"], database)
+
+
+def clear_values(model, objects, database):
+    model._default_manager.using(database).filter(pk__in=[obj.pk for obj in objects]).update(double=None)
+
+
+class DataTests(TransactionTestCase):
+    """
+    Tests batched data migrations
+    """
+
+    rows = 45
+
+    def setUp(self):
+        del batches[:]
+        fail_at[0] = None
+
+    def get_test_loader(self, **kwargs):
+        "Creates a loader with a model and a data migration for it"
+        loader = Loader({})
+        loader.add_migration(RootMigration("datatest"))
+        initial = Migration("datatest", "0001_initial")
+        initial.dependencies = []
+        initial.actions = [CreateModel("datatest", "Number", [
+            ("value", models.IntegerField()),
+            ("double", models.IntegerField(null=True)),
+        ], [])]
+        loader.add_migration(initial)
+        data = Migration("datatest", "0002_double")
+        data.dependencies = []
+        data.actions = [RunBatches("datatest", "Number", double_values, "double", clear_values, **kwargs)]
+        loader.add_migration(data)
+        loader.calculate_dependencies()
+        return loader
+
+    def fill(self, migrator):
+        migrator.execute_plan(migrator.calculate_plan("datatest", "0001"))
+        connection.cursor().executemany(
+            "INSERT INTO datatest_number (value) VALUES (%s)",
+            [(i, ) for i in range(1, self.rows + 1)],
+        )
+
+    def get_doubles(self):
+        cursor = connection.cursor()
+        cursor.execute("SELECT double FROM datatest_number ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+    def tearDown(self):
+        connection.cursor().execute("DROP TABLE IF EXISTS datatest_number")
+
+    def test_resume(self):
+        "Tests that an interrupted data migration carries on from its last batch"
+        migrator = Migrator(self.get_test_loader(batch_size=10))
+        self.fill(migrator)
+        fail_at[0] = 3
+        self.assertRaises(ValueError, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(self.get_doubles(), [i * 2 for i in range(1, 21)] + [None] * 25)
+        self.assertEqual(DataMigrationCheckpoint.objects.get().last_pk, "20")
+        self.assertFalse(AppliedMigration.objects.filter(name="0002_double").exists())
+        # The next run starts at the batch that failed
+        fail_at[0] = None
+        del batches[:]
+        migrator.recorder.flush()
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual([batch[0] for batch in batches], [21, 31, 41])
+        self.assertEqual(self.get_doubles(), [i * 2 for i in range(1, self.rows + 1)])
+        self.assertEqual(DataMigrationCheckpoint.objects.count(), 0)
+        # Backwards runs the reverse function
+        migrator.execute_plan(migrator.calculate_plan("datatest", "0001"))
+        self.assertEqual(self.get_doubles(), [None] * self.rows)
+
+    def test_partitions(self):
+        "Tests that the table is split between workers"
+        loader = self.get_test_loader(batch_size=10, workers=3)
+        migrator = Migrator(loader)
+        self.fill(migrator)
+        action = loader.get_migration("datatest", "0002_double").actions[0]
+        state = loader.action_states(loader.get_migration("datatest", "0002_double"))[0][2]
+        model = state.get_model("datatest", "Number").render(state)
+        self.assertEqual(
+            [(c.last_pk, c.end_pk) for c in action.checkpoints(model, "datatest.double", "default")],
+            [(None, "15"), ("15", "30"), ("30", None)],
+        )
+        # An in-memory database can't be shared with worker processes, so
+        # the parts run here, one after the other
+        self.assertFalse(action.can_fork("default"))
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual([batch[0] for batch in batches], [1, 11, 16, 26, 31, 41])
+        self.assertEqual(self.get_doubles(), [i * 2 for i in range(1, self.rows + 1)])
+
+    def test_transactions(self):
+        "Tests that data migrations run outside the migrator's transactions, and refuse to run inside others"
+        migrator = Migrator(self.get_test_loader(batch_size=10))
+        migrator.has_transactional_ddl = lambda database: True
+        self.fill(migrator)
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_doubles(), [i * 2 for i in range(1, self.rows + 1)])
+        with transaction.commit_on_success():
+            self.assertRaises(MigrationError, migrator.execute_plan, migrator.calculate_plan("datatest", "0001"))
+        self.assertEqual(self.get_doubles(), [i * 2 for i in range(1, self.rows + 1)])
+        self.assertRaises(MigrationError, migrator.compile_plan, migrator.calculate_plan("datatest", "0001"))
+
+    def test_write(self):
+        "Tests that data migrations can be written out if their functions are dotted paths"
+        action = RunBatches("datatest", "Number", "%s.double_values" % __name__, "double")
+        self.assertIn("    function = 'migrations.tests.data.double_values',", MigrationWriter([action]).as_string())
+        action.function = double_values
+        self.assertRaises(ValueError, MigrationWriter([action]).as_string)
@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import tempfile
+from django.utils import unittest
+from ..cache import MigrationCache
+from ..declarative import DeclarativeMigration
+from ..exceptions import MigrationError, ParsingError
+from ..loader import Loader
+from ..migration import Migration
+from ..registry import field_registry
+
+
+class DeclarativeTests(unittest.TestCase):
+    """
+    Tests declarative (JSON) migration files
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app_dirs = {}
+        for app_label in ["app1", "app2"]:
+            self.app_dirs[app_label] = os.path.join(self.directory, app_label)
+            os.mkdir(self.app_dirs[app_label])
+        self.write("app1", "0001_initial.migration.json", json.dumps({
+            "actions": [{
+                "action": "CreateModel",
+                "name": "Author",
+                "fields": [["name", ["django.db.models.fields.CharField", [], {"max_length": 100}]]],
+            }],
+        }))
+        self.write("app1", "0002_yob.migration.py", "\n".join([
+            "from migrations.api import *",
+            "class Migration(BaseMigration):",
+            "    dependencies = [('app2', '0001_initial')]",
+            "    actions = [CreateField('Author', 'yob', Field('django.db.models.fields.IntegerField', [], {'null': True}))]",
+        ]))
+        self.write("app2", "0001_initial.migration.json", json.dumps({
+            "dependencies": [["app1", "0001_initial"]],
+            "actions": [{
+                "action": "CreateModel",
+                "name": "Book",
+                "fields": [["author", ["django.db.models.fields.related.ForeignKey", ["app1.Author"], {}]]],
+                "options": {"ordering": ["id"]},
+            }],
+        }))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, app_label, filename, source):
+        with open(os.path.join(self.app_dirs[app_label], filename), "w") as fh:
+            fh.write(source)
+
+    def get_loader(self, cache=None):
+        loader = Loader(self.app_dirs, cache=cache)
+        loader.load_all()
+        loader.calculate_dependencies()
+        return loader
+
+    def test_mixed(self):
+        "Tests that declarative and Python migrations load and depend on each other"
+        loader = self.get_loader()
+        initial = loader.get_migration("app1", "0001_initial")
+        self.assertTrue(isinstance(initial, DeclarativeMigration))
+        self.assertEqual(initial.action_names, ["CreateModel"])
+        self.assertEqual(
+            loader.plan([loader.get_top_migration("app1")], set()),
+            [
+                (True, Migration("app1", "0001_initial")),
+                (True, Migration("app2", "0001_initial")),
+                (True, Migration("app1", "0002_yob")),
+            ],
+        )
+        book = loader.get_migration("app2", "0001_initial").actions[0]
+        self.assertEqual([name for name, field in book.fields], ["id", "author"])
+        self.assertEqual(book.options, {"ordering": ["id"]})
+        project_state = loader.action_states(loader.get_migration("app1", "0002_yob"))[-1][2]
+        model = project_state.get_model("app2", "Book").render(project_state)
+        self.assertEqual(model._meta.get_field("author").rel.to._meta.object_name, "Author")
+        self.assertIn("django.db.models.fields.related.ForeignKey", field_registry.classes)
+
+    def test_cached(self):
+        "Tests that declarative migrations load from the compiled migration cache"
+        cache = MigrationCache(os.path.join(self.directory, "cache"))
+        self.get_loader(cache)
+        loader = self.get_loader(cache)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(loader.get_migration("app2", "0001_initial").dependencies, [("app1", "0001_initial")])
+        self.assertEqual(loader.get_migration("app2", "0001_initial").actions[0].model_name, "Book")
+
+    def test_errors(self):
+        "Tests that malformed files are reported"
+        self.write("app1", "0003_broken.migration.json", "{\"actions\": [")
+        self.assertRaises(ParsingError, self.get_loader)
+        self.write("app1", "0003_broken.migration.json", "{\"actions\": [{\"action\": \"Explode\"}]}")
+        loader = self.get_loader()
+        self.assertRaises(ParsingError, lambda: loader.get_migration("app1", "0003_broken").actions)
+
+    def test_untrusted(self):
+        "Tests that fields can't name anything but field classes"
+        self.write("app1", "0003_evil.migration.json", json.dumps({
+            "actions": [{
+                "action": "CreateField",
+                "model_name": "Author",
+                "name": "evil",
+                "field": ["os.system", ["touch %s" % os.path.join(self.directory, "owned")], {}],
+            }],
+        }))
+        loader = self.get_loader()
+        project_state = loader.action_states(loader.get_migration("app1", "0003_evil"))[-1][2]
+        self.assertRaises(MigrationError, project_state.get_model("app1", "Author").render, project_state)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "owned")))
+        # Nor can they run functions over rows
+        self.write("app1", "0003_evil.migration.json", json.dumps({
+            "actions": [{
+                "action": "RunBatches",
+                "model_name": "Author",
+                "function": "os.system",
+                "name": "evil",
+            }],
+        }))
+        loader = self.get_loader()
+        self.assertRaises(ParsingError, lambda: loader.get_migration("app1", "0003_evil").actions)
@@ -1,6 +1,6 @@
 from django.utils import unittest
 from ..exceptions import CircularDependency
-from ..dependencies import depends, flatten
+from ..dependencies import depends, depends_all, flatten
 
 
 class DependencyTests(unittest.TestCase):
@@ -69,3 +69,38 @@ class DependencyTests(unittest.TestCase):
             CircularDependency,
             depends, target, lambda x: links.get(x, []),
         )
+
+    def test_depends_all(self):
+        "Tests that several targets share one walk and one result"
+        links = {4: [3], 3: [2, 11], 2: [1], 12: [11, 3]}
+        self.assertEqual(
+            depends_all([4, 12], lambda x: links.get(x, [])),
+            [1, 2, 11, 3, 4, 12],
+        )
+        # Nodes already seen should be skipped
+        seen = set([2])
+        self.assertEqual(
+            depends_all([4], lambda x: links.get(x, []), seen),
+            [11, 3, 4],
+        )
+        self.assertEqual(seen, set([2, 3, 4, 11]))
+
+    def test_depends_large(self):
+        "Tests that shared ancestry isn't re-walked on big, dense graphs"
+        # A ladder of two chains, every rung linked to both nodes of the
+        # previous one; walking every path would take 2**1000 steps.
+        links = {}
+        for i in range(1, 1000):
+            links[("a", i)] = [("a", i - 1), ("b", i - 1)]
+            links[("b", i)] = [("a", i - 1), ("b", i - 1)]
+        calls = []
+        def get_children(x):
+            calls.append(x)
+            return links.get(x, [])
+        result = depends(("a", 999), get_children)
+        self.assertEqual(len(result), 1999)
+        self.assertEqual(result[-1], ("a", 999))
+        self.assertEqual(len(calls), len(set(calls)))
+        # Deep chains shouldn't run out of stack either
+        chain = dict((i, [i - 1]) for i in range(1, 10000))
+        self.assertEqual(depends(9999, lambda x: chain.get(x, [])), range(10000))
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.db import connections, models
+from django.utils import unittest
+from ..actions import CreateModel, CreateField
+from ..fanout import FanOut
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..models import AppliedMigration
+
+
+class CountingMigrator(Migrator):
+    "Migrator that counts how many times it works out action states"
+
+    def __init__(self, *args, **kwargs):
+        super(CountingMigrator, self).__init__(*args, **kwargs)
+        self.entries_made = 0
+
+    def plan_entries(self, plan):
+        self.entries_made += 1
+        return super(CountingMigrator, self).plan_entries(plan)
+
+
+class FanOutTests(unittest.TestCase):
+    """
+    Tests migrating many databases at once
+    """
+
+    tenants = ["tenant%i" % i for i in range(6)]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for alias in self.tenants:
+            connections.databases[alias] = {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(self.directory, "%s.db" % alias),
+            }
+            call_command("syncdb", database=alias, interactive=False, verbosity=0)
+
+    def tearDown(self):
+        for alias in self.tenants:
+            connections[alias].close()
+            del connections.databases[alias]
+            if hasattr(connections._connections, alias):
+                delattr(connections._connections, alias)
+        shutil.rmtree(self.directory)
+
+    def get_test_loader(self):
+        "Creates a loader with a model and two migrations adding columns to it"
+        loader = Loader({})
+        loader.add_migration(RootMigration("fanouttest"))
+        for name, actions in [
+            ("0001_initial", [CreateModel("fanouttest", "Tenant", [("name", models.CharField(max_length=10))], [])]),
+            ("0002_email", [CreateField("fanouttest", "Tenant", "email", models.CharField(max_length=50, null=True))]),
+            ("0003_age", [CreateField("fanouttest", "Tenant", "age", models.IntegerField(null=True))]),
+        ]:
+            migration = Migration("fanouttest", name)
+            migration.dependencies = []
+            migration.actions = actions
+            loader.add_migration(migration)
+        loader.calculate_dependencies()
+        return loader
+
+    def get_columns(self, alias):
+        cursor = connections[alias].cursor()
+        return sorted(row[0] for row in connections[alias].introspection.get_table_description(cursor, "fanouttest_tenant"))
+
+    def test_fan_out(self):
+        "Tests that databases in the same state share a plan, and failures stay with their database"
+        migrator = CountingMigrator(self.get_test_loader())
+        for alias in self.tenants[:2]:
+            migrator.execute_plan(migrator.calculate_plan("fanouttest", "0002"), alias)
+        # The last tenant has something in the way
+        connections["tenant5"].cursor().execute("CREATE TABLE fanouttest_tenant (id integer)")
+        migrator.entries_made = 0
+        fanout = FanOut(migrator, workers=3)
+        plans = fanout.plans(self.tenants)
+        self.assertEqual([group for plan, entries, group in plans], [self.tenants[:2], self.tenants[2:]])
+        self.assertEqual([len(plan) for plan, entries, group in plans], [1, 3])
+        self.assertEqual(migrator.entries_made, 2)
+        results = fanout.run_plans(plans)
+        self.assertEqual(results.keys(), self.tenants)
+        self.assertEqual(fanout.failed(), ["tenant5"])
+        for alias in self.tenants[:5]:
+            self.assertEqual(self.get_columns(alias), ["age", "email", "id", "name"])
+            self.assertEqual(AppliedMigration.objects.using(alias).count(), 3)
+        self.assertEqual(AppliedMigration.objects.using("tenant5").count(), 0)
+        # Running again only has the failed one to do
+        connections["tenant5"].cursor().execute("DROP TABLE fanouttest_tenant")
+        migrator.recorder.flush()
+        results = fanout.run(self.tenants)
+        self.assertEqual(fanout.failed(), [])
+        self.assertEqual(self.get_columns("tenant5"), ["age", "email", "id", "name"])
@@ -0,0 +1,60 @@
+import os
+import json
+from django.utils import unittest
+from ..graph import graph_data, to_json, to_dot
+from ..loader import Loader
+from ..migration import Migration, parse_header
+
+
+class GraphTests(unittest.TestCase):
+    """
+    Tests graph and plan export
+    """
+
+    def get_test_loader(self):
+        "Creates a loader for the tests"
+        loader = Loader({
+            "app1": os.path.join(os.path.dirname(__file__), "loader_files", "app1"),
+            "app2": os.path.join(os.path.dirname(__file__), "loader_files", "app2"),
+        })
+        loader.load_all()
+        loader.calculate_dependencies()
+        return loader
+
+    def test_header_actions(self):
+        "Tests that action names are read from headers where they're literal"
+        self.assertEqual(
+            parse_header("class Migration(BaseMigration):\n    actions = [CreateModel(name='A'), DeleteField('A', 'b')]\n", "x"),
+            {"dependencies": [], "replaces": [], "actions": ["CreateModel", "DeleteField"]},
+        )
+        self.assertEqual(
+            parse_header("class Migration(BaseMigration):\n    actions = make_actions()\n", "x")["actions"],
+            None,
+        )
+
+    def test_graph(self):
+        "Tests the exported graph, and that nothing is loaded to make it"
+        loader = self.get_test_loader()
+        applied = set([Migration("app2", "0001_initial")])
+        plan = loader.plan([loader.get_top_migration("app1")], applied)
+        data = graph_data(loader, plan, applied)
+        self.assertFalse(any(
+            m.loaded
+            for migrations in loader.migrations.values()
+            for m in migrations.values()
+            if not m.is_root
+        ))
+        nodes = dict((node["id"], node) for node in data["nodes"])
+        self.assertEqual(sorted(nodes), ["app1:0001_initial", "app1:0002_yob", "app2:0001_initial"])
+        self.assertEqual(nodes["app1:0002_yob"]["actions"], ["CreateField"])
+        self.assertEqual(nodes["app1:0002_yob"]["estimated_statements"], 1)
+        self.assertEqual(nodes["app1:0002_yob"]["planned"], "forwards")
+        self.assertTrue(nodes["app2:0001_initial"]["applied"])
+        self.assertEqual(nodes["app2:0001_initial"]["planned"], None)
+        self.assertEqual(
+            sorted(data["edges"]),
+            [["app1:0002_yob", "app1:0001_initial"], ["app1:0002_yob", "app2:0001_initial"]],
+        )
+        self.assertEqual([entry["migration"] for entry in data["plan"]], ["app1:0001_initial", "app1:0002_yob"])
+        self.assertEqual(json.loads(to_json(data)), data)
+        self.assertIn('"app1:0002_yob" -> "app2:0001_initial";', to_dot(data))
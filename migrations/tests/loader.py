@@ -253,3 +253,107 @@ class LoaderTests(unittest.TestCase):
             [x for x, y in action_states[-1][2].models["app1", "Author"].fields],
             ["id", "name", "yob"],
         )
+
+    def test_plan_states_forwards(self):
+        "Tests that plan_action_states carries state through a forwards plan"
+        loader = self.get_test_loader()
+        plan = loader.plan([loader.get_migration("app1", "0002_yob")], [])
+        result = list(loader.plan_action_states(plan))
+        self.assertEqual(
+            [(forwards, migration) for forwards, migration, action_states in result],
+            plan,
+        )
+        # The last migration should see both apps' models before it starts
+        action_states = result[-1][2]
+        self.assertEqual(
+            sorted(action_states[0][1].models.keys()),
+            [("app1", "Author"), ("app2", "Book")],
+        )
+        # And should match what action_states() works out from scratch
+        fresh_loader = self.get_test_loader()
+        fresh_states = fresh_loader.action_states(fresh_loader.get_migration("app1", "0002_yob"))
+        self.assertEqual(
+            [x for x, y in action_states[-1][2].models["app1", "Author"].fields],
+            [x for x, y in fresh_states[-1][2].models["app1", "Author"].fields],
+        )
+
+    def test_plan_states_backwards(self):
+        "Tests that plan_action_states reverses states for backwards plans"
+        loader = self.get_test_loader()
+        plan = loader.plan(
+            [Migration("app1", "0000_root")],
+            [
+                Migration("app1", "0001_initial"),
+                Migration("app1", "0002_yob"),
+                Migration("app2", "0001_initial"),
+            ],
+        )
+        result = list(loader.plan_action_states(plan))
+        self.assertEqual(
+            [(forwards, migration) for forwards, migration, action_states in result],
+            plan,
+        )
+        # Undoing the initial migration should go from having Author to not
+        action, from_state, to_state = result[-1][2][0]
+        self.assertIn(("app1", "Author"), from_state.models)
+        self.assertNotIn(("app1", "Author"), to_state.models)
+
+    def test_lazy_load(self):
+        "Tests that actions are only loaded for migrations that need them"
+        loader = self.get_test_loader()
+        loader.plan([loader.get_migration("app1", "0002_yob")], [])
+        self.assertFalse(any(
+            migration.loaded
+            for migrations in loader.migrations.values()
+            for migration in migrations.values()
+            if not migration.is_root
+        ))
+        # Building the state for app2's initial migration only needs itself
+        loader.action_states(loader.get_migration("app2", "0001_initial"))
+        self.assertTrue(loader.get_migration("app2", "0001_initial").loaded)
+        self.assertFalse(loader.get_migration("app1", "0001_initial").loaded)
+        self.assertFalse(loader.get_migration("app1", "0002_yob").loaded)
+
+    def test_state_independent(self):
+        "Tests that the from and to states of an action don't share changes"
+        loader = self.get_test_loader()
+        action_states = loader.action_states(loader.get_migration("app1", "0002_yob"))
+        action, from_state, to_state = action_states[0]
+        self.assertEqual(
+            [x for x, y in from_state.models["app1", "Author"].fields],
+            ["id", "name"],
+        )
+        self.assertEqual(
+            [x for x, y in to_state.models["app1", "Author"].fields],
+            ["id", "name", "yob"],
+        )
+
+    def test_index(self):
+        "Tests that the per-app index follows migrations added at runtime"
+        loader = self.get_test_loader()
+        self.assertEqual(
+            loader.get_index("app1")[0],
+            ["0000_root", "0001_initial", "0002_yob"],
+        )
+        migration = Migration("app1", "0003_dod")
+        migration.dependencies = []
+        loader.add_migration(migration)
+        self.assertEqual(loader.get_top_migration("app1"), migration)
+        self.assertEqual(loader.get_migration_by_prefix("app1", "0003"), migration)
+        # Changing the dict directly should cause a rebuild
+        del loader.migrations["app1"]["0003_dod"]
+        self.assertEqual(loader.get_top_migration("app1"), Migration("app1", "0002_yob"))
+        # Even if the number of migrations stays the same
+        del loader.migrations["app1"]["0002_yob"]
+        loader.migrations["app1"]["0002_dob"] = Migration("app1", "0002_dob")
+        self.assertEqual(loader.get_top_migration("app1"), Migration("app1", "0002_dob"))
+        loader.migrations["app1"] = dict(loader.migrations["app1"])
+        loader.migrations["app1"].pop("0002_dob")
+        loader.migrations["app1"]["0002_yob"] = Migration("app1", "0002_yob")
+        self.assertEqual(loader.get_top_migration("app1"), Migration("app1", "0002_yob"))
+
+    def test_prefix_errors(self):
+        "Tests that prefix lookup errors mention the prefix"
+        loader = self.get_test_loader()
+        self.assertRaisesRegexp(NonexistentMigration, "app1:0003", loader.get_migration_by_prefix, "app1", "0003")
+        self.assertRaisesRegexp(AmbiguousMigration, r"app1:000 \(", loader.get_migration_by_prefix, "app1", "000")
@@ -0,0 +1,145 @@
+import time
+import threading
+from django.test import TestCase
+from ..actions.base import Action
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..models import AppliedMigration
+
+
+class SleepAction(Action):
+    "Test action that takes a little while and tracks how many run at once"
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def alter_state(self, project_state):
+        pass
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        with self.lock:
+            SleepAction.running += 1
+            SleepAction.max_running = max(SleepAction.max_running, SleepAction.running)
+        time.sleep(0.05)
+        with self.lock:
+            SleepAction.running -= 1
+
+
+class LoggingMigrator(Migrator):
+    "Migrator that notes down when each migration starts and ends"
+
+    def __init__(self, *args, **kwargs):
+        super(LoggingMigrator, self).__init__(*args, **kwargs)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def log_migration_start(self, migration, forwards):
+        with self.lock:
+            self.events.append(("start", migration))
+
+    def log_migration_end(self, migration, forwards):
+        with self.lock:
+            self.events.append(("end", migration))
+
+
+class MigratorTests(TestCase):
+    """
+    Tests migration execution
+    """
+
+    def get_test_loader(self):
+        """
+        Creates a loader with three independent apps of two migrations
+        each, plus one app that depends on two of them.
+        """
+        loader = Loader({})
+        links = {
+            "a": [],
+            "b": [],
+            "c": [],
+            "d": [("a", "0002_second"), ("b", "0001_first")],
+        }
+        for app_label, dependencies in sorted(links.items()):
+            loader.add_migration(RootMigration(app_label))
+            for name in ["0001_first", "0002_second"]:
+                migration = Migration(app_label, name)
+                migration.dependencies = dependencies if name == "0001_first" else []
+                migration.actions = [SleepAction()]
+                loader.add_migration(migration)
+        loader.calculate_dependencies()
+        return loader
+
+    def check_order(self, loader, events, forwards=True):
+        "Checks that nothing started before what it had to wait for ended"
+        position = dict((event, i) for i, event in enumerate(events))
+        for event, migration in events:
+            if event == "start":
+                if forwards:
+                    linked = loader.get_forward_dependencies(migration)
+                else:
+                    linked = loader.get_backwards_dependencies(migration)
+                for other in linked:
+                    if ("end", other) in position:
+                        self.assertLess(position[("end", other)], position[("start", migration)])
+
+    def test_parallel(self):
+        "Tests that parallel execution respects dependencies and matches serial"
+        results = []
+        for workers in [1, 4]:
+            SleepAction.max_running = 0
+            loader = self.get_test_loader()
+            migrator = LoggingMigrator(loader, workers=workers)
+            plan = migrator.calculate_plan()
+            self.assertEqual(len(plan), 8)
+            migrator.execute_plan(plan)
+            self.check_order(loader, migrator.events)
+            results.append((
+                set(AppliedMigration.objects.values_list("app_label", "name")),
+                migrator.recorder.applied_migrations(),
+            ))
+            if workers > 1:
+                self.assertGreater(SleepAction.max_running, 1)
+            else:
+                self.assertEqual(SleepAction.max_running, 1)
+            # And backwards
+            migrator.events = []
+            plan = migrator.calculate_plan("a", "0000")
+            self.assertEqual(len(plan), 4)
+            migrator.execute_plan(plan)
+            self.check_order(loader, migrator.events, forwards=False)
+            results.append(set(AppliedMigration.objects.values_list("app_label", "name")))
+            AppliedMigration.objects.all().delete()
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[1], results[3])
+        self.assertEqual(len(results[0][0]), 8)
+
+    def test_parallel_failure(self):
+        "Tests that a failure stops new work but records what finished"
+        loader = self.get_test_loader()
+        class FailingAction(SleepAction):
+            def alter_database(self, *args):
+                raise ValueError("Failed")
+        loader.get_migration("a", "0002_second").actions = [FailingAction()]
+        migrator = Migrator(loader, workers=4)
+        self.assertRaises(ValueError, migrator.execute_plan, migrator.calculate_plan())
+        applied = set(AppliedMigration.objects.values_list("app_label", "name"))
+        self.assertIn(("a", "0001_first"), applied)
+        self.assertNotIn(("a", "0002_second"), applied)
+        self.assertNotIn(("d", "0001_first"), applied)
+        self.assertEqual(applied, set((m.app_label, m.name) for m in migrator.recorder.applied_migrations()))
+
+    def test_transactional_failure(self):
+        "Tests that a batch that's rolled back doesn't leave its records queued"
+        loader = self.get_test_loader()
+        class FailingAction(SleepAction):
+            def alter_database(self, *args):
+                raise ValueError("Failed")
+        loader.get_migration("a", "0002_second").actions = [FailingAction()]
+        migrator = Migrator(loader, batch_size=None)
+        migrator.has_transactional_ddl = lambda database: True
+        self.assertRaises(ValueError, migrator.execute_plan, migrator.calculate_plan("a"))
+        self.assertEqual(migrator.recorder.queued.get("default"), None)
+        migrator.recorder.flush_records()
+        self.assertFalse(AppliedMigration.objects.exists())
@@ -0,0 +1,197 @@
+from django.db import connection, models, IntegrityError
+from django.test import TransactionTestCase
+from ..actions import CreateModel, CreateField, DeleteField, AlterModelOption
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..online import OnlineSchemaChanger
+
+
+class WritingChanger(OnlineSchemaChanger):
+    "OnlineSchemaChanger that writes to the table while it's being copied"
+
+    def __init__(self, *args, **kwargs):
+        super(WritingChanger, self).__init__(*args, **kwargs)
+        self.chunks = []
+
+    def chunk_done(self, editor, table, start, end):
+        self.chunks.append((start, end))
+        if len(self.chunks) == 1:
+            cursor = connection.cursor()
+            # One row the copy hasn't reached yet, one it has, and a new one
+            cursor.execute("UPDATE onlinetest_reader SET name = 'changed' WHERE id = 900")
+            cursor.execute("DELETE FROM onlinetest_reader WHERE id = 2")
+            cursor.execute("INSERT INTO onlinetest_reader (name, age) VALUES ('new', 1)")
+
+
+class OnlineTests(TransactionTestCase):
+    """
+    Tests online schema changes
+    """
+
+    rows = 1000
+
+    def get_test_loader(self, options={}):
+        "Creates a loader with a model, then migrations changing its columns"
+        loader = Loader({})
+        loader.add_migration(RootMigration("onlinetest"))
+        for name, actions in [
+            ("0001_initial", [CreateModel("onlinetest", "Reader", [
+                ("name", models.CharField(max_length=10)),
+                ("age", models.IntegerField(null=True)),
+            ], [], options)]),
+            ("0002_columns", [
+                CreateField("onlinetest", "Reader", "active", models.BooleanField(default=True)),
+                DeleteField("onlinetest", "Reader", "age"),
+            ]),
+            ("0003_unique", [AlterModelOption("onlinetest", "Reader", "unique_together", [("name", "active")])]),
+        ]:
+            migration = Migration("onlinetest", name)
+            migration.dependencies = []
+            migration.actions = actions
+            loader.add_migration(migration)
+        loader.calculate_dependencies()
+        return loader
+
+    def get_columns(self):
+        cursor = connection.cursor()
+        if "onlinetest_reader" not in connection.introspection.table_names(cursor):
+            return None
+        return sorted(row[0] for row in connection.introspection.get_table_description(cursor, "onlinetest_reader"))
+
+    def test_online(self):
+        "Tests that tables are rebuilt with their rows, including ones written during the copy"
+        changer = WritingChanger(chunk_size=300)
+        migrator = Migrator(self.get_test_loader(), batch_size=None, online=changer)
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0001"))
+        cursor = connection.cursor()
+        cursor.executemany(
+            "INSERT INTO onlinetest_reader (name, age) VALUES (%s, %s)",
+            [("r%i" % i, i) for i in range(self.rows)],
+        )
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["active", "id", "name"])
+        # Each migration is run and recorded by itself, so 0002 and 0003
+        # rebuild the table once each
+        self.assertEqual(changer.chunks, [
+            (1, 301), (301, 601), (601, 901), (901, 1001),
+            (1, 301), (301, 601), (601, 901), (901, 1002),
+        ])
+        cursor.execute("SELECT COUNT(*), MIN(active) FROM onlinetest_reader")
+        self.assertEqual(cursor.fetchone(), (self.rows, 1))
+        cursor.execute("SELECT name FROM onlinetest_reader WHERE id IN (2, 900, 1001) ORDER BY id")
+        self.assertEqual([row[0] for row in cursor.fetchall()], ["changed", "new"])
+        # The shadow table and triggers are gone, and new rows still get ids
+        self.assertEqual(
+            [name for name in connection.introspection.table_names(cursor) if name.startswith("onlinetest")],
+            ["onlinetest_reader"],
+        )
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        cursor.execute("INSERT INTO onlinetest_reader (name, active) VALUES ('last', 1)")
+        cursor.execute("SELECT MAX(id) FROM onlinetest_reader")
+        self.assertEqual(cursor.fetchone()[0], 1002)
+        # Backwards, the dropped column comes back empty
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0001"))
+        self.assertEqual(self.get_columns(), ["age", "id", "name"])
+        cursor.execute("SELECT COUNT(*), COUNT(age) FROM onlinetest_reader")
+        self.assertEqual(cursor.fetchone(), (self.rows + 1, 0))
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_offline(self):
+        "Tests that without online changes, SQLite tables are rebuilt straight away for unique_together"
+        migrator = Migrator(self.get_test_loader(), batch_size=None)
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["active", "id", "name"])
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO onlinetest_reader (name, active) VALUES ('same', 1)")
+        self.assertRaises(
+            IntegrityError,
+            cursor.execute,
+            "INSERT INTO onlinetest_reader (name, active) VALUES ('same', 1)",
+        )
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_compile(self):
+        "Tests that online changes compile to a single copy per table"
+        migrator = Migrator(self.get_test_loader(), batch_size=None, online=OnlineSchemaChanger())
+        statements = migrator.compile_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), None)
+        self.assertEqual(len([sql for sql in statements if sql.startswith("CREATE TRIGGER")]), 3)
+        self.assertEqual(len([sql for sql in statements if sql.startswith("INSERT INTO \"onlinetest_reader__shadow\"")]), 1)
+        self.assertIn('ALTER TABLE "onlinetest_reader__shadow" RENAME TO "onlinetest_reader";', statements)
+        self.assertEqual(statements[statements.index("BEGIN;") + 1], "PRAGMA legacy_alter_table = ON;")
+
+    def test_failed_rebuild(self):
+        "Tests that a rebuild that fails leaves no shadow table or triggers behind"
+        migrator = Migrator(self.get_test_loader(), batch_size=None, online=OnlineSchemaChanger())
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0002"))
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO onlinetest_reader (name, active) VALUES (%s, 1)", [("same",), ("same",)])
+        self.assertRaises(IntegrityError, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(
+            [name for name in connection.introspection.table_names(cursor) if name.startswith("onlinetest")],
+            ["onlinetest_reader"],
+        )
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        cursor.execute("INSERT INTO onlinetest_reader (name, active) VALUES ('same', 1)")
+        cursor.execute("SELECT COUNT(*) FROM onlinetest_reader")
+        self.assertEqual(cursor.fetchone()[0], 3)
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_unsupported_vendor(self):
+        "Tests that online changes are refused before anything runs on unsupported databases"
+        changer = OnlineSchemaChanger()
+        changer.vendors = ["postgresql"]
+        migrator = Migrator(self.get_test_loader(), batch_size=None, online=changer)
+        self.assertRaises(NotImplementedError, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), None)
+
+    def test_index_together(self):
+        "Tests that rebuilt tables keep their multi-column indexes"
+        migrator = Migrator(
+            self.get_test_loader({"index_together": [("name", "id")]}),
+            batch_size = None,
+            online = OnlineSchemaChanger(),
+        )
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0002"))
+        self.assertEqual(self.get_columns(), ["active", "id", "name"])
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'onlinetest_reader'")
+        self.assertEqual(len([sql for sql, in cursor.fetchall() if '("name", "id")' in sql]), 1)
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_rebuild_twice(self):
+        "Tests that a rebuilt table's indexes get its name, so it can be rebuilt again"
+        loader = Loader({})
+        loader.add_migration(RootMigration("onlinetest"))
+        for name, action in [
+            ("0001_initial", CreateModel("onlinetest", "Reader", [
+                ("name", models.CharField(max_length=10, db_index=True)),
+                ("email", models.CharField(max_length=50, unique=True)),
+            ], [], {"index_together": [("name", "email")]})),
+            ("0002_age", CreateField("onlinetest", "Reader", "age", models.IntegerField(null=True))),
+            ("0003_active", CreateField("onlinetest", "Reader", "active", models.BooleanField(default=True))),
+        ]:
+            migration = Migration("onlinetest", name)
+            migration.dependencies = []
+            migration.actions = [action]
+            loader.add_migration(migration)
+        loader.calculate_dependencies()
+        migrator = Migrator(loader, online=OnlineSchemaChanger())
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(self.get_columns(), ["active", "age", "email", "id", "name"])
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'onlinetest_reader'")
+        names = [name for name, in cursor.fetchall()]
+        self.assertEqual(len(names), 3)
+        self.assertEqual([name for name in names if "shadow" in name], [])
+        indexes = connection.introspection.get_indexes(cursor, "onlinetest_reader")
+        self.assertEqual((indexes["name"]["unique"], indexes["email"]["unique"]), (False, True))
+        migrator.execute_plan(migrator.calculate_plan("onlinetest", "0000"))
+        self.assertEqual(self.get_columns(), None)
@@ -0,0 +1,143 @@
+import os
+from django.db import models
+from django.utils import unittest
+from ..actions import CreateModel, DeleteModel, AlterModelOption, CreateField, DeleteField
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..optimizer import Optimizer
+
+
+class OptimizerTests(unittest.TestCase):
+    """
+    Tests the plan optimizer
+    """
+
+    def optimize(self, actions):
+        "Optimizes a list of actions, returning the resulting actions"
+        entries = [("migration", action, None, None) for action in actions]
+        return [action for migration, action, from_state, to_state in Optimizer().optimize(entries)]
+
+    def create_model(self, name, fields=None):
+        return CreateModel("app0", name, fields or [("id", models.AutoField(primary_key=True))], [])
+
+    def test_fold_into_create_model(self):
+        "Tests that field and option changes fold into CreateModel"
+        result = self.optimize([
+            self.create_model("Author"),
+            CreateField("app0", "Author", "name", models.CharField(max_length=100)),
+            AlterModelOption("app0", "Author", "ordering", ["name"]),
+            CreateField("app0", "Author", "yob", models.IntegerField()),
+            DeleteField("app0", "Author", "name"),
+        ])
+        self.assertEqual(len(result), 1)
+        self.assertEqual([name for name, field in result[0].fields], ["id", "yob"])
+        self.assertEqual(result[0].options, {"ordering": ["name"]})
+
+    def test_related_targets(self):
+        "Tests that related fields don't fold into a CreateModel from before their target exists"
+        result = self.optimize([
+            self.create_model("Author"),
+            self.create_model("Book"),
+            CreateField("app0", "Author", "favourite", models.ForeignKey("app0.Book")),
+        ])
+        self.assertEqual(len(result), 3)
+        # Across apps, the tables must still be created in order, and the
+        # whole plan is one batch
+        loader = Loader({})
+        for app_label, name, dependencies, action in [
+            ("oa", "0001_initial", [], CreateModel("oa", "Author", [("id", models.AutoField(primary_key=True))], [])),
+            ("ob", "0001_initial", [("oa", "0001_initial")], CreateModel("ob", "Book", [("id", models.AutoField(primary_key=True))], [])),
+            ("oa", "0002_fav", [("ob", "0001_initial")], CreateField("oa", "Author", "fav", models.ForeignKey("ob.Book", null=True))),
+        ]:
+            if app_label not in loader.migrations:
+                loader.add_migration(RootMigration(app_label))
+            migration = Migration(app_label, name)
+            migration.dependencies = dependencies
+            migration.actions = [action]
+            loader.add_migration(migration)
+        loader.calculate_dependencies()
+        migrator = Migrator(loader, optimize=True)
+        statements = migrator.compile_plan(migrator.calculate_plan(), transactions=True)
+        self.assertEqual(
+            [sql.split()[0] for sql in statements],
+            ["BEGIN;", "CREATE", "CREATE", "ALTER", "CREATE"] + ["INSERT"] * 3 + ["COMMIT;"],
+        )
+        self.assertIn('"oa_author"', statements[1])
+        self.assertIn('"ob_book"', statements[2])
+        # A later DeleteField can't fold into the CreateModel past the
+        # related field that couldn't
+        result = self.optimize([
+            self.create_model("Author", [("f1", models.IntegerField())]),
+            self.create_model("Book"),
+            CreateField("app0", "Author", "favourite", models.ForeignKey("app0.Book")),
+            DeleteField("app0", "Author", "f1"),
+        ])
+        self.assertEqual(len(result), 4)
+        migration = Migration("oa", "0003_f1")
+        migration.dependencies = []
+        migration.actions = [DeleteField("oa", "Author", "f1")]
+        loader.migrations["oa"]["0001_initial"].actions = [
+            CreateModel("oa", "Author", [("f1", models.IntegerField())], []),
+        ]
+        loader.add_migration(migration)
+        loader.calculate_dependencies()
+        migrator = Migrator(loader, optimize=True)
+        statements = migrator.compile_plan(migrator.calculate_plan(), transactions=True)
+        self.assertEqual(len([sql for sql in statements if '"fav_id"' in sql and sql.startswith("ALTER")]), 1)
+        self.assertNotIn('"fav_id"', statements[1])
+        self.assertIn('"ob_book"', statements[2])
+
+    def test_cancel_fields(self):
+        "Tests that creating then deleting a field cancels out"
+        result = self.optimize([
+            CreateField("app0", "Author", "name", models.CharField(max_length=100)),
+            CreateField("app0", "Author", "yob", models.IntegerField()),
+            DeleteField("app0", "Author", "name"),
+        ])
+        self.assertEqual([action.name for action in result], ["yob"])
+
+    def test_cancel_models(self):
+        "Tests that creating then deleting a model cancels out, unless it's referred to"
+        result = self.optimize([
+            self.create_model("Author"),
+            AlterModelOption("app0", "Author", "ordering", ["id"]),
+            self.create_model("Book"),
+            DeleteModel("app0", "Author"),
+        ])
+        self.assertEqual([action.model_name for action in result], ["Book"])
+        result = self.optimize([
+            self.create_model("Author"),
+            self.create_model("Book", [("author", models.ForeignKey("app0.Author"))]),
+            DeleteModel("app0", "Author"),
+        ])
+        self.assertEqual(len(result), 3)
+
+    def test_collapse_options(self):
+        "Tests that consecutive changes to one option collapse"
+        result = self.optimize([
+            AlterModelOption("app0", "Author", "ordering", ["id"]),
+            AlterModelOption("app0", "Author", "ordering", ["name"]),
+            AlterModelOption("app0", "Book", "ordering", ["id"]),
+        ])
+        self.assertEqual([(a.model_name, a.value) for a in result], [("Author", ["name"]), ("Book", ["id"])])
+
+    def test_optimize_plan(self):
+        "Tests optimizing a real plan keeps every migration but fewer actions"
+        loader = Loader({
+            "app1": os.path.join(os.path.dirname(__file__), "loader_files", "app1"),
+            "app2": os.path.join(os.path.dirname(__file__), "loader_files", "app2"),
+        })
+        loader.load_all()
+        loader.calculate_dependencies()
+        plan = loader.plan([loader.get_migration("app1", "0002_yob")], [])
+        optimizer = Optimizer()
+        result = optimizer.optimize_plan(list(loader.plan_action_states(plan)))
+        self.assertEqual([(f, m) for f, m, action_states in result], plan)
+        self.assertEqual([len(action_states) for f, m, action_states in result], [1, 1, 0])
+        self.assertEqual((optimizer.before, optimizer.after), (3, 2))
+        # The folded CreateModel should render with the later field
+        action, from_state, to_state = result[1][2][0]
+        self.assertEqual([name for name, field in action.fields], ["id", "name", "yob"])
+        self.assertEqual([name for name, field in to_state.models["app1", "Author"].fields], ["id", "name", "yob"])
+        self.assertEqual(optimizer.report(), "Optimized 3 actions down to 2.")
@@ -0,0 +1,144 @@
+import os
+import sys
+from StringIO import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from ..loader import Loader
+from ..migration import Migration
+from ..migrator import Migrator
+from ..models import AppliedMigration, GraphFingerprint
+from ..recorder import MigrationRecorder
+
+
+class RecorderTests(TestCase):
+    """
+    Tests the applied migration recorder
+    """
+
+    def get_test_loader(self):
+        "Creates a loader for the tests"
+        loader = Loader({
+            "app1": os.path.join(os.path.dirname(__file__), "loader_files", "app1"),
+            "app2": os.path.join(os.path.dirname(__file__), "loader_files", "app2"),
+        })
+        loader.load_all()
+        loader.calculate_dependencies()
+        return loader
+
+    def test_applied(self):
+        "Tests that the applied set is read once and mapped to loaded migrations"
+        loader = self.get_test_loader()
+        AppliedMigration.objects.create(app_label="app2", name="0001_initial", applied=timezone.now())
+        AppliedMigration.objects.create(app_label="app3", name="0001_gone", applied=timezone.now())
+        recorder = MigrationRecorder(loader)
+        with self.assertNumQueries(1):
+            applied = recorder.applied_migrations()
+            self.assertEqual(applied, recorder.applied_migrations())
+        self.assertEqual(applied, set([Migration("app2", "0001_initial"), Migration("app3", "0001_gone")]))
+        self.assertTrue(
+            [m for m in applied if m.app_label == "app2"][0] is loader.get_migration("app2", "0001_initial"),
+        )
+
+    def test_record(self):
+        "Tests that recording updates both the table and the cached set"
+        loader = self.get_test_loader()
+        recorder = MigrationRecorder(loader)
+        migration = loader.get_migration("app1", "0001_initial")
+        recorder.applied_migrations()
+        with self.assertNumQueries(1):
+            recorder.record_applied(migration)
+        self.assertEqual(recorder.applied_migrations(), set([migration]))
+        self.assertEqual(
+            list(AppliedMigration.objects.values_list("app_label", "name")),
+            [("app1", "0001_initial")],
+        )
+        recorder.record_unapplied(migration)
+        self.assertEqual(recorder.applied_migrations(), set())
+        self.assertEqual(AppliedMigration.objects.count(), 0)
+
+    def test_fingerprint(self):
+        "Tests the graph fingerprint, and that unapplying anything removes the stored one"
+        loader = self.get_test_loader()
+        fingerprint = loader.graph_fingerprint()
+        self.assertEqual(fingerprint, self.get_test_loader().graph_fingerprint())
+        migration = loader.get_migration("app1", "0002_yob")
+        migration.dependencies = migration.dependencies + [("app2", "0002_new")]
+        self.assertNotEqual(loader.graph_fingerprint(), fingerprint)
+        recorder = MigrationRecorder(loader)
+        self.assertEqual(recorder.stored_fingerprint(), None)
+        recorder.record_fingerprint(fingerprint)
+        with self.assertNumQueries(1):
+            self.assertEqual(recorder.stored_fingerprint(), fingerprint)
+        # Applying things leaves it be; unapplying anything removes it
+        recorder.record_applied(migration)
+        self.assertEqual(recorder.stored_fingerprint(), fingerprint)
+        recorder.record_unapplied(migration)
+        self.assertEqual(recorder.stored_fingerprint(), None)
+        self.assertIn('DELETE FROM "migrations_graphfingerprint";', recorder.record_sql(migration, False))
+
+    def test_fingerprint_fast_path(self):
+        "Tests that migrate stops after one query when the stored fingerprint matches"
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            call_command("migrate", use_cache=False)
+            self.assertEqual(GraphFingerprint.objects.count(), 1)
+            with self.assertNumQueries(1):
+                call_command("migrate", use_cache=False)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(output.splitlines(), ["No migrations required."] * 2)
+
+    def test_command_errors(self):
+        "Tests that the commands report migration errors as a message, rather than a traceback"
+        for command in ["migrate", "showplan"]:
+            stderr, sys.stderr = sys.stderr, StringIO()
+            try:
+                self.assertRaises(SystemExit, call_command, command, "nonexistent", use_cache=False)
+                output = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            self.assertTrue(output.startswith("Error: "))
+
+    def test_calculate_plan(self):
+        "Tests that the migrator plans against the recorded migrations"
+        loader = self.get_test_loader()
+        AppliedMigration.objects.create(app_label="app2", name="0001_initial", applied=timezone.now())
+        migrator = Migrator(loader)
+        self.assertEqual(
+            migrator.calculate_plan("app1"),
+            [
+                (True, Migration("app1", "0001_initial")),
+                (True, Migration("app1", "0002_yob")),
+            ],
+        )
+
+    def test_batched_execution(self):
+        "Tests that records are written in batches of the right size"
+        for batch_size, queries in [(1, 3), (2, 2), (None, 1)]:
+            # Only the records are of interest here, not the schema changes
+            loader = self.get_test_loader()
+            for migrations in loader.migrations.values():
+                for migration in migrations.values():
+                    migration.actions = []
+            migrator = Migrator(loader, batch_size=batch_size)
+            # Without transactional DDL, each migration is recorded by itself
+            migrator.has_transactional_ddl = lambda database: True
+            plan = migrator.calculate_plan()
+            with self.assertNumQueries(queries):
+                migrator.execute_plan(plan)
+            self.assertEqual(AppliedMigration.objects.count(), 3)
+            self.assertEqual(len(migrator.recorder.applied_migrations()), 3)
+            # Undoing app2 (and app1's migration on top of it) should be one
+            # delete, plus removing the graph fingerprint
+            migrator.batch_size = None
+            plan = migrator.calculate_plan("app2", "0000")
+            self.assertEqual(len(plan), 2)
+            with self.assertNumQueries(2):
+                migrator.execute_plan(plan)
+            self.assertEqual(
+                list(AppliedMigration.objects.values_list("app_label", "name")),
+                [("app1", "0001_initial")],
+            )
+            AppliedMigration.objects.all().delete()
@@ -0,0 +1,73 @@
+import sys
+import cPickle as pickle
+from django.db import models
+from django.utils import unittest
+from ..api import Field
+from ..exceptions import MigrationError
+from ..registry import FieldRegistry, DeferredField
+from ..state import ProjectState, ModelState, RenderCache, related_model_key
+from ..writer import MigrationWriter
+
+
+class RegistryTests(unittest.TestCase):
+    """
+    Tests field class resolution and deferred fields
+    """
+
+    def test_resolve(self):
+        "Tests paths, aliases and registered classes"
+        registry = FieldRegistry()
+        self.assertTrue(registry.resolve("django.db.models.fields.CharField") is models.CharField)
+        registry.register("text", "django.db.models.fields.TextField")
+        self.assertTrue(registry.resolve("text") is models.TextField)
+        registry.register("number", models.IntegerField)
+        self.assertTrue(registry.resolve("number") is models.IntegerField)
+        field = DeferredField("number", [], {"null": True}, registry=registry)
+        self.assertTrue(isinstance(field.construct(), models.IntegerField))
+        # Only field classes can be resolved
+        self.assertRaises(MigrationError, registry.resolve, "os.system")
+        self.assertRaises(MigrationError, registry.resolve, "django.db.models.Model")
+        self.assertRaises(MigrationError, registry.resolve, "nonexistent.Field")
+        field = DeferredField("os.system", ["true"], {}, registry=registry)
+        self.assertRaises(MigrationError, field.construct)
+
+    def test_unimported_modules(self):
+        "Tests that paths outside the allowed modules are rejected without being imported"
+        registry = FieldRegistry()
+        self.assertFalse("migrations.tests.registry_files.fields" in sys.modules)
+        self.assertRaises(MigrationError, registry.resolve, "migrations.tests.registry_files.fields.SideEffectField")
+        self.assertFalse("migrations.tests.registry_files.fields" in sys.modules)
+        self.assertFalse("migrations.tests.registry_files" in sys.modules)
+        # Unless the module is allowed, or registered under an alias
+        registry.register("side", "migrations.tests.registry_files.fields.SideEffectField")
+        self.assertTrue(issubclass(registry.resolve("side"), models.IntegerField))
+        registry = FieldRegistry()
+        registry.allow_module("migrations.tests.registry_files")
+        self.assertTrue(issubclass(
+            registry.resolve("migrations.tests.registry_files.fields.SideEffectField"),
+            models.IntegerField,
+        ))
+
+    def test_deferred(self):
+        "Tests that fields are only constructed when a model is rendered"
+        name = Field("django.db.models.fields.CharField", [], {"max_length": 100})
+        author = Field("django.db.models.fields.related.ForeignKey", ["app1.Author"], {})
+        self.assertEqual(related_model_key("app2", author), ("app1", "Author"))
+        self.assertEqual(related_model_key("app2", name), None)
+        # Fingerprinting and copying states doesn't need the fields
+        project_state = ProjectState()
+        project_state.add_model(ModelState(project_state, "app1", "Author", [("name", name)]))
+        project_state.add_model(ModelState(project_state, "app2", "Book", [("author", author)]))
+        project_state.get_model("app1", "Author").fingerprint()
+        pickle.loads(pickle.dumps(project_state.copy(), pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((name._field, author._field), (None, None))
+        # Rendering does
+        model = project_state.get_model("app2", "Book").render(cache=RenderCache())
+        self.assertEqual(model._meta.get_field("author").rel.to._meta.object_name, "Author")
+        self.assertTrue(isinstance(author._field, models.ForeignKey))
+        self.assertEqual(author.null, False)
+        # And the definition can still be written back out
+        self.assertEqual(
+            MigrationWriter([]).serialize_field(author),
+            "Field('django.db.models.fields.related.ForeignKey', ['app1.Author'], {})",
+        )
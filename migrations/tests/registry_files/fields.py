@@ -0,0 +1,6 @@
+from django.db import models
+
+
+class SideEffectField(models.IntegerField):
+    "Field in a module the registry mustn't import unless it's allowed to"
+    pass
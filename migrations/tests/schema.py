@@ -0,0 +1,223 @@
+import json
+from django.db import connection, models, IntegrityError
+from django.test import TransactionTestCase
+from ..actions import CreateModel, CreateField, AlterModelOption
+from ..actions.base import Action
+from ..loader import Loader
+from ..migration import Migration, RootMigration
+from ..migrator import Migrator
+from ..models import AppliedMigration
+
+
+class EditorMigrator(Migrator):
+    "Migrator that keeps hold of the SchemaEditors it makes"
+
+    def __init__(self, *args, **kwargs):
+        super(EditorMigrator, self).__init__(*args, **kwargs)
+        self.editors = []
+
+    def schema_editor(self, database, **kwargs):
+        editor = super(EditorMigrator, self).schema_editor(database, **kwargs)
+        self.editors.append(editor)
+        return editor
+
+    def executed(self):
+        return [sql for editor in self.editors for sql, params in editor.executed]
+
+
+class FailingAction(Action):
+    "Action that fails when it's run"
+
+    def alter_state(self, project_state):
+        pass
+
+    def alter_database(self, from_state, to_state, editor, forwards):
+        raise ValueError("Failed")
+
+
+class SchemaTests(TransactionTestCase):
+    """
+    Tests the schema editor
+    """
+
+    def get_test_loader(self):
+        "Creates a loader with a model and three migrations adding columns to it"
+        loader = Loader({})
+        loader.add_migration(RootMigration("schematest"))
+        initial = Migration("schematest", "0001_initial")
+        initial.dependencies = []
+        initial.actions = [CreateModel("schematest", "Reader", [("name", models.CharField(max_length=10))], [])]
+        loader.add_migration(initial)
+        for i, (name, field) in enumerate([
+            ("email", models.CharField(max_length=50, blank=True)),
+            ("age", models.IntegerField(null=True)),
+            ("active", models.BooleanField(default=True)),
+        ]):
+            migration = Migration("schematest", "%04i_%s" % (i + 2, name))
+            migration.dependencies = []
+            migration.actions = [CreateField("schematest", "Reader", name, field)]
+            loader.add_migration(migration)
+        loader.calculate_dependencies()
+        return loader
+
+    def get_columns(self):
+        cursor = connection.cursor()
+        if "schematest_reader" not in connection.introspection.table_names(cursor):
+            return None
+        return [row[0] for row in connection.introspection.get_table_description(cursor, "schematest_reader")]
+
+    def test_columns(self):
+        "Tests that columns are added in one batch and removed again"
+        migrator = EditorMigrator(self.get_test_loader(), batch_size=None)
+        migrator.execute_plan(migrator.calculate_plan())
+        self.assertEqual(sorted(self.get_columns()), ["active", "age", "email", "id", "name"])
+        executed = migrator.executed()
+        self.assertEqual(len([sql for sql in executed if sql.startswith("ALTER TABLE")]), 3)
+        # Undoing it all should drop the columns and then the table
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_combined_alters(self):
+        "Tests that buffered changes to one table become one ALTER TABLE where possible"
+        loader = self.get_test_loader()
+        migrator = Migrator(loader)
+        entries = list(migrator.plan_entries(migrator.calculate_plan()))
+        for combine_alters, statements in [(True, 1), (False, 3)]:
+            editor = migrator.schema_editor("default")
+            editor.combine_alters = combine_alters
+            for forwards, migration, action_states in entries[1:]:
+                for action, from_state, to_state in action_states:
+                    action.alter_database(from_state, to_state, editor, forwards)
+            self.assertEqual(len(editor.alter_statements("schematest_reader")), statements)
+            self.assertEqual(editor.executed, [])
+
+    def test_rename_table(self):
+        "Tests that changing db_table renames the table, after its buffered changes"
+        loader = self.get_test_loader()
+        rename = Migration("schematest", "0005_rename")
+        rename.dependencies = []
+        rename.actions = [AlterModelOption("schematest", "Reader", "db_table", "schematest_member")]
+        loader.add_migration(rename)
+        loader.calculate_dependencies()
+        migrator = Migrator(loader, batch_size=None)
+        migrator.execute_plan(migrator.calculate_plan())
+        cursor = connection.cursor()
+        tables = connection.introspection.table_names(cursor)
+        self.assertIn("schematest_member", tables)
+        self.assertNotIn("schematest_reader", tables)
+        self.assertEqual(
+            sorted(row[0] for row in connection.introspection.get_table_description(cursor, "schematest_member")),
+            ["active", "age", "email", "id", "name"],
+        )
+        # Backwards, it's renamed back before the columns are dropped
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0001"))
+        self.assertEqual(sorted(self.get_columns()), ["id", "name"])
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_failed_flush(self):
+        "Tests that a migration whose buffered changes fail isn't recorded"
+        loader = self.get_test_loader()
+        migrator = Migrator(loader)
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0001"))
+        connection.cursor().execute("INSERT INTO schematest_reader (name) VALUES ('one')")
+        # A NOT NULL column with no default can't be added to a table with rows
+        loader.get_migration("schematest", "0002_email").actions = [
+            CreateField("schematest", "Reader", "best_friend", models.ForeignKey("schematest.Reader")),
+        ]
+        self.assertRaises(Exception, migrator.execute_plan, migrator.calculate_plan("schematest", "0002"))
+        self.assertEqual(sorted(self.get_columns()), ["id", "name"])
+        self.assertFalse(AppliedMigration.objects.filter(name="0002_email").exists())
+        migrator.recorder.flush()
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_failed_batch(self):
+        "Tests that without transactional DDL, the migrations before a failure in a batch are recorded"
+        loader = self.get_test_loader()
+        loader.get_migration("schematest", "0003_age").actions.append(FailingAction())
+        migrator = Migrator(loader, batch_size=None)
+        migrator.has_transactional_ddl = lambda database: False
+        self.assertRaises(ValueError, migrator.execute_plan, migrator.calculate_plan())
+        self.assertEqual(sorted(self.get_columns()), ["email", "id", "name"])
+        self.assertEqual(
+            sorted(AppliedMigration.objects.values_list("name", flat=True)),
+            ["0001_initial", "0002_email"],
+        )
+        migrator.recorder.flush()
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
+        self.assertEqual(self.get_columns(), None)
+
+    def test_table_options(self):
+        "Tests that unique_together, index_together and db_tablespace change the table, optimized or not"
+        for optimize in [False, True]:
+            loader = Loader({})
+            loader.add_migration(RootMigration("schematest"))
+            for name, action in [
+                ("0001_initial", CreateModel("schematest", "Reader", [
+                    ("name", models.CharField(max_length=10)),
+                    ("email", models.CharField(max_length=50)),
+                ], [])),
+                ("0002_unique", AlterModelOption("schematest", "Reader", "unique_together", [("name", "email")])),
+                ("0003_index", AlterModelOption("schematest", "Reader", "index_together", [("email", "name")])),
+                ("0004_tablespace", AlterModelOption("schematest", "Reader", "db_tablespace", "fast")),
+            ]:
+                migration = Migration("schematest", name)
+                migration.dependencies = []
+                migration.actions = [action]
+                loader.add_migration(migration)
+            loader.calculate_dependencies()
+            migrator = Migrator(loader, optimize=optimize)
+            migrator.execute_plan(migrator.calculate_plan())
+            cursor = connection.cursor()
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'schematest_reader'")
+            self.assertEqual(len([sql for sql, in cursor.fetchall() if sql and '("email", "name")' in sql]), 1)
+            cursor.execute("INSERT INTO schematest_reader (name, email) VALUES ('a', 'b')")
+            self.assertRaises(
+                IntegrityError,
+                cursor.execute,
+                "INSERT INTO schematest_reader (name, email) VALUES ('a', 'b')",
+            )
+            # Backwards, the index and the constraint go again
+            migrator.execute_plan(migrator.calculate_plan("schematest", "0001"))
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = 'schematest_reader'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute("INSERT INTO schematest_reader (name, email) VALUES ('a', 'b')")
+            migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
+            self.assertEqual(self.get_columns(), None)
+
+    def test_compile(self):
+        "Tests that plans compile to SQL without touching the database"
+        migrator = Migrator(self.get_test_loader())
+        plan = migrator.calculate_plan()
+        with self.assertNumQueries(0):
+            statements = migrator.compile_plan(plan, transactions=True)
+        self.assertEqual(self.get_columns(), None)
+        self.assertEqual(AppliedMigration.objects.count(), 0)
+        self.assertEqual(statements.count("BEGIN;"), 4)
+        self.assertEqual(statements[-1], "COMMIT;")
+        self.assertTrue(statements[1].startswith("CREATE TABLE"))
+        self.assertTrue(statements[-3].startswith("ALTER TABLE"))
+        self.assertTrue(statements[-2].startswith("INSERT INTO"))
+        self.assertIn("'0004_active'", statements[-2])
+        # Without transactions, the batches are as for execute_plan
+        migrator.batch_size = None
+        statements = migrator.compile_plan(plan)
+        self.assertEqual([sql.split()[0] for sql in statements], ["CREATE"] + ["ALTER"] * 3 + ["INSERT"] * 4)
+
+    def test_profile(self):
+        "Tests that profiling attributes statements to actions and flushes"
+        migrator = Migrator(self.get_test_loader(), batch_size=None, profile=True)
+        migrator.has_transactional_ddl = lambda database: True
+        migrator.execute_plan(migrator.calculate_plan())
+        profiler = migrator.profiler
+        self.assertEqual(len(profiler.migrations), 4)
+        self.assertEqual([record["statements"] for record in profiler.actions], [1, 0, 0, 0])
+        self.assertEqual([record["statements"] for record in profiler.flushes], [3])
+        self.assertEqual(profiler.totals()["statements"], 4)
+        self.assertEqual(len(profiler.state_times), 4)
+        summary = profiler.summary()
+        self.assertEqual(len(summary), 6)
+        self.assertTrue(any("schematest:0001_initial: Create model schematest.Reader" in line for line in summary))
+        json.dumps(profiler.report())
+        migrator.execute_plan(migrator.calculate_plan("schematest", "0000"))
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+from django.utils import unittest
+from ..loader import Loader
+from ..snapshots import SnapshotStore
+
+
+class SnapshotTests(unittest.TestCase):
+    """
+    Tests saving and starting from ProjectState snapshots
+    """
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def get_test_loader(self, snapshot_interval=0, namespace=""):
+        "Creates a loader with a snapshot store for the tests"
+        loader = Loader(
+            {
+                "app1": os.path.join(os.path.dirname(__file__), "loader_files", "app1"),
+                "app2": os.path.join(os.path.dirname(__file__), "loader_files", "app2"),
+            },
+            snapshots = SnapshotStore(self.snapshot_dir, namespace),
+            snapshot_interval = snapshot_interval,
+        )
+        loader.load_all()
+        loader.calculate_dependencies()
+        return loader
+
+    def test_start_from_snapshot(self):
+        "Tests that state building starts from an ancestor's snapshot"
+        loader = self.get_test_loader()
+        self.assertTrue(loader.save_snapshot(loader.get_migration("app1", "0001_initial")))
+        loader = self.get_test_loader()
+        action_states = loader.action_states(loader.get_migration("app1", "0002_yob"))
+        # The snapshotted migration should never have been loaded
+        self.assertFalse(loader.get_migration("app1", "0001_initial").loaded)
+        self.assertTrue(loader.get_migration("app2", "0001_initial").loaded)
+        self.assertEqual(
+            sorted(action_states[0][1].models.keys()),
+            [("app1", "Author"), ("app2", "Book")],
+        )
+        self.assertEqual(
+            [x for x, y in action_states[-1][2].models["app1", "Author"].fields],
+            ["id", "name", "yob"],
+        )
+
+    def test_stale_snapshot(self):
+        "Tests that a snapshot is ignored once an upstream file changes"
+        loader = self.get_test_loader()
+        loader.save_snapshot(loader.get_migration("app1", "0001_initial"))
+        loader = self.get_test_loader()
+        loader.get_migration("app1", "0001_initial").source_hash = "changed"
+        loader.action_states(loader.get_migration("app1", "0002_yob"))
+        self.assertTrue(loader.get_migration("app1", "0001_initial").loaded)
+
+    def test_auto_snapshot(self):
+        "Tests that snapshots are saved automatically on the interval"
+        loader = self.get_test_loader(snapshot_interval=2)
+        list(loader.plan_action_states(
+            loader.plan([loader.get_migration("app1", "0002_yob")], []),
+        ))
+        self.assertTrue(loader.snapshots.has_snapshot(loader.get_migration("app1", "0002_yob")))
+        self.assertFalse(loader.snapshots.has_snapshot(loader.get_migration("app1", "0001_initial")))
+
+    def test_namespaces(self):
+        "Tests that snapshots are kept apart by namespace, and need a private directory"
+        loader = self.get_test_loader(namespace="one")
+        loader.save_snapshot(loader.get_migration("app1", "0001_initial"))
+        self.assertTrue(loader.snapshots.has_snapshot(loader.get_migration("app1", "0001_initial")))
+        loader = self.get_test_loader(namespace="two")
+        self.assertFalse(loader.snapshots.has_snapshot(loader.get_migration("app1", "0001_initial")))
+        os.chmod(self.snapshot_dir, 0777)
+        loader = self.get_test_loader(namespace="one")
+        self.assertFalse(loader.snapshots.has_snapshot(loader.get_migration("app1", "0001_initial")))
+        self.assertFalse(loader.save_snapshot(loader.get_migration("app1", "0001_initial")))
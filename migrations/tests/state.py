@@ -1,6 +1,7 @@
 from django.utils import unittest
 from django.db import models
-from ..state import ProjectState, ModelState
+from django.db.models.loading import get_model
+from ..state import ProjectState, ModelState, RenderCache
 
 
 class StateTests(unittest.TestCase):
@@ -26,3 +27,111 @@ class StateTests(unittest.TestCase):
         self.assertEqual(model._meta.app_label, "app0")
         self.assertEqual(len(model._meta.fields), 3)
         self.assertEqual(model._meta.fields[1].max_length, 255)
+
+    def test_copy_on_write(self):
+        "Tests that copies share untouched models but change independently"
+        project_state = ProjectState()
+        for name in ["Author", "Book"]:
+            project_state.add_model(ModelState(
+                project_state = project_state,
+                app_label = "app0",
+                name = name,
+                fields = [("id", models.AutoField(primary_key=True))],
+                options = {"ordering": ["id"]},
+            ))
+        from_state = project_state.copy()
+        project_state.mutate_model("app0", "Author").fields.append(("name", models.CharField(max_length=100)))
+        project_state.mutate_model("app0", "Author").options["ordering"] = ["name"]
+        to_state = project_state.copy()
+        # The change must only be visible in the later state
+        self.assertEqual([n for n, f in from_state.models["app0", "Author"].fields], ["id"])
+        self.assertEqual([n for n, f in to_state.models["app0", "Author"].fields], ["id", "name"])
+        self.assertEqual(from_state.models["app0", "Author"].options, {"ordering": ["id"]})
+        # Untouched models should be shared, not copied
+        self.assertTrue(from_state.get_model("app0", "Book") is to_state.get_model("app0", "Book"))
+        # Removals shouldn't leak backwards either
+        project_state.remove_model("app0", "Book")
+        self.assertEqual(project_state.models.keys(), [("app0", "Author")])
+        self.assertIn(("app0", "Book"), to_state.models)
+        self.assertRaises(KeyError, project_state.get_model, "app0", "Book")
+        # The models dict can't be changed behind the state's back
+        self.assertRaises(TypeError, project_state.models.__setitem__, ("app0", "Book"), None)
+        self.assertRaises(TypeError, project_state.models.pop, ("app0", "Author"))
+
+    def test_copied_back_references(self):
+        "Tests that shared models default to rendering against a state with the contents they were shared with"
+        project_state = ProjectState()
+        for name, fields in [
+            ("Author", [("id", models.AutoField(primary_key=True))]),
+            ("Book", [("id", models.AutoField(primary_key=True)), ("author", models.ForeignKey("Author"))]),
+        ]:
+            project_state.add_model(ModelState(project_state, "app0", name, fields))
+        book = project_state.get_model("app0", "Book")
+        copied = project_state.copy()
+        # Later changes to the original state don't reach its old models
+        project_state.remove_model("app0", "Author")
+        self.assertIn(("app0", "Author"), book.project_state.models)
+        self.assertTrue(book.project_state.get_model("app0", "Author") is copied.get_model("app0", "Author"))
+        self.assertEqual(book.render()._meta.get_field("author").rel.to._meta.object_name, "Author")
+        self.assertRaises(TypeError, book.project_state.remove_model, "app0", "Author")
+
+    def test_deep_copies(self):
+        "Tests that long chains of copies stay correct once flattened"
+        project_state = ProjectState()
+        states = []
+        for i in range(ProjectState.max_depth * 3):
+            project_state.add_model(ModelState(project_state, "app0", "Model%i" % i))
+            states.append(project_state.copy())
+        self.assertEqual(len(states[-1].models), ProjectState.max_depth * 3)
+        self.assertEqual(len(states[4].models), 5)
+        self.assertEqual(states[-1].get_model("app0", "Model0").name, "Model0")
+
+    def test_render_cache(self):
+        "Tests that identical states reuse one rendered model"
+        cache = RenderCache()
+        project_state = ProjectState()
+        project_state.add_model(ModelState(
+            project_state = project_state,
+            app_label = "app0",
+            name = "CachedAuthor",
+            fields = [
+                ("id", models.AutoField(primary_key=True)),
+                ("name", models.CharField(max_length=255)),
+            ],
+        ))
+        project_state.add_model(ModelState(
+            project_state = project_state,
+            app_label = "app0",
+            name = "CachedBook",
+            fields = [
+                ("id", models.AutoField(primary_key=True)),
+                ("author", models.ForeignKey("app0.CachedAuthor")),
+            ],
+        ))
+        author = project_state.get_model("app0", "CachedAuthor").render(project_state, cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertTrue(author is project_state.copy().get_model("app0", "CachedAuthor").render(cache=cache))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Relations should resolve to the cached related model
+        book = project_state.get_model("app0", "CachedBook").render(project_state, cache)
+        self.assertTrue(book._meta.get_field("author").rel.to is author)
+        # Nothing should have been left in Django's app cache
+        self.assertEqual(get_model("app0", "CachedAuthor", seed_cache=False, only_installed=False), None)
+        # A changed model must render afresh, as must things pointing to it
+        project_state.mutate_model("app0", "CachedAuthor").fields.append(("yob", models.IntegerField()))
+        new_author = project_state.get_model("app0", "CachedAuthor").render(project_state, cache)
+        self.assertFalse(new_author is author)
+        self.assertEqual(len(new_author._meta.fields), 3)
+        new_book = project_state.get_model("app0", "CachedBook").render(project_state, cache)
+        self.assertTrue(new_book._meta.get_field("author").rel.to is new_author)
+
+    def test_render_cache_bounded(self):
+        "Tests that the render cache evicts the least recently used model"
+        cache = RenderCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
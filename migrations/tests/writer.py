@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+from django.utils import timezone, unittest
+from ..loader import Loader
+from ..migration import Migration
+from ..migrator import Migrator
+from ..models import AppliedMigration
+from ..writer import squash_migrations
+from ..exceptions import CircularDependency
+
+
+APP1_MIGRATIONS = {
+    "0001_initial": """from migrations.api import *
+
+
+class Migration(BaseMigration):
+
+    actions = [
+        CreateModel(
+            name = "Author",
+            fields = [
+                ("name", Field("django.db.models.fields.CharField", [], {"max_length": 100})),
+            ],
+        ),
+    ]
+""",
+    "0002_yob": """from migrations.api import *
+
+
+class Migration(BaseMigration):
+
+    actions = [
+        CreateField(
+            model_name = "Author",
+            name = "yob",
+            field = Field("django.db.models.fields.IntegerField", [], {}),
+        ),
+    ]
+""",
+    "0003_ordering": """from migrations.api import *
+
+
+class Migration(BaseMigration):
+
+    actions = [
+        AlterModelOption(
+            model_name = "Author",
+            name = "ordering",
+            value = ["name"],
+        ),
+    ]
+""",
+}
+
+APP2_MIGRATIONS = {
+    "0001_initial": """from migrations.api import *
+
+
+class Migration(BaseMigration):
+
+    dependencies = [
+        ("app1", "0002_yob"),
+    ]
+
+    actions = [
+        CreateModel(
+            name = "Book",
+            fields = [
+                ("author", Field("django.db.models.fields.related.ForeignKey", ["app1.Author"], {})),
+            ],
+        ),
+    ]
+""",
+}
+
+
+class SquashTests(unittest.TestCase):
+    """
+    Tests writing out and using squashed migrations
+    """
+
+    def setUp(self):
+        self.app_dirs = {}
+        for app_label, files in [("app1", APP1_MIGRATIONS), ("app2", APP2_MIGRATIONS)]:
+            self.app_dirs[app_label] = tempfile.mkdtemp()
+            for name, source in files.items():
+                with open(os.path.join(self.app_dirs[app_label], name + ".migration.py"), "w") as fh:
+                    fh.write(source)
+
+    def tearDown(self):
+        for app_dir in self.app_dirs.values():
+            shutil.rmtree(app_dir)
+
+    def get_loader(self):
+        loader = Loader(self.app_dirs)
+        loader.load_all()
+        loader.calculate_dependencies()
+        return loader
+
+    def squash(self):
+        "Squashes app1's migrations and writes the result out"
+        loader = self.get_loader()
+        name, writer = squash_migrations(
+            loader,
+            "app1",
+            loader.get_migration("app1", "0001_initial"),
+            loader.get_migration("app1", "0003_ordering"),
+        )
+        with open(os.path.join(self.app_dirs["app1"], name + ".migration.py"), "w") as fh:
+            fh.write(writer.as_string())
+        return name
+
+    def test_squash(self):
+        "Tests the squashed migration's contents"
+        name = self.squash()
+        self.assertEqual(name, "0001_squashed_0003_ordering")
+        loader = self.get_loader()
+        squashed = loader.get_migration("app1", name)
+        self.assertEqual(
+            squashed.replaces,
+            [("app1", "0001_initial"), ("app1", "0002_yob"), ("app1", "0003_ordering")],
+        )
+        self.assertEqual(squashed.dependencies, [])
+        self.assertEqual(len(squashed.actions), 1)
+        self.assertEqual([n for n, f in squashed.actions[0].fields], ["id", "name", "yob"])
+        self.assertEqual(squashed.actions[0].options, {"ordering": ["name"]})
+
+    def test_plan_fresh(self):
+        "Tests that a fresh database uses the squashed migration"
+        name = self.squash()
+        loader = self.get_loader()
+        self.assertEqual(loader.get_top_migration("app1"), Migration("app1", name))
+        self.assertEqual(
+            loader.plan([loader.get_top_migration("app2")], set()),
+            [
+                (True, Migration("app1", name)),
+                (True, Migration("app2", "0001_initial")),
+            ],
+        )
+
+    def test_plan_partial(self):
+        "Tests that a partly-applied database uses the replaced migrations"
+        self.squash()
+        loader = self.get_loader()
+        applied = set([Migration("app1", "0001_initial")])
+        loader.calculate_dependencies(applied)
+        self.assertEqual(
+            loader.plan([loader.get_top_migration("app1")], applied),
+            [
+                (True, Migration("app1", "0002_yob")),
+                (True, Migration("app1", "0003_ordering")),
+            ],
+        )
+
+    def test_plan_applied(self):
+        "Tests that the squashed migration counts as applied if all it replaces is"
+        name = self.squash()
+        loader = self.get_loader()
+        applied = set(Migration("app1", n) for n in APP1_MIGRATIONS)
+        loader.calculate_dependencies(applied)
+        self.assertEqual(loader.plan([loader.get_migration("app1", name)], applied), [])
+
+    def test_record_applied(self):
+        "Tests that a squashed migration is recorded once all it replaces is applied"
+        name = self.squash()
+        for n in APP1_MIGRATIONS:
+            AppliedMigration.objects.create(app_label="app1", name=n, applied=timezone.now())
+        try:
+            migrator = Migrator(self.get_loader())
+            plan = migrator.calculate_plan("app1")
+            self.assertEqual(plan, [])
+            migrator.execute_plan(plan)
+            self.assertTrue(AppliedMigration.objects.filter(app_label="app1", name=name).exists())
+            # It stays applied once the replaced migrations are removed
+            for n in APP1_MIGRATIONS:
+                os.remove(os.path.join(self.app_dirs["app1"], n + ".migration.py"))
+            migrator = Migrator(self.get_loader())
+            self.assertEqual(migrator.calculate_plan("app1"), [])
+        finally:
+            AppliedMigration.objects.filter(app_label="app1").delete()
+
+    def test_circular(self):
+        "Tests that ranges other apps' migrations are in the middle of can't be squashed"
+        with open(os.path.join(self.app_dirs["app1"], "0004_book.migration.py"), "w") as fh:
+            fh.write(APP1_MIGRATIONS["0002_yob"].replace("yob", "book").replace(
+                "    actions",
+                "    dependencies = [\n        (\"app2\", \"0001_initial\"),\n    ]\n\n    actions",
+            ))
+        loader = self.get_loader()
+        self.assertRaises(
+            CircularDependency,
+            squash_migrations,
+            loader,
+            "app1",
+            loader.get_migration("app1", "0001_initial"),
+            loader.get_migration("app1", "0004_book"),
+        )
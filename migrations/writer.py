@@ -0,0 +1,143 @@
+"""
+Turns actions back into migration files, and squashes runs of an app's
+migrations into a single migration that replaces them.
+"""
+
+from django.db.models import AutoField
+from .actions import CreateModel, DeleteModel, AlterModelOption, AlterModelBases, CreateField, DeleteField, RunBatches
+from .exceptions import CircularDependency, MigrationError
+from .optimizer import Optimizer
+
+
+class MigrationWriter(object):
+    """
+    Writes out the source of a migration file, using the migrations API,
+    for a list of (rendered) actions and the migration's header.
+    """
+
+    def __init__(self, actions, dependencies=None, replaces=None):
+        self.actions = actions
+        self.dependencies = dependencies or []
+        self.replaces = replaces or []
+
+    def as_string(self):
+        "Returns the migration file's contents"
+        lines = [
+            "from migrations.api import *",
+            "",
+            "",
+            "class Migration(BaseMigration):",
+            "",
+        ]
+        for attribute, entries in [("replaces", self.replaces), ("dependencies", self.dependencies)]:
+            if entries:
+                lines.append("    %s = [" % attribute)
+                lines.extend("        %r," % (tuple(entry), ) for entry in entries)
+                lines.append("    ]")
+                lines.append("")
+        lines.append("    actions = [")
+        for action in self.actions:
+            lines.extend("        " + line for line in self.serialize_action(action))
+        lines.append("    ]")
+        return "\n".join(lines) + "\n"
+
+    def serialize_action(self, action):
+        "Returns the lines of API code that make the action"
+        if isinstance(action, CreateModel):
+            lines = [
+                "CreateModel(",
+                "    name = %r," % action.model_name,
+                "    fields = [",
+            ]
+            for name, field in action.fields:
+                if name == "id" and isinstance(field, AutoField) and not hasattr(field, "_migrations_definition"):
+                    # Added by CreateModel itself; it'll add it again
+                    continue
+                lines.append("        (%r, %s)," % (name, self.serialize_field(field)))
+            lines.append("    ],")
+            if list(action.bases) != ["django.db.models.base.Model"]:
+                lines.append("    bases = %r," % (list(action.bases), ))
+            if action.options:
+                lines.append("    options = %r," % (action.options, ))
+            lines.append("),")
+            return lines
+        elif isinstance(action, DeleteModel):
+            arguments = [("name", action.model_name)]
+        elif isinstance(action, AlterModelOption):
+            arguments = [("model_name", action.model_name), ("name", action.name), ("value", action.value)]
+        elif isinstance(action, AlterModelBases):
+            arguments = [("model_name", action.model_name), ("bases", action.value)]
+        elif isinstance(action, CreateField):
+            arguments = [("model_name", action.model_name), ("name", action.name)]
+            return [action.__class__.__name__ + "("] + \
+                ["    %s = %r," % argument for argument in arguments] + \
+                ["    field = %s," % self.serialize_field(action.instance), "),"]
+        elif isinstance(action, DeleteField):
+            arguments = [("model_name", action.model_name), ("name", action.name)]
+        elif isinstance(action, RunBatches):
+            for function in [action.function, action.reverse_function]:
+                if function is not None and not isinstance(function, basestring):
+                    raise ValueError("Cannot write out action %r, as its functions are not dotted paths" % action)
+            arguments = [
+                ("model_name", action.model_name),
+                ("function", action.function),
+                ("name", action.name),
+                ("reverse_function", action.reverse_function),
+                ("batch_size", action.batch_size),
+                ("sleep", action.sleep),
+                ("workers", action.workers),
+            ]
+        else:
+            raise ValueError("Cannot write out action %r" % action)
+        return [action.__class__.__name__ + "("] + \
+            ["    %s = %r," % argument for argument in arguments] + \
+            ["),"]
+
+    def serialize_field(self, field):
+        "Returns the API code that makes the field"
+        definition = getattr(field, "_migrations_definition", None)
+        if definition is None:
+            raise ValueError("Cannot write out field %r, as it was not made with Field()" % field)
+        return "Field(%r, %r, %r)" % definition
+
+
+def squash_migrations(loader, app_label, start, end):
+    """
+    Squashes the migrations of app_label from start to end (inclusive)
+    into one. The loader must have had its dependencies calculated.
+    Returns a (name, MigrationWriter) pair for the new migration, which
+    replaces the old ones; its actions are the old migrations' actions,
+    folded together by an Optimizer, and it depends on whatever the old
+    ones depended on in other apps.
+    """
+    migrations = [m for m in loader.get_index(app_label)[1] if m not in loader.removed]
+    if start not in migrations or end not in migrations or start.is_root:
+        raise MigrationError("Can only squash migrations that are in the graph (and not the root).")
+    squashed = migrations[migrations.index(start):migrations.index(end) + 1]
+    if not squashed:
+        raise MigrationError("%s comes after %s." % (start, end))
+    for migration in squashed:
+        if migration.replaces:
+            raise MigrationError("%s is already a squashed migration." % migration)
+    # Work out the latest migration we need from each other app
+    latest = {}
+    for migration in squashed:
+        for dependency in loader.get_forward_dependencies(migration):
+            if dependency.app_label == app_label:
+                continue
+            if any(m in squashed for m in loader.ancestors(dependency)):
+                raise CircularDependency("%s depends on %s, which depends on a migration being squashed." % (
+                    migration,
+                    dependency,
+                ))
+            if dependency.name > latest.get(dependency.app_label, ""):
+                latest[dependency.app_label] = dependency.name
+    # Fold all the actions together
+    entries = [(m, action, None, None) for m in squashed for action in m.actions]
+    actions = [action for _, action, _, _ in Optimizer().optimize(entries)]
+    name = "%s_squashed_%s" % (start.name.split("_", 1)[0], end.name)
+    return name, MigrationWriter(
+        actions,
+        dependencies = sorted(latest.items()),
+        replaces = [(m.app_label, m.name) for m in squashed],
+    )